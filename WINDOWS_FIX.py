@@ -15,6 +15,13 @@ import shutil
 def fix_timeout_optimization():
     """Corrige le fichier timeout_optimization.py pour Windows"""
     
+    # Les versions récentes utilisent une échéance coopérative (AnalysisDeadline), sans signal
+    if os.path.exists('timeout_optimization.py'):
+        with open('timeout_optimization.py', encoding='utf-8') as f:
+            if 'SIGALRM' not in f.read():
+                print("✅ timeout_optimization.py n'utilise plus SIGALRM - aucun correctif nécessaire")
+                return
+    
     timeout_fix = '''"""
 Optimisation pour éviter les timeouts sur gros documents
 Compatible Windows et Unix/Linux
@@ -4,13 +4,18 @@ Remplace l'algorithme Turnitin par une approche moderne basée sur l'apprentissa
 """
 
 import os
+import ast
+import json
 import logging
-import pickle
 import sqlite3
 import re
 from typing import Dict, List, Optional, Tuple
 from datetime import datetime
 
+from embedding_store import encode_embeddings, decode_embeddings, is_encoded
+from edit_distance import token_similarity, tokenize
+from text_segmentation import segment_document
+
 # Importations conditionnelles pour gérer les dépendances
 try:
     import joblib
@@ -39,10 +44,16 @@ except ImportError:
     SKLEARN_AVAILABLE = False
 
 try:
-    import Levenshtein
-    LEVENSHTEIN_AVAILABLE = True
+    from minhash_lsh import MinHashLSH, word_set, jaccard
+    MINHASH_AVAILABLE = True
+except ImportError:
+    MINHASH_AVAILABLE = False
+
+try:
+    from document_vectors import TfidfDocumentIndex
+    DOCUMENT_VECTORS_AVAILABLE = True
 except ImportError:
-    LEVENSHTEIN_AVAILABLE = False
+    DOCUMENT_VECTORS_AVAILABLE = False
 
 class AdvancedDetectionService:
     """Service de détection avancé avec Sentence-BERT et modèles d'IA"""
@@ -52,6 +63,8 @@ class AdvancedDetectionService:
         self.tfidf_vectorizer = None
         self.ai_detector_model = None
         self.ai_vectorizer = None
+        self.minhash_index = None
+        self.document_vectors = None
         self.local_db_path = "plagiarism_cache/local_documents.db"
         self.models_path = "plagiarism_cache/models"
         
@@ -99,7 +112,7 @@ class AdvancedDetectionService:
                     filename TEXT,
                     content TEXT,
                     sentences TEXT,  -- JSON des phrases
-                    embeddings BLOB,  -- Embeddings Sentence-BERT
+                    embeddings BLOB,  -- Embeddings Sentence-BERT (embedding_store)
                     tfidf_vector BLOB,  -- Vecteur TF-IDF
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
@@ -118,11 +131,42 @@ class AdvancedDetectionService:
             conn.commit()
             conn.close()
             
+            self._migrate_legacy_embeddings()
+            
+            if MINHASH_AVAILABLE:
+                self.minhash_index = MinHashLSH(self.local_db_path)
+                self.minhash_index.index_missing()
+            
+            if DOCUMENT_VECTORS_AVAILABLE and self.tfidf_vectorizer is not None:
+                # Même analyse, même IDF lissé et mêmes limites que tfidf_vectorizer
+                self.document_vectors = TfidfDocumentIndex(
+                    self.local_db_path, self.tfidf_vectorizer.build_analyzer(), smooth_idf=True, max_df=0.8,
+                    max_features=self.tfidf_vectorizer.max_features)
+                self.document_vectors.index_missing()
+                self.document_vectors.refresh_async()
+            
             logging.info("📁 Base de données locale configurée")
             
         except Exception as e:
             logging.error(f"Erreur setup DB: {e}")
     
+    def _migrate_legacy_embeddings(self):
+        """Ré-encode les embeddings enregistrés avec pickle (jamais désérialisés) au format embedding_store"""
+        conn = sqlite3.connect(self.local_db_path)
+        rows = conn.execute("SELECT id, sentences, embeddings FROM documents WHERE embeddings IS NOT NULL").fetchall()
+        legacy = [(doc_id, sentences) for doc_id, sentences, blob in rows if not is_encoded(blob)]
+        for doc_id, sentences in legacy:
+            stored_sentences = _load_sentences(sentences)
+            blob = None
+            if self.sentence_model and stored_sentences:
+                blob = encode_embeddings(self.sentence_model.encode(stored_sentences))
+            conn.execute("UPDATE documents SET sentences = ?, embeddings = ? WHERE id = ?",
+                         (json.dumps(stored_sentences), blob, doc_id))
+        conn.commit()
+        conn.close()
+        if legacy:
+            logging.info(f"📁 {len(legacy)} embeddings convertis au format binaire")
+    
     def _load_or_create_ai_detector(self):
         """Charge ou crée le modèle de détection IA"""
         model_path = os.path.join(self.models_path, "ai_detector.joblib")
@@ -258,11 +302,7 @@ class AdvancedDetectionService:
     
     def _split_into_sentences(self, text: str) -> List[str]:
         """Divise le texte en phrases"""
-        import re
-        # Regex améliorée pour diviser en phrases
-        sentences = re.split(r'[.!?]+', text)
-        sentences = [s.strip() for s in sentences if len(s.strip()) > 10]
-        return sentences
+        return segment_document(text).sentences(10)
     
     def _detect_similarity_with_bert(self, text: str, sentences: List[str]) -> Dict:
         """Détection de similarité avec Sentence-BERT (ou méthode alternative)"""
@@ -277,18 +317,17 @@ class AdvancedDetectionService:
             # Comparer avec les documents stockés
             conn = sqlite3.connect(self.local_db_path)
             cursor = conn.cursor()
-            cursor.execute("SELECT filename, sentences, embeddings FROM documents")
+            cursor.execute("SELECT filename, embeddings FROM documents")
             
             max_similarity = 0
             sources_found = 0
             
             for row in cursor.fetchall():
                 try:
-                    stored_filename, stored_sentences_json, stored_embeddings_blob = row
+                    stored_filename, stored_embeddings_blob = row
                     
-                    if stored_embeddings_blob and NUMPY_AVAILABLE and SKLEARN_AVAILABLE:
-                        stored_embeddings = pickle.loads(stored_embeddings_blob)
-                        stored_sentences = eval(stored_sentences_json)  # JSON simple
+                    if is_encoded(stored_embeddings_blob) and NUMPY_AVAILABLE and SKLEARN_AVAILABLE:
+                        stored_embeddings = decode_embeddings(stored_embeddings_blob)
                         
                         # Calculer similarité cosinus entre toutes les phrases
                         similarities = cosine_similarity(current_embeddings, stored_embeddings)
@@ -316,6 +355,9 @@ class AdvancedDetectionService:
     def _detect_similarity_fallback(self, text: str, sentences: List[str]) -> Dict:
         """Méthode de fallback pour la détection sans Sentence-BERT"""
         try:
+            if self.minhash_index:
+                return self._detect_similarity_minhash(text)
+            
             # Comparaison basique avec correspondance de mots-clés
             conn = sqlite3.connect(self.local_db_path)
             cursor = conn.cursor()
@@ -346,11 +388,37 @@ class AdvancedDetectionService:
             logging.error(f"Erreur fallback: {e}")
             return {'score': 0, 'sources_found': 0}
     
+    def _detect_similarity_minhash(self, text: str) -> Dict:
+        """Jaccard exact, calculé seulement pour les candidats des seaux LSH"""
+        candidates = [doc_id for doc_id, _ in self.minhash_index.query(text)]
+        if not candidates:
+            return {'score': 0, 'sources_found': 0}
+        
+        conn = sqlite3.connect(self.local_db_path)
+        placeholders = ','.join('?' * len(candidates))
+        rows = conn.execute(f"SELECT content FROM documents WHERE id IN ({placeholders})", candidates).fetchall()
+        conn.close()
+        
+        max_similarity = 0
+        sources_found = 0
+        text_words = word_set(text)
+        for (stored_text,) in rows:
+            similarity = jaccard(text_words, word_set(stored_text)) * 100
+            if similarity > 30:  # Seuil plus bas pour méthode basique
+                max_similarity = max(max_similarity, similarity)
+                sources_found += 1
+        
+        return {'score': max_similarity, 'sources_found': sources_found}
+    
     def _detect_similarity_with_tfidf(self, text: str) -> Dict:
         """Détection rapide avec TF-IDF (si disponible)"""
         try:
             if not SKLEARN_AVAILABLE or not self.tfidf_vectorizer:
                 return {'score': 0}
+            
+            if self.document_vectors is not None:
+                similarities = self.document_vectors.query(text)
+                return {'score': (similarities[0][1] if similarities else 0) * 100}
                 
             conn = sqlite3.connect(self.local_db_path)
             cursor = conn.cursor()
@@ -381,40 +449,35 @@ class AdvancedDetectionService:
             return {'score': 0}
     
     def _detect_exact_matches(self, text: str) -> Dict:
-        """Détection de correspondances exactes avec Levenshtein (ou méthode alternative)"""
+        """
+        Détection de correspondances exactes avec Levenshtein mot à mot (distance
+        bornée), limitée aux candidats des seaux LSH quand l'index MinHash existe
+        """
         try:
             conn = sqlite3.connect(self.local_db_path)
             cursor = conn.cursor()
-            cursor.execute("SELECT content FROM documents")
+            if self.minhash_index:
+                # Candidats LSH, du plus au moins similaire : la distance ne porte que sur des paires plausibles
+                candidates = [doc_id for doc_id, _ in self.minhash_index.query(text, limit=20)]
+                if not candidates:
+                    conn.close()
+                    return {'score': 0}
+                placeholders = ','.join('?' * len(candidates))
+                cursor.execute(f"SELECT content FROM documents WHERE id IN ({placeholders})", candidates)
+            else:
+                cursor.execute("SELECT content FROM documents")
             
+            tokens = tokenize(text)
             max_similarity = 0
             
             for row in cursor.fetchall():
                 stored_text = row[0]
+                if not stored_text:
+                    continue
                 
-                if LEVENSHTEIN_AVAILABLE:
-                    # Calculer distance Levenshtein
-                    distance = Levenshtein.distance(text.lower(), stored_text.lower())
-                    max_length = max(len(text), len(stored_text))
-                    
-                    if max_length > 0:
-                        similarity = (1 - distance / max_length) * 100
-                        max_similarity = max(max_similarity, similarity)
-                else:
-                    # Méthode alternative : pourcentage de correspondance de caractères
-                    text_lower = text.lower()
-                    stored_lower = stored_text.lower()
-                    
-                    # Compter les sous-chaînes communes
-                    common_chars = 0
-                    for i in range(min(len(text_lower), len(stored_lower))):
-                        if text_lower[i] == stored_lower[i]:
-                            common_chars += 1
-                    
-                    max_length = max(len(text), len(stored_text))
-                    if max_length > 0:
-                        similarity = (common_chars / max_length) * 100
-                        max_similarity = max(max_similarity, similarity)
+                # Le calcul s'arrête dès que le document ne peut plus dépasser le meilleur score
+                similarity = token_similarity(tokens, tokenize(stored_text), max_similarity)
+                max_similarity = max(max_similarity, similarity)
             
             conn.close()
             
@@ -467,10 +530,10 @@ class AdvancedDetectionService:
             # Encoder les phrases avec Sentence-BERT si disponible
             if self.sentence_model and SENTENCE_TRANSFORMERS_AVAILABLE:
                 embeddings = self.sentence_model.encode(sentences)
-                embeddings_blob = pickle.dumps(embeddings)
+                embeddings_blob = encode_embeddings(embeddings)
             
             # Sérialiser les données
-            sentences_json = str(sentences)  # Simple serialization
+            sentences_json = json.dumps(sentences)
             
             conn = sqlite3.connect(self.local_db_path)
             cursor = conn.cursor()
@@ -480,14 +543,35 @@ class AdvancedDetectionService:
                 VALUES (?, ?, ?, ?)
             ''', (filename, text, sentences_json, embeddings_blob))
             
+            document_id = cursor.lastrowid
+            if self.minhash_index:
+                self.minhash_index.add(document_id, text, conn)
+            if self.document_vectors is not None:
+                self.document_vectors.add(document_id, text, conn)
+            
             conn.commit()
             conn.close()
             
+            if self.document_vectors is not None:
+                self.document_vectors.refresh_async()
+            
             logging.info(f"📚 Document '{filename}' ajouté à la base locale")
             
         except Exception as e:
             logging.error(f"Erreur stockage document: {e}")
 
+def _load_sentences(value) -> List[str]:
+    """Liste de phrases stockée en JSON, ou avec str(list) dans les anciennes lignes"""
+    if not value:
+        return []
+    try:
+        return json.loads(value)
+    except ValueError:
+        try:
+            return list(ast.literal_eval(value))
+        except (ValueError, SyntaxError):
+            return []
+
 # Instance globale du service
 advanced_detection_service = None
 
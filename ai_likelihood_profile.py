@@ -0,0 +1,143 @@
+"""
+Profil de vraisemblance IA par token et par phrase.
+
+Sortie détaillée du moteur de perplexité GPT-2 (ai_perplexity_detectgpt),
+stockée dans des tableaux numpy compacts et sérialisée avec le résultat
+d'analyse, pour que les surlignages, le PDF annoté et le rapport HTML
+lisent les vrais scores de phrase sans recharger le modèle. Ce module ne
+dépend que de numpy.
+"""
+import io
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+AI_SENTENCE_THRESHOLD = 0.5  # Probabilité à partir de laquelle une phrase est signalée
+
+
+def sentence_ai_probabilities(ppls) -> np.ndarray:
+    """
+    Probabilité IA de chaque phrase à partir de sa perplexité : même pente que
+    la zone intermédiaire de calibrate_ai_result (1 sous 20, 0 au-delà de 100).
+    """
+    ppls = np.asarray(ppls, dtype=np.float32)
+    probabilities = np.clip(1.0 - (ppls - 20.0) / 80.0, 0.0, 1.0)
+    probabilities[~np.isfinite(ppls)] = 0.0
+    return probabilities.astype(np.float32)
+
+
+class AILikelihoodProfile:
+    """
+    Sortie détaillée du moteur de perplexité, dans des tableaux numpy compacts :
+    log-probabilité de chaque token (avec la position de fin du token dans le
+    texte) et, pour chaque phrase, ses positions, sa perplexité et sa
+    probabilité IA. Sérialisable pour être relue sans relancer le modèle.
+    """
+    
+    _ARRAYS = {
+        'token_ends': np.int32,
+        'token_logprobs': np.float32,
+        'sentence_starts': np.int32,
+        'sentence_ends': np.int32,
+        'sentence_perplexity': np.float32,
+        'sentence_ai_probability': np.float32,
+    }
+    
+    def __init__(self, token_ends, token_logprobs, sentence_starts, sentence_ends,
+                 sentence_perplexity, sentence_ai_probability=None):
+        if sentence_ai_probability is None:
+            sentence_ai_probability = sentence_ai_probabilities(sentence_perplexity)
+        values = (token_ends, token_logprobs, sentence_starts, sentence_ends,
+                  sentence_perplexity, sentence_ai_probability)
+        for (name, dtype), value in zip(self._ARRAYS.items(), values):
+            setattr(self, name, np.asarray(value, dtype=dtype))
+    
+    @classmethod
+    def from_losses(cls, losses, token_ends, spans) -> 'AILikelihoodProfile':
+        """Profil d'un texte à partir des pertes par token de token_losses()"""
+        return cls.from_sentence_losses(spans, split_sentence_losses(losses, token_ends, spans))
+    
+    @classmethod
+    def from_sentence_losses(cls, spans, sentence_losses) -> 'AILikelihoodProfile':
+        """Profil à partir des pertes de chaque phrase (split_sentence_losses ou perplexity_cache)"""
+        bounds = np.asarray(spans, dtype=np.int64).reshape(-1, 2)
+        token_ends = [ends.astype(np.int64) + start for start, (_, ends) in zip(bounds[:, 0], sentence_losses)]
+        losses = [losses for losses, _ in sentence_losses]
+        return cls(np.concatenate(token_ends) if token_ends else [],
+                   -np.concatenate(losses) if losses else [],
+                   bounds[:, 0], bounds[:, 1], perplexities(*sentence_loss_sums(sentence_losses)))
+    
+    def __len__(self):
+        return len(self.sentence_starts)
+    
+    def sentences(self):
+        """(début, fin, perplexité, probabilité IA) de chaque phrase"""
+        for i in range(len(self)):
+            yield (int(self.sentence_starts[i]), int(self.sentence_ends[i]),
+                   float(self.sentence_perplexity[i]), float(self.sentence_ai_probability[i]))
+    
+    def sentence_scores_by_text(self, text: str) -> Dict[str, float]:
+        """Probabilité IA indexée par le texte de la phrase (espaces normalisés), pour les rendus sans positions"""
+        return {' '.join(text[start:end].split()): probability
+                for start, end, _, probability in self.sentences()}
+    
+    def to_bytes(self) -> bytes:
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, **{name: getattr(self, name) for name in self._ARRAYS})
+        return buffer.getvalue()
+    
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'AILikelihoodProfile':
+        with np.load(io.BytesIO(data), allow_pickle=False) as arrays:
+            return cls(*(arrays[name] for name in cls._ARRAYS))
+
+
+def split_sentence_losses(losses: np.ndarray, token_ends: np.ndarray,
+                          spans: List[Tuple[int, int]]) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Pertes des tokens de chaque phrase (début, fin), avec la fin de chaque
+    token relative au début de la phrase. Un token appartient à la phrase qui
+    contient son dernier caractère ; ceux qui tombent entre deux phrases (sauts
+    de ligne) ne comptent nulle part, ni dans le document ni dans le cache.
+    """
+    if not spans:
+        return []
+    bounds = np.asarray(spans, dtype=np.int64).reshape(-1, 2)
+    losses = np.asarray(losses, dtype=np.float32)
+    token_ends = np.asarray(token_ends, dtype=np.int64)
+    lo = np.searchsorted(token_ends - 1, bounds[:, 0], side='left')
+    hi = np.searchsorted(token_ends - 1, bounds[:, 1], side='left')
+    return [(losses[first:last], (token_ends[first:last] - start).astype(np.int32))
+            for start, first, last in zip(bounds[:, 0].tolist(), lo.tolist(), hi.tolist())]
+
+
+def sentence_loss_sums(sentence_losses) -> Tuple[np.ndarray, np.ndarray]:
+    """Somme des pertes et nombre de tokens de chaque phrase"""
+    sums = np.array([losses.sum(dtype=np.float64) for losses, _ in sentence_losses], dtype=np.float64)
+    counts = np.array([len(losses) for losses, _ in sentence_losses], dtype=np.int64)
+    return sums, counts
+
+
+def perplexities(sums: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """Perplexité de chaque phrase à partir de ses sommes; NaN pour une phrase sans token évalué"""
+    ppls = np.full(len(sums), np.nan, dtype=np.float32)
+    has_tokens = counts > 0
+    ppls[has_tokens] = np.exp(sums[has_tokens] / counts[has_tokens])
+    return ppls
+
+
+def document_perplexity(sentence_losses) -> float:
+    """
+    Perplexité d'un ensemble de phrases : exp(somme des pertes / nombre de
+    tokens), sur les seuls tokens attribués aux phrases, que leurs pertes
+    viennent d'une passe du modèle ou du cache (même résultat dans les deux cas).
+    """
+    sums, counts = sentence_loss_sums(sentence_losses)
+    total = int(counts.sum())
+    return float(np.exp(sums.sum() / total)) if total else 1000.0
+
+
+def sentence_perplexities(losses: np.ndarray, token_ends: np.ndarray,
+                          spans: List[Tuple[int, int]]) -> np.ndarray:
+    """Perplexité de chaque phrase (début, fin); NaN pour une phrase sans token évalué"""
+    return perplexities(*sentence_loss_sums(split_sentence_losses(losses, token_ends, spans)))
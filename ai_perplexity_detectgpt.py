@@ -1,29 +1,30 @@
 import numpy as np
 import torch
-import re
-from typing import List, Tuple, Dict, Any
+from typing import List, Tuple, Dict, Any, Optional
 import os
 from collections import defaultdict
 import time
+import logging
+
+from ai_likelihood_profile import AILikelihoodProfile, document_perplexity, split_sentence_losses
+from perplexity_cache import get_perplexity_cache
+from text_segmentation import segment_document
+from inference_server import InferenceClient
 
 # Cache pour les modèles et données de référence
 _MODEL_CACHE = {}
 _REFERENCE_CACHE = {}
 _PLAGIARISM_CACHE = {}
+REFERENCE_INDEX_RETRY_SECONDS = float(os.environ.get('REFERENCE_INDEX_RETRY_SECONDS', 600))
 
 # --------- Initialisation optimisée des modèles ---------
 def get_model():
-    """Charge le modèle une seule fois avec mise en cache"""
+    """Charge le modèle une seule fois avec mise en cache (backend choisi par PERPLEXITY_BACKEND)"""
     if 'model' not in _MODEL_CACHE:
-        from transformers import GPT2LMHeadModel, GPT2TokenizerFast
+        from perplexity_backends import load_backend, PERPLEXITY_BACKEND
         
-        print("Chargement du modèle GPT-2...")
-        _MODEL_CACHE['tokenizer'] = GPT2TokenizerFast.from_pretrained('distilgpt2')
-        _MODEL_CACHE['model'] = GPT2LMHeadModel.from_pretrained('distilgpt2')
-        _MODEL_CACHE['model'].eval()
-        # Configuration pour une meilleure performance
-        if torch.cuda.is_available():
-            _MODEL_CACHE['model'] = _MODEL_CACHE['model'].to('cuda')
+        print(f"Chargement du modèle GPT-2 (backend {PERPLEXITY_BACKEND})...")
+        _MODEL_CACHE['model'], _MODEL_CACHE['tokenizer'] = load_backend(PERPLEXITY_BACKEND)
     
     return _MODEL_CACHE['model'], _MODEL_CACHE['tokenizer']
 
@@ -33,48 +34,97 @@ def preprocess_text(text: str, min_length: int = 10) -> List[str]:
     if not text or not text.strip():
         return []
     
-    # Version plus efficace de la séparation des phrases
-    sentences = re.split(r'(?<=[.!?])\s+', text)
-    return [s.strip() for s in sentences if s.strip() and len(s.strip()) > min_length]
+    return segment_document(text).sentences(min_length)
 
-def get_reference_data(ignore_filename=None):
-    """Charge et cache les données de référence une seule fois, possibilité d'ignorer un fichier"""
-    cache_key = 'reference_data' if ignore_filename is None else f'reference_data_{ignore_filename}'
-    if cache_key in _REFERENCE_CACHE:
-        return _REFERENCE_CACHE[cache_key]
-    
-    REFERENCE_DIR = os.path.join(os.path.dirname(__file__), 'reference_corpus')
-    if not os.path.exists(REFERENCE_DIR):
-        _REFERENCE_CACHE[cache_key] = ([], None, None)
-        return _REFERENCE_CACHE[cache_key]
-        
-    texts = []
-    ref_sentences = []
+def _load_reference():
+    """
+    Référence partagée : l'index persistant (reference_index) ou, s'il est
+    indisponible, une reconstruction en mémoire faite une seule fois.
+    """
+    # Après un échec, pas de nouvelle tentative de construction à chaque appel
+    failed_at = _REFERENCE_CACHE.get('index_failed_at')
+    if failed_at is None or time.monotonic() - failed_at >= REFERENCE_INDEX_RETRY_SECONDS:
+        try:
+            from reference_index import load_reference_index
+            index = load_reference_index()
+            _REFERENCE_CACHE.pop('index_failed_at', None)
+            return index
+        except Exception as e:
+            _REFERENCE_CACHE['index_failed_at'] = time.monotonic()
+            logging.error(f"Index de référence indisponible, reconstruction en mémoire : {e}")
     
-    for fname in os.listdir(REFERENCE_DIR):
-        if ignore_filename and fname == ignore_filename:
-            continue
-        path = os.path.join(REFERENCE_DIR, fname)
-        if os.path.isfile(path):
-            try:
-                with open(path, encoding='utf-8', errors='ignore') as f:
-                    content = f.read()
-                    texts.append((fname, content))
-                    ref_sentences.extend(preprocess_text(content, 20))  # Seuil plus élevé pour les références
-            except Exception as e:
-                print(f"Error reading file {fname}: {str(e)}")
+    if 'reference' in _REFERENCE_CACHE:
+        return _REFERENCE_CACHE['reference']
     
-    # Vectoriser une seule fois
-    from sklearn.feature_extraction.text import TfidfVectorizer
-    if ref_sentences:
-        vectorizer = TfidfVectorizer().fit(ref_sentences)
-        ref_vecs = vectorizer.transform(ref_sentences)
-    else:
-        vectorizer = None
-        ref_vecs = None
+    from reference_index import InMemoryReference
+    REFERENCE_DIR = os.path.join(os.path.dirname(__file__), 'reference_corpus')
+    documents = []
+    if os.path.exists(REFERENCE_DIR):
+        from corpus_extraction import extract_corpus_text
+        for fname in sorted(os.listdir(REFERENCE_DIR)):
+            path = os.path.join(REFERENCE_DIR, fname)
+            if os.path.isfile(path):
+                try:
+                    content = extract_corpus_text(path)
+                    documents.append((fname, preprocess_text(content, 20)))  # Seuil plus élevé pour les références
+                except Exception as e:
+                    print(f"Error reading file {fname}: {str(e)}")
     
-    _REFERENCE_CACHE[cache_key] = (texts, vectorizer, ref_vecs)
-    return texts, vectorizer, ref_vecs
+    _REFERENCE_CACHE['reference'] = InMemoryReference(documents)
+    return _REFERENCE_CACHE['reference']
+
+def get_reference_data(ignore_filename=None):
+    """
+    Données de référence (documents, vectoriseur, matrice TF-IDF des phrases).
+    Les détecteurs utilisent la matrice complète avec reference_exclusion();
+    avec ignore_filename, les lignes du fichier sont retirées d'une copie
+    (non mise en cache) pour les appelants qui attendent une matrice filtrée.
+    """
+    reference = _load_reference()
+    excluded = reference.excluded_rows(ignore_filename)
+    if excluded is None or reference.matrix is None:
+        return reference.documents(), reference.vectorizer, reference.matrix
+    keep = np.ones(reference.matrix.shape[0], dtype=bool)
+    keep[excluded] = False
+    return reference.documents(), reference.vectorizer, reference.matrix[keep]
+
+def reference_exclusion(ignore_filename=None) -> Optional[np.ndarray]:
+    """Lignes de la matrice de référence à exclure (fichier(s) ignorés), ou None"""
+    return _load_reference().excluded_rows(ignore_filename)
+
+PLAGIARISM_SIMILARITY_THRESHOLD = 0.7
+
+def suspicious_heuristic_score(has_long_phrases: bool, repeated: bool, unique_ratio: float) -> float:
+    """Heuristique "suspect" utilisée si corpus absent ou aucune phrase détectée"""
+    score = 0.0
+    if has_long_phrases:
+        score += 5
+    if repeated:
+        score += 3
+    if unique_ratio < 0.7:
+        score += 2
+    return min(10, score)
+
+def suspicious_heuristic(sentences):
+    if not sentences:
+        return 0.0
+    unique_ratio = len(set(sentences)) / len(sentences)
+    return suspicious_heuristic_score(
+        any(len(s) > 120 for s in sentences),
+        len(sentences) != len(set(sentences)),
+        unique_ratio
+    )
+
+def sentence_plagiarism_weight(sentence_length: int, max_sim: float) -> float:
+    """Contribution pondérée d'une phrase au-dessus du seuil de similarité"""
+    return max_sim * min(1.0, sentence_length / 100)
+
+def calibrate_plagiarism_score(mean_weighted_score: float, heuristic: float) -> float:
+    """Calibration Turnitin appliquée à la moyenne des scores pondérés"""
+    raw_score = mean_weighted_score * 100
+    calibrated_score = 15 * np.log(1 + raw_score / 15)
+    # Si le score calibré est très faible (< 10), on prend le max avec l'heuristique
+    return float(min(100, max(calibrated_score, heuristic)))
 
 def tfidf_cosine_plagiarism_optimized(submitted_text: str, ignore_filename=None) -> float:
     """Version optimisée de la détection de plagiat avec calibration pour Turnitin"""
@@ -82,119 +132,198 @@ def tfidf_cosine_plagiarism_optimized(submitted_text: str, ignore_filename=None)
     if not submitted_sentences:
         return 0.0
 
-    _, vectorizer, ref_vecs = get_reference_data(ignore_filename=ignore_filename)
-
-    # Heuristique "suspect" si corpus absent ou vide
-    def suspicious_heuristic(sentences):
-        if not sentences:
-            return 0.0
-        long_phrases = [s for s in sentences if len(s) > 120]
-        repeated = len(sentences) != len(set(sentences))
-        unique_ratio = len(set(sentences)) / len(sentences) if sentences else 1
-        score = 0.0
-        if long_phrases:
-            score += 5
-        if repeated:
-            score += 3
-        if unique_ratio < 0.7:
-            score += 2
-        return min(10, score)
+    _, vectorizer, ref_vecs = get_reference_data()
 
     if ref_vecs is None or vectorizer is None:
         return suspicious_heuristic(submitted_sentences)
 
-    submitted_vecs = vectorizer.transform(submitted_sentences)
-    from sklearn.metrics.pairwise import cosine_similarity
-    sim_matrix = cosine_similarity(submitted_vecs, ref_vecs)
-
-    if sim_matrix.size == 0:
+    if ref_vecs.shape[0] == 0:
         return suspicious_heuristic(submitted_sentences)
 
-    threshold = 0.7
+    # Parcours du corpus par blocs : pas de matrice dense phrases x corpus
+    from sparse_topk import max_similarities
+    submitted_vecs = vectorizer.transform(submitted_sentences)
+    max_sims = max_similarities(submitted_vecs, ref_vecs, reference_exclusion(ignore_filename))
     weighted_scores = []
-    for i in range(sim_matrix.shape[0]):
-        max_sim = np.max(sim_matrix[i])
-        if max_sim > threshold:
-            sentence_length = len(submitted_sentences[i])
-            weight = min(1.0, sentence_length / 100)
-            weighted_scores.append(max_sim * weight)
+    for i in range(len(submitted_sentences)):
+        max_sim = max_sims[i]
+        if max_sim > PLAGIARISM_SIMILARITY_THRESHOLD:
+            weighted_scores.append(sentence_plagiarism_weight(len(submitted_sentences[i]), max_sim))
 
     if not weighted_scores:
         # Si aucune phrase n'est détectée comme plagiée, appliquer l'heuristique
         return suspicious_heuristic(submitted_sentences)
 
-    raw_score = np.mean(weighted_scores) * 100
-    calibrated_score = 15 * np.log(1 + raw_score / 15)
-    # Si le score calibré est très faible (< 10), on prend le max avec l'heuristique
-    return min(100, max(calibrated_score, suspicious_heuristic(submitted_sentences)))
+    return calibrate_plagiarism_score(np.mean(weighted_scores), suspicious_heuristic(submitted_sentences))
 
-# --------- Algorithme IA optimisé (inchangé) ---------
-def perplexity_optimized(text, model, tokenizer):
-    """Version optimisée du calcul de perplexité"""
+# --------- Algorithme IA optimisé ---------
+LOSS_STRIDE = 256  # Réduction du stride pour plus d'efficacité
+
+def _model_device(model):
+    # Modèles transformers et backends de perplexity_backends exposent .device
+    return model.device
+
+def perplexity_model_id(model) -> Optional[str]:
+    """Clé du modèle dans le cache de perplexité (None : modèle chargé hors load_backend, pas de cache)"""
+    return getattr(model, 'perplexity_model_id', None)
+
+def loss_windows(seq_len: int, max_length: int, stride: int = LOSS_STRIDE) -> List[Tuple[int, int, int]]:
+    """
+    Fenêtres glissantes (début, fin, premier nouveau) de token_losses : la
+    fenêtre [début, fin) prédit les tokens début + premier nouveau à fin - 1,
+    pas encore évalués, avec le plus de contexte possible. Le token 0 n'est
+    pas prédit.
+    """
+    windows = []
+    prev_end_loc = 1
+    for begin_loc in range(0, seq_len, stride):
+        end_loc = min(begin_loc + max_length, seq_len)
+        windows.append((begin_loc, end_loc, prev_end_loc - begin_loc - 1))
+        prev_end_loc = end_loc
+        if end_loc == seq_len:
+            break
+    return windows
+
+def token_losses(text, model, tokenizer, deadline=None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Perte (NLL) de chaque token du texte en une seule passe à fenêtre glissante,
+    avec la position (en caractères) de la fin de chaque token. Le premier token
+    n'a pas de prédiction et n'est pas compté. Renvoie des tableaux vides si le
+    texte est vide ou si l'échéance est atteinte avant la fin du calcul.
+    """
+    empty = (np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64))
     if not text or not text.strip():
-        return 1000.0  # Valeur par défaut élevée pour texte vide
+        return empty
+    if isinstance(model, InferenceClient):
+        # Passes du modèle regroupées par le démon d'inférence
+        return model.token_losses([text], deadline)[0]
     
-    encodings = tokenizer(text, return_tensors='pt')
+    encodings = tokenizer(text, return_tensors='pt', return_offsets_mapping=True)
+    input_ids = encodings['input_ids'].to(_model_device(model))
+    token_ends = encodings['offset_mapping'][0, :, 1].numpy().astype(np.int64)
     
-    # Utiliser GPU si disponible
-    if torch.cuda.is_available():
-        encodings = {k: v.to('cuda') for k, v in encodings.items()}
+    seq_len = input_ids.size(1)
+    if seq_len < 2:
+        return empty
     
-    max_length = model.config.n_positions
-    stride = 256  # Réduction du stride pour plus d'efficacité
-    seq_len = encodings.input_ids.size(1)
+    losses = np.empty(seq_len - 1, dtype=np.float32)
+    for begin_loc, end_loc, first_new in loss_windows(seq_len, model.config.n_positions):
+        if deadline is not None and deadline.expired():
+            return empty
+        window_ids = input_ids[:, begin_loc:end_loc]
+        
+        with torch.no_grad():
+            logits = model(window_ids).logits[0, :-1].float()
+            log_probs = torch.log_softmax(logits, dim=-1)
+            nll = -log_probs.gather(1, window_ids[0, 1:].unsqueeze(1)).squeeze(1)
+        
+        losses[begin_loc + first_new:end_loc - 1] = nll[first_new:].cpu().numpy()
     
-    nlls = []
-    prev_end_loc = 0
+    return losses, token_ends[1:]
+
+def burstiness_from_perplexities(ppls) -> float:
+    """Coefficient de variation des perplexités de phrases (0 si moins de 3 phrases)"""
+    ppls = np.asarray(ppls, dtype=np.float64)
+    ppls = ppls[np.isfinite(ppls)]
+    if len(ppls) < 3:
+        return 0.0
+    return float(np.std(ppls) / np.mean(ppls)) if np.mean(ppls) > 0 else 0.0
+
+def batched_perplexities(texts: List[str], model, tokenizer, batch_size: int = 32,
+                         deadline=None) -> np.ndarray:
+    """
+    Perplexité de plusieurs textes courts, par lots complétés (padding) avec
+    masque d'attention : une passe du modèle par lot au lieu d'une par texte.
+    Chaque texte est tronqué au contexte du modèle. Les textes non évalués à
+    l'échéance gardent la valeur par défaut.
+    """
+    ppls = np.full(len(texts), 1000.0, dtype=np.float32)  # même défaut que perplexity_optimized
+    if not texts:
+        return ppls
+    if isinstance(model, InferenceClient):
+        # Le démon regroupe lui-même les phrases en lots (même troncature)
+        for i, (losses, _) in enumerate(model.token_losses(texts, deadline, truncate=True)):
+            if len(losses):
+                ppls[i] = np.exp(losses.mean(dtype=np.float64))
+        return ppls
     
-    for begin_loc in range(0, seq_len, stride):
-        end_loc = min(begin_loc + max_length, seq_len)
-        trg_len = end_loc - prev_end_loc
-        input_ids = encodings.input_ids[:, begin_loc:end_loc]
-        target_ids = input_ids.clone()
+    pad_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+    device = _model_device(model)
+    max_length = model.config.n_positions
+    
+    for batch_start in range(0, len(texts), batch_size):
+        if deadline is not None and deadline.expired():
+            break
+        batch = texts[batch_start:batch_start + batch_size]
+        encoded = [tokenizer(t)['input_ids'][:max_length] for t in batch]
+        width = max(len(ids) for ids in encoded)
+        if width < 2:
+            continue
+        input_ids = torch.full((len(batch), width), pad_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(batch), width), dtype=torch.long)
+        for row, ids in enumerate(encoded):
+            input_ids[row, :len(ids)] = torch.tensor(ids, dtype=torch.long)
+            attention_mask[row, :len(ids)] = 1
+        input_ids = input_ids.to(device)
+        attention_mask = attention_mask.to(device)
         
         with torch.no_grad():
-            outputs = model(input_ids, labels=target_ids)
-            neg_log_likelihood = outputs.loss * trg_len
+            logits = model(input_ids, attention_mask=attention_mask).logits[:, :-1].float()
+            log_probs = torch.log_softmax(logits, dim=-1)
+            nll = -log_probs.gather(2, input_ids[:, 1:].unsqueeze(2)).squeeze(2)
+            target_mask = attention_mask[:, 1:].float()
+            counts = target_mask.sum(dim=1)
+            mean_nll = (nll * target_mask).sum(dim=1) / counts.clamp(min=1)
         
-        nlls.append(neg_log_likelihood)
-        prev_end_loc = end_loc
-        if end_loc == seq_len:
-            break
+        batch_ppls = torch.exp(mean_nll).cpu().numpy()
+        valid = counts.cpu().numpy() > 0
+        ppls[batch_start:batch_start + len(batch)][valid] = batch_ppls[valid]
     
-    if not nlls:
-        return 1000.0
-        
-    ppl = torch.exp(torch.stack(nlls).sum() / seq_len)
-    return float(ppl)
+    return ppls
+
+def negative_log_likelihood(text, model, tokenizer, deadline=None) -> Tuple[float, int]:
+    """
+    Somme des log-vraisemblances négatives et nombre de tokens évalués.
+    Renvoie (0.0, 0) si l'échéance est atteinte avant la fin du calcul.
+    """
+    losses, _ = token_losses(text, model, tokenizer, deadline)
+    return float(losses.sum(dtype=np.float64)), len(losses)
+
+def perplexity_optimized(text, model, tokenizer):
+    """Version optimisée du calcul de perplexité"""
+    nll_sum, n_tokens = negative_log_likelihood(text, model, tokenizer)
+    if n_tokens == 0:
+        return 1000.0  # Valeur par défaut élevée pour texte vide
+    return float(np.exp(nll_sum / n_tokens))
 
 def burstiness_optimized(text, model, tokenizer, max_sentences=10):
-    """Version optimisée du calcul de burstiness avec échantillonnage"""
+    """Burstiness d'un échantillon de phrases évaluées isolément, en un seul lot"""
     sentences = [s for s in split_sentences(text) if len(s) > 10]
     
     if len(sentences) < 3:
         return 0.0
     
     # Échantillonnage pour éviter de traiter trop de phrases
-    if len(sentences) > max_sentences:
+    if max_sentences and len(sentences) > max_sentences:
         indices = np.random.choice(len(sentences), max_sentences, replace=False)
         sentences = [sentences[i] for i in indices]
     
-    ppls = []
-    for s in sentences:
-        ppl = perplexity_optimized(s, model, tokenizer)
-        ppls.append(ppl)
-        # Petite pause pour éviter la surcharge
-        time.sleep(0.01)
-    
-    ppls = np.array(ppls)
-    return float(np.std(ppls) / np.mean(ppls)) if np.mean(ppls) > 0 else 0.0
+    return burstiness_from_perplexities(batched_perplexities(sentences, model, tokenizer))
 
 def split_sentences(text):
-    return re.split(r'(?<=[.!?])\s+', text)
+    return segment_document(text).sentences()
 
 def ai_detection_score_optimized(text: str) -> Dict[str, Any]:
-    """Version optimisée de la détection IA avec calibration pour Turnitin/CopyLeaks"""
+    """Détection IA avec calibration pour Turnitin/CopyLeaks (score du document seul)"""
+    return ai_detection_profile(text)[0]
+
+def ai_detection_profile(text: str, model=None, tokenizer=None,
+                         deadline=None) -> Tuple[Dict[str, Any], Optional[AILikelihoodProfile]]:
+    """
+    Score IA calibré du document et profil détaillé par token et par phrase.
+    Une seule passe du modèle : la perplexité du document et celles des
+    phrases (burstiness) proviennent des mêmes pertes par token.
+    """
     if not text or len(text) < 100:  # Texte trop court
         return {
             "score": 0.0,
@@ -204,14 +333,34 @@ def ai_detection_score_optimized(text: str) -> Dict[str, Any]:
                 "norm_ppl": 0.0,
                 "norm_burstiness": 0.0
             }
-        }
+        }, None
     
-    model, tokenizer = get_model()
+    from chunked_analysis import MIN_BURSTINESS_SENTENCE
+    if model is None:
+        model, tokenizer = get_model()
     
-    # Calcul en parallèle si possible
-    ppl = perplexity_optimized(text, model, tokenizer)
-    burst = burstiness_optimized(text, model, tokenizer)
+    spans = segment_document(text).sentence_spans()
+    sentences = [text[start:end] for start, end in spans]
+    cache, model_id = get_perplexity_cache(), perplexity_model_id(model)
+    sentence_losses = None
+    if cache is not None and model_id and spans:
+        # Document déjà vu phrase par phrase : pas de passe du modèle
+        sentence_losses = cache.lookup(model_id, sentences)
+    if sentence_losses is None or any(value is None for value in sentence_losses):
+        losses, token_ends = token_losses(text, model, tokenizer, deadline)
+        sentence_losses = split_sentence_losses(losses, token_ends, spans)
+        if cache is not None and model_id and len(losses):
+            cache.store(model_id, sentences, sentence_losses)
+    # Mêmes tokens (ceux des phrases) que les pertes viennent du modèle ou du cache
+    ppl = document_perplexity(sentence_losses)
+    profile = AILikelihoodProfile.from_sentence_losses(spans, sentence_losses)
+    long_enough = (profile.sentence_ends - profile.sentence_starts) > MIN_BURSTINESS_SENTENCE
+    burst = burstiness_from_perplexities(profile.sentence_perplexity[long_enough])
     
+    return calibrate_ai_result(ppl, burst), profile
+
+def calibrate_ai_result(ppl: float, burst: float) -> Dict[str, Any]:
+    """Score IA à partir de la perplexité et de la burstiness"""
     # Nouvelle calibration pour correspondre à Turnitin/CopyLeaks
     # Ajustement des formules de normalisation
     if ppl < 20:  # Très basse perplexité (forte indication IA)
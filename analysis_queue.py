@@ -0,0 +1,248 @@
+"""
+File durable des analyses de documents, stockée dans la base de l'application.
+
+La route d'envoi ne fait qu'ajouter un AnalysisJob ; les workers d'analyse
+(voir analysis_worker.py) prennent un bail sur les tâches, lancent les
+détecteurs et écrivent les résultats. Un bail non renouvelé avant son
+expiration rend la tâche de nouveau disponible : un worker qui plante ne
+perd jamais de document.
+"""
+import os
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+from sqlalchemy import and_, or_, update
+
+from app import app, db
+from models import AnalysisJob, Document, DocumentStatus, JobStatus
+
+LEASE_SECONDS = int(os.environ.get('ANALYSIS_LEASE_SECONDS', 300))
+MAX_ATTEMPTS = int(os.environ.get('ANALYSIS_MAX_ATTEMPTS', 3))
+RETRY_BACKOFF_SECONDS = int(os.environ.get('ANALYSIS_RETRY_BACKOFF_SECONDS', 30))
+
+
+def enqueue_analysis(document_id: int, commit: bool = True) -> AnalysisJob:
+    """Crée une tâche d'analyse en attente pour un document"""
+    job = AnalysisJob()
+    job.document_id = document_id
+    job.status = JobStatus.QUEUED
+    job.attempts = 0
+    job.max_attempts = MAX_ATTEMPTS
+    job.available_at = datetime.now()
+    db.session.add(job)
+    if commit:
+        db.session.commit()
+    return job
+
+
+# ---- baux : communs aux tâches d'analyse et aux cohortes (cohort_jobs) ----
+#
+# Le modèle doit avoir les colonnes status, attempts, max_attempts,
+# lease_owner, lease_expires_at, last_error et updated_at. Une colonne
+# available_at, si elle existe, retarde la reprise d'une tâche en attente.
+
+def _leasable(model, now: datetime):
+    """Lignes en attente et arrivées à échéance, ou dont le bail a expiré, avec des tentatives restantes"""
+    queued = model.status == JobStatus.QUEUED
+    if hasattr(model, 'available_at'):
+        queued = and_(queued, model.available_at <= now)
+    return and_(
+        model.attempts < model.max_attempts,
+        or_(queued, and_(model.status == JobStatus.RUNNING, model.lease_expires_at < now)),
+    )
+
+
+def lease_owned(model, row_id: int, worker_id: str):
+    """La ligne tourne toujours sous le bail de ce worker"""
+    return and_(model.id == row_id,
+                model.status == JobStatus.RUNNING,
+                model.lease_owner == worker_id)
+
+
+def fail_expired_leases(model, now: datetime, label: str,
+                        on_failed: Optional[Callable] = None) -> None:
+    """Marque en échec les lignes au bail expiré qui n'ont plus de tentative"""
+    exhausted = model.query.filter(
+        model.status == JobStatus.RUNNING,
+        model.lease_expires_at < now,
+        model.attempts >= model.max_attempts
+    ).all()
+    for row in exhausted:
+        logging.error(f"{label} {row.id} lease expired after {row.attempts} attempts, giving up")
+        row.status = JobStatus.FAILED
+        row.lease_owner = None
+        row.lease_expires_at = None
+        row.last_error = row.last_error or 'Lease expired (worker lost)'
+        if on_failed is not None:
+            on_failed(row)
+    if exhausted:
+        db.session.commit()
+
+
+def lease_next(model, worker_id: str, order_by, lease_seconds: int = LEASE_SECONDS):
+    """
+    Réserve atomiquement la prochaine ligne disponible pour ce worker.
+
+    La réservation est un UPDATE conditionnel : deux workers en concurrence
+    sur la même ligne ne peuvent pas l'obtenir tous les deux, sous SQLite
+    comme sous PostgreSQL.
+    """
+    now = datetime.now()
+    candidate_ids = [row[0] for row in db.session.query(model.id)
+                     .filter(_leasable(model, now))
+                     .order_by(*order_by)
+                     .limit(10).all()]
+
+    for row_id in candidate_ids:
+        claimed = db.session.execute(
+            update(model)
+            .where(model.id == row_id, _leasable(model, now))
+            .values(status=JobStatus.RUNNING,
+                    lease_owner=worker_id,
+                    lease_expires_at=now + timedelta(seconds=lease_seconds),
+                    attempts=model.attempts + 1,
+                    updated_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        if claimed.rowcount == 1:
+            return db.session.get(model, row_id)
+
+    return None
+
+
+def renew_lease(model, row_id: int, worker_id: str, lease_seconds: int = LEASE_SECONDS) -> bool:
+    """Renouvelle le bail d'une ligne en cours ; False si le worker ne le détient plus"""
+    now = datetime.now()
+    renewed = db.session.execute(
+        update(model)
+        .where(lease_owned(model, row_id, worker_id))
+        .values(lease_expires_at=now + timedelta(seconds=lease_seconds), updated_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return renewed.rowcount == 1
+
+
+# ---- tâches d'analyse ----
+
+def _fail_document(job: AnalysisJob) -> None:
+    if job.document:
+        job.document.status = DocumentStatus.FAILED
+
+
+def lease_next_job(worker_id: str, lease_seconds: int = LEASE_SECONDS) -> Optional[AnalysisJob]:
+    """Réserve atomiquement la prochaine tâche disponible pour ce worker"""
+    fail_expired_leases(AnalysisJob, datetime.now(), "Analysis job", _fail_document)
+    return lease_next(AnalysisJob, worker_id, (AnalysisJob.available_at, AnalysisJob.id), lease_seconds)
+
+
+def extend_lease(job_id: int, worker_id: str, lease_seconds: int = LEASE_SECONDS) -> bool:
+    """Renouvelle le bail d'une tâche en cours ; False si le worker ne le détient plus"""
+    return renew_lease(AnalysisJob, job_id, worker_id, lease_seconds)
+
+
+class LeaseLost(RuntimeError):
+    """Levée quand un autre worker a repris la tâche que ce worker traitait"""
+
+
+class LeaseHeartbeat(threading.Thread):
+    """
+    Renouvelle un bail (tâche d'analyse ou cohorte) pendant un long calcul.
+    Dès qu'un renouvellement est refusé, lost est posé et check() lève
+    LeaseLost : le worker s'arrête avant d'écrire quoi que ce soit.
+    """
+
+    def __init__(self, renew: Callable[[], bool], description: str, lease_seconds: int = LEASE_SECONDS):
+        super().__init__(daemon=True)
+        self.renew = renew
+        self.description = description
+        self.lease_seconds = lease_seconds
+        self.stopped = threading.Event()
+        self.lost = threading.Event()
+
+    def run(self):
+        interval = max(1.0, self.lease_seconds / 3)
+        with app.app_context():
+            try:
+                while not self.stopped.wait(interval):
+                    try:
+                        if not self.renew():
+                            logging.warning(f"Lost the lease on {self.description}")
+                            self.lost.set()
+                            return
+                    except Exception as e:
+                        db.session.rollback()
+                        logging.error(f"Lease renewal failed for {self.description}: {e}")
+            finally:
+                db.session.remove()
+
+    def check(self):
+        if self.lost.is_set():
+            raise LeaseLost(f"Lost the lease on {self.description}")
+
+    def stop(self):
+        self.stopped.set()
+
+
+def complete_job(job: AnalysisJob, worker_id: str) -> bool:
+    """
+    Marque une tâche comme terminée et libère son bail, seulement si ce
+    worker le détient encore. Renvoie False si le bail a été perdu (un autre
+    worker a relancé la tâche).
+    """
+    completed = db.session.execute(
+        update(AnalysisJob)
+        .where(lease_owned(AnalysisJob, job.id, worker_id))
+        .values(status=JobStatus.DONE, lease_owner=None, lease_expires_at=None,
+                last_error=None, updated_at=datetime.now())
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    db.session.refresh(job)
+    return completed.rowcount == 1
+
+
+def fail_job(job: AnalysisJob, worker_id: str, error: str) -> bool:
+    """
+    Enregistre une tentative échouée. Tant qu'il reste des tentatives, la
+    tâche est remise en file avec un délai croissant linéairement ; sinon
+    elle et son document passent en échec. Rien n'est modifié si ce worker
+    ne détient plus le bail. Renvoie True si la tâche sera relancée.
+    """
+    now = datetime.now()
+    will_retry = job.attempts < job.max_attempts
+    values = dict(last_error=error[:2000] if error else None, lease_owner=None,
+                  lease_expires_at=None, updated_at=now)
+    if will_retry:
+        values.update(status=JobStatus.QUEUED,
+                      available_at=now + timedelta(seconds=RETRY_BACKOFF_SECONDS * job.attempts))
+    else:
+        values.update(status=JobStatus.FAILED)
+
+    failed = db.session.execute(
+        update(AnalysisJob)
+        .where(lease_owned(AnalysisJob, job.id, worker_id))
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    if failed.rowcount != 1:
+        db.session.rollback()
+        logging.warning(f"Worker {worker_id} lost the lease on job {job.id}, failure not recorded")
+        return False
+    if not will_retry:
+        document = db.session.get(Document, job.document_id)
+        if document:
+            document.status = DocumentStatus.FAILED
+    db.session.commit()
+    db.session.refresh(job)
+    return will_retry
+
+
+def queue_stats() -> dict:
+    """Nombre de tâches par statut, pour la supervision"""
+    counts = dict(db.session.query(AnalysisJob.status, db.func.count(AnalysisJob.id))
+                  .group_by(AnalysisJob.status).all())
+    return {status.value: counts.get(status, 0) for status in JobStatus}
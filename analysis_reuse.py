@@ -0,0 +1,88 @@
+"""
+Réutilisation des analyses précédentes pour les documents déposés à nouveau.
+
+Un document dont les octets ou le texte normalisé correspondent à un document
+déjà analysé pour le même utilisateur reçoit une copie de cette analyse au
+lieu de repasser par GPT-2 et TF-IDF. Seuls les résultats produits par
+l'ANALYSIS_ENGINE_VERSION courante sont réutilisés. Un contenu identique
+déposé par un autre utilisateur est analysé normalement, pour être comparé à
+la soumission précédente (voir analysis_worker.index_submission).
+"""
+import logging
+from typing import Optional
+
+from sqlalchemy import or_
+
+from app import db
+from models import Document, DocumentStatus, AnalysisResult, HighlightedSentence
+
+# À incrémenter dès qu'une modification des détecteurs locaux change leurs scores
+ANALYSIS_ENGINE_VERSION = "local-9"
+
+_RESULT_FIELDS = (
+    'plagiarism_score', 'total_words', 'identical_words', 'minor_changes_words',
+    'related_meaning_words', 'ai_score', 'ai_words', 'ai_profile', 'raw_results', 'sources_count',
+    'analysis_provider', 'raw_response', 'highlighted_text', 'engine_version',
+)
+
+_HIGHLIGHT_FIELDS = (
+    'sentence_text', 'start_position', 'end_position', 'is_plagiarism', 'is_ai_generated',
+    'plagiarism_score', 'ai_score', 'plagiarism_confidence', 'ai_confidence', 'source_url', 'source_title',
+    'source_start', 'source_end',
+)
+
+
+def find_reusable_analysis(document: Document) -> Optional[AnalysisResult]:
+    """Analyse complète (non partielle) la plus récente d'un contenu identique, avec la version courante du moteur"""
+    hash_filters = []
+    if document.content_hash:
+        hash_filters.append(Document.content_hash == document.content_hash)
+    if document.text_hash:
+        hash_filters.append(Document.text_hash == document.text_hash)
+    if not hash_filters:
+        return None
+
+    return (AnalysisResult.query
+            .join(Document, AnalysisResult.document_id == Document.id)
+            .filter(or_(*hash_filters),
+                    Document.id != document.id,
+                    # Un travail identique d'un autre compte doit être comparé, pas réutilisé
+                    Document.user_id == document.user_id,
+                    Document.status == DocumentStatus.COMPLETED,
+                    AnalysisResult.analysis_provider == 'local',
+                    AnalysisResult.engine_version == ANALYSIS_ENGINE_VERSION)
+            .order_by(AnalysisResult.created_at.desc())
+            .first())
+
+
+def clone_analysis(source: AnalysisResult, document: Document) -> AnalysisResult:
+    """Copie un résultat d'analyse et ses phrases surlignées sur un autre document"""
+    AnalysisResult.query.filter_by(document_id=document.id).delete()
+    HighlightedSentence.query.filter_by(document_id=document.id).delete()
+
+    clone = AnalysisResult()
+    clone.document_id = document.id
+    for field in _RESULT_FIELDS:
+        setattr(clone, field, getattr(source, field))
+    db.session.add(clone)
+
+    for highlight in HighlightedSentence.query.filter_by(document_id=source.document_id).all():
+        copy = HighlightedSentence()
+        copy.document_id = document.id
+        for field in _HIGHLIGHT_FIELDS:
+            setattr(copy, field, getattr(highlight, field))
+        db.session.add(copy)
+
+    document.status = DocumentStatus.COMPLETED
+    db.session.commit()
+
+    logging.info(f"Reused analysis of document {source.document_id} for document {document.id}")
+    return clone
+
+
+def reuse_previous_analysis(document: Document) -> Optional[AnalysisResult]:
+    """Copie sur le document une analyse précédente correspondante, s'il y en a une"""
+    source = find_reusable_analysis(document)
+    if source is None:
+        return None
+    return clone_analysis(source, document)
@@ -0,0 +1,258 @@
+"""
+Worker d'analyse en arrière-plan.
+
+Prend des tâches dans la file analysis_jobs (voir analysis_queue.py), lance
+les détecteurs locaux de plagiat et d'IA et écrit les lignes AnalysisResult
+et HighlightedSentence. Quand aucun document n'attend, il calcule les
+matrices de similarité de cohorte en file (voir cohort_jobs.py). Tourne dans
+ses propres processus, pour dimensionner séparément le web et l'analyse :
+
+    python -m analysis_worker --processes 2
+"""
+import os
+import sys
+import time
+import socket
+import logging
+import argparse
+import traceback
+import multiprocessing
+
+# Même configuration que le processus web (voir main.py)
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    try:
+        import config_local  # noqa: F401
+    except ImportError:
+        pass
+
+from app import app, db
+from models import Document, DocumentStatus, AnalysisResult
+from analysis_queue import (LeaseHeartbeat, LeaseLost, lease_next_job, extend_lease,
+                            complete_job, fail_job)
+from analysis_reuse import ANALYSIS_ENGINE_VERSION, reuse_previous_analysis
+from cohort_jobs import process_next_cohort
+from perplexity_cache import perplexity_cache_stats
+from timeout_optimization import AnalysisDeadline
+
+POLL_INTERVAL_SECONDS = float(os.environ.get('ANALYSIS_POLL_INTERVAL', 2))
+DEADLINE_SECONDS = float(os.environ.get('ANALYSIS_DEADLINE_SECONDS', 600))
+
+
+class _LeaseDeadline(AnalysisDeadline):
+    """Échéance d'analyse qui expire aussi dès qu'un autre worker détient la tâche"""
+
+    def __init__(self, max_seconds: float, lease: LeaseHeartbeat = None):
+        super().__init__(max_seconds)
+        self.lease = lease
+
+    def expired(self) -> bool:
+        return super().expired() or (self.lease is not None and self.lease.lost.is_set())
+
+
+def analyze_document(document: Document, deadline_seconds: float = DEADLINE_SECONDS,
+                     lease: LeaseHeartbeat = None) -> AnalysisResult:
+    """
+    Lance les détecteurs locaux sur un document et enregistre les résultats.
+    Si l'échéance est atteinte, les étapes terminées sont gardées et le
+    résultat est enregistré comme partiel. Si le bail est perdu, l'analyse
+    s'arrête à la fenêtre suivante et LeaseLost est levée avant toute écriture.
+    """
+    from chunked_analysis import analyze_text_chunked
+    from passage_alignment import align_passages, sources_count
+    from winnowing import matched_length, submission_key
+
+    extracted_text = document.extracted_text or ""
+
+    # Document entier, fenêtre par fenêtre (sans troncature)
+    chunked = analyze_text_chunked(extracted_text, deadline=_LeaseDeadline(deadline_seconds, lease))
+    # Passages copiés de documents indexés (corpus de référence et soumissions précédentes),
+    # jamais des brouillons de l'étudiant ni des documents déposés après celui-ci
+    uploaded_at = document.created_at.isoformat() if document.created_at else None
+    passages = align_passages(extracted_text, exclude_keys=[submission_key(document.id)],
+                              user_id=document.user_id, uploaded_before=uploaded_at)
+    # Le score TF-IDF de référence ne masque jamais les passages identiques trouvés dans l'index
+    verified_percent = matched_length([passage._asdict() for passage in passages]) * 100.0 / max(1, len(extracted_text))
+    plag_score = max(chunked['plagiarism']['score'], round(min(100.0, verified_percent), 1))
+    result = {
+        'plagiarism': {
+            'percent': plag_score,
+            'exact': plag_score,
+            'semantic': 0.0,
+            'sources_found': sources_count(passages)
+        },
+        'windows': chunked['windows'],
+        'partial': chunked['partial'],
+        'coverage': chunked['coverage']
+    }
+
+    ai_result = chunked['ai_generated']
+    result['ai_content'] = {
+        'percent': ai_result.get('score', 0),
+        'perplexity': ai_result.get('perplexity', 0),
+        'burstiness': ai_result.get('burstiness', 0),
+        'norm_ppl': ai_result.get('details', {}).get('norm_ppl', 0),
+        'norm_burstiness': ai_result.get('details', {}).get('norm_burstiness', 0)
+    }
+
+    word_count = len(extracted_text.split()) if extracted_text else 0
+    plagiarism_percent = result['plagiarism']['percent']
+    ai_percent = result['ai_content']['percent']
+
+    identical_words = int((plagiarism_percent / 100.0) * word_count) if plagiarism_percent > 0 else 0
+    ai_words = int((ai_percent / 100.0) * word_count) if ai_percent > 0 else 0
+
+    if lease is not None:
+        lease.check()
+
+    # Une tâche relancée ne doit pas laisser d'ancien résultat
+    AnalysisResult.query.filter_by(document_id=document.id).delete()
+
+    analysis_result = AnalysisResult()
+    analysis_result.document_id = document.id
+    analysis_result.plagiarism_score = plagiarism_percent
+    analysis_result.ai_score = ai_percent
+    analysis_result.total_words = word_count
+    analysis_result.identical_words = identical_words
+    analysis_result.ai_words = ai_words
+    analysis_result.sources_count = result['plagiarism']['sources_found']
+    # Les résultats partiels ne sont jamais réutilisés pour un nouveau dépôt (voir analysis_reuse)
+    analysis_result.analysis_provider = 'local_partial' if chunked['partial'] else 'local'
+    analysis_result.raw_results = {
+        'partial': chunked['partial'],
+        'coverage': chunked['coverage'],
+        'stages': chunked['stages'],
+        'passages': [passage._asdict() for passage in passages]
+    }
+    analysis_result.raw_response = str(result)
+    if chunked['ai_profile'] is not None:
+        analysis_result.ai_profile = chunked['ai_profile'].to_bytes()
+    analysis_result.engine_version = ANALYSIS_ENGINE_VERSION
+
+    db.session.add(analysis_result)
+    document.status = DocumentStatus.COMPLETED
+    db.session.commit()
+
+    index_submission(document)
+
+    # Phrases surlignées du rapport PDF
+    try:
+        from simple_highlight_generator import create_highlights_for_document
+        highlighted_sentences = create_highlights_for_document(document, analysis_result)
+        logging.info(f"Created {len(highlighted_sentences)} highlighted sentences for document ID: {document.id}")
+    except Exception as e:
+        logging.error(f"Error creating highlighted sentences for document ID: {document.id}: {e}")
+
+    return analysis_result
+
+
+def index_submission(document: Document) -> None:
+    """Ajoute le document à l'index de passages partagé : les soumissions suivantes y sont comparées"""
+    try:
+        from winnowing import get_winnowing_index, submission_key, submission_title
+        uploaded_at = document.created_at.isoformat() if document.created_at else None
+        # Affiché dans les rapports des autres étudiants : jamais le nom du fichier déposé
+        get_winnowing_index().add_document(submission_key(document.id), document.extracted_text or "",
+                                           title=submission_title(document.id, uploaded_at),
+                                           content_hash=document.text_hash,
+                                           user_id=document.user_id, uploaded_at=uploaded_at)
+    except Exception as e:
+        logging.error(f"Error indexing document ID {document.id} for cross-submission checks: {e}")
+
+
+def process_next_job(worker_id: str) -> bool:
+    """Prend et traite une tâche. Renvoie False si la file est vide."""
+    job = lease_next_job(worker_id)
+    if job is None:
+        return False
+
+    logging.info(f"Worker {worker_id} processing job {job.id} (document {job.document_id}, attempt {job.attempts})")
+    job_id = job.id
+    heartbeat = LeaseHeartbeat(lambda: extend_lease(job_id, worker_id), f"job {job_id}")
+    heartbeat.start()
+    try:
+        document = db.session.get(Document, job.document_id)
+        if document is None:
+            raise LookupError(f"Document {job.document_id} no longer exists")
+        # Un dépôt identique a pu être analysé pendant que la tâche attendait
+        analysis_result = reuse_previous_analysis(document) or analyze_document(document, lease=heartbeat)
+        if complete_job(job, worker_id):
+            logging.info(f"Job {job.id} done: plagiarism {analysis_result.plagiarism_score}%, "
+                         f"AI {analysis_result.ai_score}%")
+        else:
+            logging.warning(f"Job {job.id} was taken over by another worker before it completed")
+        logging.info(f"Perplexity cache: {perplexity_cache_stats()}")
+    except LeaseLost as e:
+        # Le worker qui détient maintenant la tâche écrit le résultat et son statut
+        db.session.rollback()
+        logging.warning(f"Job {job_id} abandoned: {e}")
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Job {job.id} failed: {e}\n{traceback.format_exc()}")
+        will_retry = fail_job(job, worker_id, f"{type(e).__name__}: {e}")
+        logging.info(f"Job {job.id} {'re-queued' if will_retry else 'marked as failed'}")
+    finally:
+        heartbeat.stop()
+    return True
+
+
+def run_worker(worker_id: str, poll_interval: float = POLL_INTERVAL_SECONDS, once: bool = False) -> None:
+    """Boucle du worker : traite les tâches jusqu'à interruption (ou file vide avec once=True)"""
+    with app.app_context():
+        # Ne jamais partager les connexions du pool héritées du processus parent
+        db.engine.dispose()
+        logging.info(f"Analysis worker {worker_id} started")
+        while True:
+            try:
+                # Les matrices de cohorte ne passent que si aucun document n'attend
+                had_job = process_next_job(worker_id) or process_next_cohort(worker_id)
+            except Exception as e:
+                db.session.rollback()
+                logging.error(f"Worker {worker_id} error while leasing: {e}")
+                had_job = False
+            finally:
+                db.session.remove()
+
+            if not had_job:
+                if once:
+                    return
+                time.sleep(poll_interval)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="AcadCheck analysis worker")
+    parser.add_argument('--processes', type=int, default=int(os.environ.get('ANALYSIS_WORKERS', 1)),
+                        help="number of worker processes")
+    parser.add_argument('--poll-interval', type=float, default=POLL_INTERVAL_SECONDS,
+                        help="seconds to wait when the queue is empty")
+    parser.add_argument('--once', action='store_true',
+                        help="exit once the queue is empty")
+    args = parser.parse_args(argv)
+
+    base_id = f"{socket.gethostname()}-{os.getpid()}"
+
+    if args.processes <= 1:
+        run_worker(base_id, args.poll_interval, args.once)
+        return 0
+
+    processes = []
+    for i in range(args.processes):
+        process = multiprocessing.Process(target=run_worker,
+                                          args=(f"{base_id}-{i}", args.poll_interval, args.once),
+                                          daemon=False)
+        process.start()
+        processes.append(process)
+
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
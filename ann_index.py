@@ -0,0 +1,336 @@
+"""
+Index approximatif des plus proches voisins (IVF) pour les embeddings de phrases.
+
+Les vecteurs sont normalisés (similarité cosinus = produit scalaire) et
+répartis en listes autour de centroïdes k-means ; une recherche ne lit que
+les N_PROBE listes les plus proches de la requête au lieu de toutes les
+phrases stockées. Tant que l'index est petit (< TRAIN_THRESHOLD vecteurs),
+la recherche reste exacte.
+
+Les fichiers sont en ajout seul : un nouveau document ajoute ses vecteurs
+sans réécrire l'index, et les autres processus voient la fin des fichiers
+au prochain appel. Les vecteurs ne sont pas chargés en mémoire : chaque
+processus projette les fichiers (np.memmap), et un ajout ne copie que les
+nouvelles lignes dans les listes IVF. Les centroïdes ne sont recalculés que lorsque
+l'index a quadruplé depuis le dernier entraînement.
+
+    index_dir/
+        index.json      dimension, génération, taille au dernier entraînement
+        vectors.f32     vecteurs float32 normalisés, ligne par ligne
+        meta.i64        (document_id, indice de phrase) par vecteur
+        assign.i32      liste IVF de chaque vecteur (après entraînement)
+        centroids.npy
+"""
+import os
+import json
+import logging
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows : pas de verrou inter-processus
+    fcntl = None
+
+INDEX_DIR = os.path.join('plagiarism_cache', 'sentence_ann')
+TRAIN_THRESHOLD = 1024
+N_PROBE = 8
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE = 20000
+SEED = 0
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _kmeans(vectors: np.ndarray, n_lists: int, iterations: int = KMEANS_ITERATIONS) -> np.ndarray:
+    """k-means sphérique sur un échantillon des vecteurs"""
+    generator = np.random.RandomState(SEED)
+    if len(vectors) > KMEANS_SAMPLE:
+        vectors = vectors[generator.choice(len(vectors), KMEANS_SAMPLE, replace=False)]
+    centroids = vectors[generator.choice(len(vectors), n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        labels = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, vectors)
+        counts = np.bincount(labels, minlength=n_lists)
+        empty = counts == 0
+        # Liste vide : réinitialisée sur un vecteur au hasard
+        sums[empty] = vectors[generator.choice(len(vectors), int(empty.sum()))]
+        centroids = _normalize(sums)
+    return centroids.astype(np.float32)
+
+
+def _map(path: str, dtype, shape: Tuple[int, ...]) -> np.ndarray:
+    """Vue en lecture seule du début d'un fichier en ajout seul : les pages sont lues à la demande"""
+    if shape[0] == 0:
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', shape=shape)
+
+
+class _RowList:
+    """Lignes d'une liste IVF, dans un tampon agrandi géométriquement (ajout en O(1) amorti)"""
+
+    def __init__(self):
+        self._rows = np.empty(16, dtype=np.int64)
+        self._size = 0
+
+    def extend(self, rows: np.ndarray):
+        size = self._size + len(rows)
+        if size > len(self._rows):
+            grown = np.empty(max(size, 2 * len(self._rows)), dtype=np.int64)
+            grown[:self._size] = self._rows[:self._size]
+            self._rows = grown
+        self._rows[self._size:size] = rows
+        self._size = size
+
+    def rows(self) -> np.ndarray:
+        return self._rows[:self._size]
+
+
+class IVFIndex:
+    """Index IVF persistant des vecteurs de phrases (document_id, indice de phrase)"""
+
+    def __init__(self, index_dir: str = INDEX_DIR, n_probe: int = N_PROBE,
+                 train_threshold: int = TRAIN_THRESHOLD):
+        self.index_dir = index_dir
+        self.n_probe = n_probe
+        self.train_threshold = train_threshold
+        os.makedirs(index_dir, exist_ok=True)
+        self._clear_memory()
+        with self._lock(exclusive=False):
+            self._refresh()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.index_dir, name)
+
+    def _clear_memory(self):
+        self.dim = None
+        self.generation = 0
+        self.trained_size = 0
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self.meta = np.zeros((0, 2), dtype=np.int64)
+        self.assign = None
+        self.centroids = None
+        self._lists = None
+
+    @contextmanager
+    def _lock(self, exclusive: bool):
+        if fcntl is None:
+            yield
+            return
+        with open(self._path('lock'), 'a+') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def __len__(self) -> int:
+        return len(self.meta)
+
+    # ---- lecture -------------------------------------------------------
+
+    def _read_header(self) -> Dict:
+        try:
+            with open(self._path('index.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _rows_on_disk(self) -> int:
+        if self.dim is None:
+            return 0
+        sizes = [os.path.getsize(self._path(name)) // width if os.path.exists(self._path(name)) else 0
+                 for name, width in (('meta.i64', 16), ('vectors.f32', 4 * self.dim))]
+        if self.centroids is not None:
+            path = self._path('assign.i32')
+            sizes.append(os.path.getsize(path) // 4 if os.path.exists(path) else 0)
+        # Un ajout interrompu laisse des fichiers de longueurs différentes
+        return min(sizes)
+
+    def _refresh(self):
+        """Charge les vecteurs ajoutés par d'autres processus depuis la dernière lecture"""
+        header = self._read_header()
+        if header.get('dim') != self.dim or header.get('generation', 0) != self.generation:
+            self._clear_memory()
+            if not header:
+                return
+            self.dim = header['dim']
+            self.generation = header.get('generation', 0)
+            self.trained_size = header.get('trained_size', 0)
+            self.vectors = np.zeros((0, self.dim), dtype=np.float32)
+            if os.path.exists(self._path('centroids.npy')) and self.trained_size:
+                self.centroids = np.load(self._path('centroids.npy'))
+                self.assign = np.zeros(0, dtype=np.int32)
+                self._lists = [_RowList() for _ in range(len(self.centroids))]
+
+        start, stop = len(self.meta), self._rows_on_disk()
+        if stop <= start:
+            return
+        self._map_files(stop)
+        self._extend_lists(start, stop)
+
+    def _map_files(self, rows: int):
+        """Projette en mémoire (memmap, sans copie) les rows premières lignes des fichiers"""
+        self.vectors = _map(self._path('vectors.f32'), np.float32, (rows, self.dim))
+        self.meta = _map(self._path('meta.i64'), np.int64, (rows, 2))
+        if self.centroids is not None:
+            self.assign = _map(self._path('assign.i32'), np.int32, (rows,))
+
+    def _extend_lists(self, start: int, stop: int):
+        """Ajoute les lignes start..stop à leurs listes IVF (coût proportionnel aux seules nouvelles lignes)"""
+        if self.centroids is None or stop <= start:
+            return
+        new_assign = np.asarray(self.assign[start:stop])
+        order = np.argsort(new_assign, kind='stable')
+        bounds = np.searchsorted(new_assign[order], np.arange(len(self.centroids) + 1))
+        for list_id in np.flatnonzero(np.diff(bounds)):
+            self._lists[list_id].extend(start + order[bounds[list_id]:bounds[list_id + 1]])
+
+    def document_ids(self) -> Set[int]:
+        with self._lock(exclusive=False):
+            self._refresh()
+        return set(int(doc_id) for doc_id in np.unique(self.meta[:, 0]))
+
+    # ---- écriture ------------------------------------------------------
+
+    def _write_header(self):
+        tmp_path = self._path(f'index.json.{os.getpid()}.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({'dim': self.dim, 'generation': self.generation,
+                       'trained_size': self.trained_size}, f)
+        os.replace(tmp_path, self._path('index.json'))
+
+    def _truncate_files(self, rows: int):
+        for name, width in (('meta.i64', 16), ('vectors.f32', 4 * self.dim), ('assign.i32', 4)):
+            path = self._path(name)
+            if os.path.exists(path) and os.path.getsize(path) > rows * width:
+                with open(path, 'r+b') as f:
+                    f.truncate(rows * width)
+
+    def _nearest_lists(self, vectors: np.ndarray) -> np.ndarray:
+        labels = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), 8192):
+            block = vectors[start:start + 8192]
+            labels[start:start + len(block)] = np.argmax(block @ self.centroids.T, axis=1)
+        return labels
+
+    def _train(self):
+        """(Ré)entraîne les centroïdes sur tous les vecteurs et réécrit les affectations"""
+        n_lists = max(8, int(np.sqrt(len(self.vectors))))
+        self.centroids = _kmeans(self.vectors, n_lists)
+        self.assign = self._nearest_lists(self.vectors)
+        for name, array in (('centroids.npy', self.centroids), ('assign.i32', self.assign)):
+            tmp_path = self._path(f'{name}.{os.getpid()}.tmp')
+            with open(tmp_path, 'wb') as f:
+                if name.endswith('.npy'):
+                    np.save(f, array)
+                else:
+                    array.tofile(f)
+            os.replace(tmp_path, self._path(name))
+        self.trained_size = len(self.vectors)
+        self.generation += 1
+        self._write_header()
+        # Nouvelles listes ; assign.i32 a été remplacé : nouvelle projection
+        self._lists = [_RowList() for _ in range(n_lists)]
+        self._map_files(len(self.meta))
+        self._extend_lists(0, len(self.meta))
+        logging.info(f"🧭 Index IVF entraîné : {len(self.vectors)} vecteurs, {n_lists} listes")
+
+    def add(self, vectors, document_id: int, sentence_indices: Optional[List[int]] = None) -> int:
+        """
+        Ajoute les vecteurs des phrases d'un document. Les vecteurs nuls
+        (phrase sans terme connu) sont ignorés. Renvoie le nombre ajouté.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim != 2 or len(vectors) == 0:
+            return 0
+        if sentence_indices is None:
+            sentence_indices = np.arange(len(vectors))
+        keep = np.linalg.norm(vectors, axis=1) > 0
+        vectors = _normalize(vectors[keep])
+        sentence_indices = np.asarray(sentence_indices, dtype=np.int64)[keep]
+        if len(vectors) == 0:
+            return 0
+
+        with self._lock(exclusive=True):
+            self._refresh()
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                self._write_header()
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Dimension {vectors.shape[1]} incompatible avec l'index ({self.dim})")
+            self._truncate_files(len(self.meta))
+
+            meta = np.column_stack([np.full(len(vectors), document_id, dtype=np.int64), sentence_indices])
+            with open(self._path('vectors.f32'), 'ab') as f:
+                vectors.tofile(f)
+            if self.centroids is not None:
+                with open(self._path('assign.i32'), 'ab') as f:
+                    self._nearest_lists(vectors).tofile(f)
+            # meta.i64 en dernier : une ligne n'est visible que lorsque tout est écrit
+            with open(self._path('meta.i64'), 'ab') as f:
+                meta.tofile(f)
+            # Fichiers projetés à nouveau : l'index existant n'est ni relu ni copié
+            start = len(self.meta)
+            self._map_files(start + len(vectors))
+
+            if (self.centroids is None and len(self.vectors) >= self.train_threshold) or \
+                    (self.centroids is not None and len(self.vectors) >= 4 * self.trained_size):
+                self._train()
+            else:
+                self._extend_lists(start, len(self.meta))
+        return len(vectors)
+
+    def reset(self):
+        """Vide l'index (par exemple après un changement de vocabulaire des embeddings)"""
+        with self._lock(exclusive=True):
+            for name in ('index.json', 'vectors.f32', 'meta.i64', 'assign.i32', 'centroids.npy'):
+                if os.path.exists(self._path(name)):
+                    os.remove(self._path(name))
+            self._clear_memory()
+
+    # ---- recherche -----------------------------------------------------
+
+    def search(self, queries, k: int = 5) -> List[List[Tuple[float, int, int]]]:
+        """
+        Les k plus proches voisins de chaque requête :
+        [(similarité cosinus, document_id, indice de phrase), ...] par requête,
+        du plus au moins similaire.
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        with self._lock(exclusive=False):
+            self._refresh()
+        if len(self.meta) == 0 or queries.ndim != 2 or len(queries) == 0 or queries.shape[1] != self.dim:
+            return [[] for _ in range(len(queries))]
+        queries = _normalize(queries)
+
+        if self.centroids is None:
+            all_scores = queries @ self.vectors.T
+            candidate_sets = [(None, scores) for scores in all_scores]
+        else:
+            n_probe = min(self.n_probe, len(self.centroids))
+            probes = np.argpartition(-(queries @ self.centroids.T), n_probe - 1, axis=1)[:, :n_probe]
+            candidate_sets = []
+            for query, lists in zip(queries, probes):
+                rows = np.concatenate([self._lists[l].rows() for l in lists])
+                candidate_sets.append((rows, self.vectors[rows] @ query))
+
+        results = []
+        for rows, scores in candidate_sets:
+            top = min(k, len(scores))
+            if top == 0:
+                results.append([])
+                continue
+            best = np.argpartition(-scores, top - 1)[:top]
+            best = best[np.argsort(-scores[best])]
+            ids = best if rows is None else rows[best]
+            results.append([(float(scores[b]), int(self.meta[i, 0]), int(self.meta[i, 1]))
+                            for b, i in zip(best, ids)])
+        return results
@@ -59,6 +59,9 @@ with app.app_context():
     # Make sure to import the models here or their tables won't be created
     import models  # noqa: F401
     db.create_all()
+    # create_all() never alters existing tables: add columns introduced since
+    for column in models.add_missing_columns(db.engine):
+        logging.info(f"Added missing column {column}")
     logging.info("Database tables created")
 
 # Initialiser le support des langues
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Benchmark : ancienne distance de Levenshtein (programmation dynamique en
+Python, textes tronqués à 1000 caractères) contre edit_distance (Myers
+bit-parallèle, textes complets, caractères ou mots).
+
+    python benchmark_edit_distance.py [--words 300 1000 3000] [--repeat 3]
+"""
+import argparse
+import random
+import time
+
+from edit_distance import myers_distance, bounded_distance, token_similarity, tokenize
+
+
+def legacy_levenshtein(s1, s2):
+    """Ancienne levenshtein_distance_manual (sentence_bert_detection), conservée pour comparaison"""
+    MAX_LEN = 1000
+    if len(s1) > MAX_LEN:
+        s1 = s1[:MAX_LEN//2] + s1[-MAX_LEN//2:]
+    if len(s2) > MAX_LEN:
+        s2 = s2[:MAX_LEN//2] + s2[-MAX_LEN//2:]
+    if len(s1) < len(s2):
+        return legacy_levenshtein(s2, s1)
+    if len(s2) == 0:
+        return len(s1)
+    if abs(len(s1) - len(s2)) > min(len(s1), len(s2)) * 0.8:
+        return max(len(s1), len(s2))
+    previous_row = list(range(len(s2) + 1))
+    for i, c1 in enumerate(s1):
+        current_row = [i + 1]
+        for j, c2 in enumerate(s2):
+            insertions = previous_row[j + 1] + 1
+            deletions = current_row[j] + 1
+            substitutions = previous_row[j] + (c1 != c2)
+            current_row.append(min(insertions, deletions, substitutions))
+        previous_row = current_row
+        if i > 100 and min(current_row) > len(s2) * 0.5:
+            return len(s1)
+    return previous_row[-1]
+
+
+VOCABULARY = ("analyse donnée modèle résultat méthode étude système recherche valeur "
+              "processus mesure contexte développement structure qualité théorie "
+              "approche information performance évaluation the of and to in is that "
+              "for with as on by this are be from at which an").split()
+
+
+def make_pair(n_words, edit_ratio, rng):
+    """Texte aléatoire et copie paraphrasée (substitutions, insertions, suppressions)"""
+    original = [rng.choice(VOCABULARY) for _ in range(n_words)]
+    copy = list(original)
+    for _ in range(int(n_words * edit_ratio)):
+        position = rng.randrange(len(copy))
+        operation = rng.random()
+        if operation < 0.6:
+            copy[position] = rng.choice(VOCABULARY)
+        elif operation < 0.8:
+            copy.insert(position, rng.choice(VOCABULARY))
+        elif len(copy) > 1:
+            del copy[position]
+    return ' '.join(original), ' '.join(copy)
+
+
+def timed(function, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def run(word_counts, repeat):
+    rng = random.Random(42)
+    print(f"{'mots':>6} {'cas':>10} {'ancien (ms)':>12} {'myers car. (ms)':>16} "
+          f"{'myers mots (ms)':>16} {'borné (ms)':>11} {'sim. mots':>10}")
+    for n_words in word_counts:
+        for label, edit_ratio in (('copie', 0.05), ('paraphrase', 0.3), ('distinct', 1.5)):
+            a, b = make_pair(n_words, edit_ratio, rng)
+            if label == 'distinct':
+                b = ' '.join(rng.choice(VOCABULARY) for _ in range(n_words))
+            tokens_a, tokens_b = tokenize(a), tokenize(b)
+
+            legacy_time, _ = timed(lambda: legacy_levenshtein(a, b), repeat)
+            chars_time, _ = timed(lambda: myers_distance(a, b), repeat)
+            words_time, distance = timed(lambda: myers_distance(tokens_a, tokens_b), repeat)
+            # Seuil typique : ne garder que les documents au-dessus de 80 % de similarité
+            k = int(max(len(tokens_a), len(tokens_b)) * 0.2)
+            bounded_time, _ = timed(lambda: bounded_distance(tokens_a, tokens_b, k), repeat)
+            similarity = token_similarity(tokens_a, tokens_b)
+
+            print(f"{n_words:>6} {label:>10} {legacy_time * 1000:>12.1f} {chars_time * 1000:>16.1f} "
+                  f"{words_time * 1000:>16.2f} {bounded_time * 1000:>11.2f} {similarity:>9.1f}%")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--words', type=int, nargs='+', default=[300, 1000, 3000])
+    parser.add_argument('--repeat', type=int, default=3)
+    arguments = parser.parse_args()
+    run(arguments.words, arguments.repeat)
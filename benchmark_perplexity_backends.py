@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Benchmark des backends de perplexité (perplexity_backends) : débit en
+tokens par seconde, mémoire résidente de pointe et écart de perplexité par
+document par rapport au backend 'eager', sur les textes de reference_corpus.
+
+Chaque backend tourne dans son propre processus (spawn) : la mémoire
+mesurée est celle de ce backend seul.
+
+    python benchmark_perplexity_backends.py [--backends eager int8 onnx] [--repeat 3] [--threads 4]
+"""
+import argparse
+import glob
+import multiprocessing
+import os
+import resource
+import time
+
+import numpy as np
+
+from perplexity_backends import BACKENDS
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reference_corpus')
+
+
+def load_samples():
+    samples = []
+    for path in sorted(glob.glob(os.path.join(CORPUS_DIR, '*.txt'))):
+        with open(path, encoding='utf-8', errors='ignore') as f:
+            text = f.read().strip()
+        if text:
+            samples.append((os.path.basename(path), text))
+    return samples
+
+
+def run_backend(backend, samples, repeat, threads):
+    """Exécuté dans un processus dédié : débit, mémoire et perplexité de chaque document"""
+    import torch
+    if threads:
+        torch.set_num_threads(threads)
+    from perplexity_backends import load_backend
+    from ai_perplexity_detectgpt import token_losses
+
+    start = time.perf_counter()
+    model, tokenizer = load_backend(backend)
+    load_time = time.perf_counter() - start
+
+    perplexities = {}
+    n_tokens = 0
+    best = None
+    for _ in range(repeat):
+        n_tokens = 0
+        start = time.perf_counter()
+        for name, text in samples:
+            losses, _ = token_losses(text, model, tokenizer)
+            n_tokens += len(losses)
+            perplexities[name] = float(np.exp(losses.mean())) if len(losses) else 0.0
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return {
+        'backend': backend,
+        'load_s': load_time,
+        'tokens_per_s': n_tokens / best if best else 0.0,
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'perplexities': perplexities,
+    }
+
+
+def run(backends, repeat, threads):
+    samples = load_samples()
+    if not samples:
+        print(f"Aucun texte dans {CORPUS_DIR}")
+        return
+    print(f"{len(samples)} documents, {sum(len(text) for _, text in samples)} caractères\n")
+
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for backend in backends:
+        with context.Pool(1) as pool:
+            results.append(pool.apply(run_backend, (backend, samples, repeat, threads)))
+
+    reference = next((r['perplexities'] for r in results if r['backend'] == 'eager'), None)
+    print(f"{'backend':>8} {'chargement (s)':>15} {'tokens/s':>10} {'RSS max (Mo)':>13} "
+          f"{'écart ppl moyen':>16} {'écart ppl max':>14}")
+    for result in results:
+        drift = ''
+        if reference:
+            gaps = [abs(result['perplexities'][name] - ppl) / ppl * 100
+                    for name, ppl in reference.items() if ppl > 0]
+            if gaps:
+                drift = f"{np.mean(gaps):>15.2f}% {np.max(gaps):>13.2f}%"
+        print(f"{result['backend']:>8} {result['load_s']:>15.2f} {result['tokens_per_s']:>10.0f} "
+              f"{result['max_rss_mb']:>13.0f} {drift}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backends', nargs='+', choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=0, help="threads PyTorch (0 : valeur par défaut)")
+    args = parser.parse_args()
+    run(args.backends, args.repeat, args.threads)
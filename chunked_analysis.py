@@ -0,0 +1,372 @@
+"""
+Analyse complète des documents longs par fenêtres glissantes.
+
+Au lieu de tronquer le texte à 3000 caractères (optimize_text_for_analysis),
+le document est parcouru phrase par phrase et découpé en fenêtres alignées
+sur les phrases. Chaque fenêtre est évaluée indépendamment (plagiat TF-IDF et
+une passe GPT-2 dont les pertes par token donnent la perplexité de la fenêtre
+et celles de ses phrases), puis les résultats sont fusionnés en scores globaux
+et en scores par phrase. La mémoire de pointe dépend de la taille d'une fenêtre,
+pas de la longueur du document. Les phrases déjà évaluées (perplexity_cache)
+ne repassent pas dans le modèle quand elles sont aux bords d'une fenêtre.
+"""
+import math
+import logging
+from array import array
+from typing import Iterator, List, Tuple, Dict, Any, Optional
+
+import numpy as np
+
+from text_segmentation import segment_document, strip_span
+
+WINDOW_CHARS = 3000          # Taille du coeur d'une fenêtre (~700 tokens GPT-2)
+OVERLAP_CHARS = 300          # Contexte précédent donné au modèle, non compté
+MIN_PLAGIARISM_SENTENCE = 20  # Même seuil que tfidf_cosine_plagiarism_optimized
+MIN_BURSTINESS_SENTENCE = 10  # Même seuil que burstiness_optimized
+
+
+class TextWindow:
+    """Fenêtre d'analyse : un coeur de phrases entières précédé d'un contexte"""
+
+    def __init__(self, text: str, spans: List[Tuple[int, int]], overlap_chars: int):
+        self.text = text
+        self.spans = spans
+        self.core_start = spans[0][0]
+        self.core_end = spans[-1][1]
+        context_start = max(0, self.core_start - overlap_chars)
+        # Ne pas couper un mot en début de contexte
+        while 0 < context_start < self.core_start and not text[context_start - 1].isspace():
+            context_start += 1
+        self.context_start = context_start
+
+    @property
+    def context(self) -> str:
+        return self.text[self.context_start:self.core_start]
+
+    @property
+    def core(self) -> str:
+        return self.text[self.core_start:self.core_end]
+
+    @property
+    def full(self) -> str:
+        return self.text[self.context_start:self.core_end]
+
+    def sentences(self) -> Iterator[Tuple[int, int, str]]:
+        for start, end in self.spans:
+            yield start, end, self.text[start:end]
+
+
+def iter_windows(text: str, window_chars: int = WINDOW_CHARS,
+                 overlap_chars: int = OVERLAP_CHARS) -> Iterator[TextWindow]:
+    """Découpe le texte en fenêtres de phrases entières; chaque phrase appartient à une seule fenêtre"""
+    spans = []
+    for sentence_span in segment_document(text).sentence_spans():
+        for span in _split_long_span(text, sentence_span, window_chars):
+            if spans and span[1] - spans[0][0] > window_chars:
+                yield TextWindow(text, spans, overlap_chars)
+                spans = []
+            spans.append(span)
+    if spans:
+        yield TextWindow(text, spans, overlap_chars)
+
+
+def _split_long_span(text: str, span: Tuple[int, int], max_chars: int) -> Iterator[Tuple[int, int]]:
+    """Coupe aux espaces une "phrase" plus longue qu'une fenêtre (texte PDF sans ponctuation)"""
+    start, end = span
+    while end - start > max_chars:
+        cut = text.rfind(' ', start + 1, start + max_chars)
+        if cut <= start:
+            cut = start + max_chars
+        piece = strip_span(text, start, cut)
+        if piece:
+            yield piece
+        start = cut
+        while start < end and text[start].isspace():
+            start += 1
+    if end > start:
+        yield (start, end)
+
+
+class SentenceScores:
+    """Scores par phrase stockés dans des tableaux compacts"""
+
+    def __init__(self):
+        self.starts = array('i')
+        self.ends = array('i')
+        self.plagiarism_similarity = array('f')
+        self.perplexity = array('f')  # NaN si la phrase n'a pas été évaluée
+
+    def append(self, start: int, end: int, similarity: float, perplexity: float = math.nan):
+        self.starts.append(start)
+        self.ends.append(end)
+        self.plagiarism_similarity.append(similarity)
+        self.perplexity.append(perplexity)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def to_list(self) -> List[Dict[str, Any]]:
+        return [
+            {
+                'start': self.starts[i],
+                'end': self.ends[i],
+                'plagiarism_similarity': round(float(self.plagiarism_similarity[i]), 4),
+                'perplexity': (round(float(self.perplexity[i]), 2)
+                               if not math.isnan(self.perplexity[i]) else None),
+            }
+            for i in range(len(self))
+        ]
+
+
+class _PlagiarismAccumulator:
+    """Fusion en flux de la formule de tfidf_cosine_plagiarism_optimized"""
+
+    def __init__(self):
+        self.weighted_sum = 0.0
+        self.flagged = 0
+        self.count = 0
+        self.has_long_phrases = False
+        self.seen = set()  # empreintes des phrases (entiers), pas les phrases
+        self.repeated = False
+
+    def add_sentence(self, sentence: str):
+        self.count += 1
+        if len(sentence) > 120:
+            self.has_long_phrases = True
+        fingerprint = hash(sentence)
+        if fingerprint in self.seen:
+            self.repeated = True
+        self.seen.add(fingerprint)
+
+    def add_match(self, sentence_length: int, max_sim: float):
+        from ai_perplexity_detectgpt import sentence_plagiarism_weight
+        self.weighted_sum += sentence_plagiarism_weight(sentence_length, max_sim)
+        self.flagged += 1
+
+    def score(self) -> float:
+        from ai_perplexity_detectgpt import suspicious_heuristic_score, calibrate_plagiarism_score
+        if self.count == 0:
+            return 0.0
+        heuristic = suspicious_heuristic_score(self.has_long_phrases, self.repeated,
+                                               len(self.seen) / self.count)
+        if self.flagged == 0:
+            return heuristic
+        return calibrate_plagiarism_score(self.weighted_sum / self.flagged, heuristic)
+
+
+def _window_max_similarities(sentences: List[str], vectorizer, ref_vecs,
+                             excluded_rows: Optional[np.ndarray] = None) -> np.ndarray:
+    """Similarité maximale de chaque phrase de la fenêtre avec le corpus de référence"""
+    from sparse_topk import max_similarities
+    submitted_vecs = vectorizer.transform(sentences)
+    return max_similarities(submitted_vecs, ref_vecs, excluded_rows)
+
+
+def _window_token_losses(window: TextWindow, model, tokenizer,
+                         deadline=None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Pertes des tokens du coeur de la fenêtre, conditionnées par le contexte
+    précédent, avec la fin de chaque token en position absolue dans le texte.
+    Une seule passe du modèle sur contexte + coeur.
+    """
+    from ai_perplexity_detectgpt import token_losses
+    losses, token_ends = token_losses(window.full, model, tokenizer, deadline)
+    token_ends = token_ends + window.context_start
+    in_core = token_ends > window.core_start
+    return losses[in_core], token_ends[in_core]
+
+
+def _window_sentence_losses(window: TextWindow, model, tokenizer, overlap_chars: int,
+                            deadline=None) -> Optional[List[Tuple[np.ndarray, np.ndarray]]]:
+    """
+    Pertes des tokens de chaque phrase de la fenêtre (split_sentence_losses),
+    avec le cache de perplexité (perplexity_cache) : les phrases déjà en cache
+    aux deux bords de la fenêtre ne repassent pas dans le modèle ; celles du
+    milieu sont recalculées pour garder un contexte continu. None si
+    l'échéance est atteinte pendant la passe.
+    """
+    from ai_perplexity_detectgpt import perplexity_model_id
+    from ai_likelihood_profile import split_sentence_losses
+    from perplexity_cache import get_perplexity_cache
+
+    sentences = [sentence for _, _, sentence in window.sentences()]
+    cache, model_id = get_perplexity_cache(), perplexity_model_id(model)
+    if cache is not None and model_id:
+        sentence_losses = cache.lookup(model_id, sentences)
+    else:
+        sentence_losses = [None] * len(sentences)
+    todo = [i for i, value in enumerate(sentence_losses) if value is None]
+    if not todo:
+        return sentence_losses
+
+    first, last = todo[0], todo[-1] + 1
+    if first > 0 or last < len(sentences):
+        # Le contexte précédent reste le texte d'origine, phrases en cache comprises
+        window = TextWindow(window.text, window.spans[first:last], overlap_chars)
+    losses, token_ends = _window_token_losses(window, model, tokenizer, deadline)
+    if not len(losses):
+        return None
+    sentence_losses[first:last] = split_sentence_losses(losses, token_ends, window.spans)
+    if cache is not None and model_id:
+        cache.store(model_id, sentences[first:last], sentence_losses[first:last])
+    return sentence_losses
+
+
+def analyze_text_chunked(text: str, ignore_filename=None, window_chars: int = WINDOW_CHARS,
+                         overlap_chars: int = OVERLAP_CHARS, with_ai: bool = True,
+                         model=None, tokenizer=None, deadline=None) -> Dict[str, Any]:
+    """
+    Analyse plagiat + IA sur l'intégralité du texte, fenêtre par fenêtre.
+
+    Retourne le score de plagiat global, le résultat IA calibré (même format
+    que ai_detection_score_optimized), le profil IA par token et par phrase
+    (AILikelihoodProfile, None sans analyse IA) et les scores par phrase. Si l'échéance
+    (AnalysisDeadline) est atteinte, les fenêtres restantes sont ignorées et le
+    résultat porte partial=True avec le pourcentage de texte couvert par étape.
+    """
+    from ai_perplexity_detectgpt import (get_reference_data, reference_exclusion, get_model,
+                                         burstiness_from_perplexities, calibrate_ai_result,
+                                         PLAGIARISM_SIMILARITY_THRESHOLD)
+    from ai_likelihood_profile import AILikelihoodProfile, perplexities, sentence_loss_sums
+    from timeout_optimization import deadline_expired
+
+    text = text or ""
+    _, vectorizer, ref_vecs = get_reference_data()
+    excluded_rows = reference_exclusion(ignore_filename)
+    has_reference = vectorizer is not None and ref_vecs is not None
+
+    run_ai = with_ai and len(text) >= 100
+    if run_ai and model is None:
+        model, tokenizer = get_model()
+
+    plagiarism = _PlagiarismAccumulator()
+    sentence_scores = SentenceScores()
+    total_nll = 0.0
+    total_tokens = 0
+    burstiness_ppls = array('f')  # perplexité de chaque phrase, pour la burstiness
+    # Profil IA du document (AILikelihoodProfile), rempli fenêtre par fenêtre
+    profile_token_ends = array('i')
+    profile_token_logprobs = array('f')
+    profile_starts = array('i')
+    profile_ends = array('i')
+    profile_ppls = array('f')
+    n_windows = 0
+
+    # Caractères du document traités par chaque étape
+    covered = {'segmentation': 0, 'tfidf': 0, 'perplexity': 0}
+    segmentation_done = True
+
+    for window in iter_windows(text, window_chars, overlap_chars):
+        if deadline_expired(deadline):
+            segmentation_done = False
+            break
+        n_windows += 1
+        covered['segmentation'] = window.core_end
+
+        # Plagiat : phrases de la fenêtre contre le corpus de référence
+        candidates = []
+        for start, end, sentence in window.sentences():
+            if len(sentence) > MIN_PLAGIARISM_SENTENCE:
+                plagiarism.add_sentence(sentence)
+                candidates.append((start, end, sentence))
+        covered['tfidf'] = window.core_end
+
+        # IA : une passe sur la fenêtre, perplexité de chaque phrase par ses tokens
+        window_ppls = np.full(len(window.spans), np.nan, dtype=np.float32)
+        if run_ai and not deadline_expired(deadline):
+            sentence_losses = _window_sentence_losses(window, model, tokenizer, overlap_chars, deadline)
+            if sentence_losses is not None:
+                # Seuls les tokens des phrases comptent, qu'ils viennent du modèle ou du cache
+                sums, counts = sentence_loss_sums(sentence_losses)
+                total_nll += float(sums.sum())
+                total_tokens += int(counts.sum())
+                window_ppls = perplexities(sums, counts)
+                covered['perplexity'] = window.core_end
+                for (start, end), (losses, ends) in zip(window.spans, sentence_losses):
+                    profile_token_ends.frombytes((ends + start).astype(np.intc).tobytes())
+                    profile_token_logprobs.frombytes((-losses).astype(np.float32).tobytes())
+                for (start, end), sentence_ppl in zip(window.spans, window_ppls):
+                    profile_starts.append(start)
+                    profile_ends.append(end)
+                    profile_ppls.append(sentence_ppl)
+                    if end - start > MIN_BURSTINESS_SENTENCE:
+                        burstiness_ppls.append(sentence_ppl)
+
+        if candidates:
+            if has_reference:
+                max_sims = _window_max_similarities([c[2] for c in candidates], vectorizer,
+                                                    ref_vecs, excluded_rows)
+            else:
+                max_sims = np.zeros(len(candidates), dtype=np.float32)
+            ppl_by_start = dict(zip((span[0] for span in window.spans), window_ppls))
+            for (start, end, sentence), max_sim in zip(candidates, max_sims):
+                sentence_scores.append(start, end, float(max_sim), float(ppl_by_start[start]))
+                if max_sim > PLAGIARISM_SIMILARITY_THRESHOLD:
+                    plagiarism.add_match(len(sentence), float(max_sim))
+
+        if run_ai and covered['perplexity'] != window.core_end:
+            segmentation_done = False  # échéance atteinte pendant la perplexité
+            break
+
+    ai_profile = None
+    if run_ai and total_tokens:
+        ppl = math.exp(total_nll / total_tokens)
+        ai_result = calibrate_ai_result(ppl, burstiness_from_perplexities(burstiness_ppls))
+        ai_profile = AILikelihoodProfile(profile_token_ends, profile_token_logprobs,
+                                         profile_starts, profile_ends, profile_ppls)
+    else:
+        ai_result = _empty_ai_result()
+
+    # Sans corpus aucune phrase n'est retenue : score() retombe sur l'heuristique
+    plagiarism_score = plagiarism.score()
+
+    text_length = max(1, len(text))
+    last_end = covered['segmentation']
+
+    def stage_coverage(chars: int) -> float:
+        if segmentation_done and chars == last_end:
+            return 100.0
+        return round(100.0 * chars / text_length, 1)
+
+    stages = {
+        'segmentation': stage_coverage(last_end),
+        'tfidf': stage_coverage(covered['tfidf']),
+        'perplexity': stage_coverage(covered['perplexity']) if run_ai else 100.0,
+    }
+    # La burstiness provient des mêmes passes que la perplexité
+    coverage = min(stages.values())
+    partial = coverage < 100.0
+
+    if partial:
+        # Sans échéance, seule une passe du modèle vide (texte sans token) rend l'analyse partielle
+        elapsed = f" après {deadline.elapsed():.1f}s" if deadline is not None else ""
+        logging.warning(f"⏰ Analyse partielle{elapsed} : couverture {stages}")
+    logging.info(f"📄 Analyse par fenêtres : {len(text)} caractères, {n_windows} fenêtres, "
+                 f"{len(sentence_scores)} phrases")
+
+    return {
+        'plagiarism': {
+            'score': round(plagiarism_score, 1),
+            'sentences_flagged': plagiarism.flagged,
+        },
+        'ai_generated': ai_result,
+        'ai_profile': ai_profile,
+        'sentences': sentence_scores,
+        'windows': n_windows,
+        'partial': partial,
+        'coverage': coverage,
+        'stages': stages,
+    }
+
+
+def _empty_ai_result() -> Dict[str, Any]:
+    """Résultat IA nul (texte trop court), identique à ai_detection_score_optimized"""
+    return {
+        "score": 0.0,
+        "perplexity": 0.0,
+        "burstiness": 0.0,
+        "details": {
+            "norm_ppl": 0.0,
+            "norm_burstiness": 0.0
+        }
+    }
@@ -0,0 +1,200 @@
+"""
+Tâches de similarité de cohorte : une vue « qui a copié sur qui » pour une classe.
+
+Un enseignant choisit un ensemble de ses documents ; create_cohort met en
+file une ligne CohortAnalysis et les workers d'analyse (analysis_worker.py)
+calculent la matrice de similarité deux à deux entre les tâches de documents
+(voir cohort_similarity.py). La matrice, les paires les plus proches et leurs
+passages alignés sont enregistrés sur la ligne et exportés en JSON ou CSV.
+"""
+import io
+import csv
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import update
+
+from app import db
+from models import CohortAnalysis, Document, DocumentStatus, JobStatus
+from analysis_queue import (LEASE_SECONDS, MAX_ATTEMPTS, LeaseHeartbeat, fail_expired_leases,
+                            lease_next, lease_owned, renew_lease)
+
+MAX_COHORT_DOCUMENTS = 2000
+
+
+def create_cohort(user_id: str, document_ids: List[int], name: str, method: str = 'tfidf') -> CohortAnalysis:
+    """Met en file l'analyse de cohorte des documents terminés de l'utilisateur parmi document_ids"""
+    from cohort_similarity import METHODS
+
+    if method not in METHODS:
+        raise ValueError(f"Unknown similarity method: {method}")
+    owned = [row[0] for row in db.session.query(Document.id)
+             .filter(Document.id.in_(document_ids),
+                     Document.user_id == user_id,
+                     Document.status == DocumentStatus.COMPLETED)
+             .order_by(Document.id).all()]
+    if len(owned) < 2:
+        raise ValueError("A cohort needs at least two analysed documents")
+    if len(owned) > MAX_COHORT_DOCUMENTS:
+        raise ValueError(f"A cohort is limited to {MAX_COHORT_DOCUMENTS} documents")
+
+    cohort = CohortAnalysis()
+    cohort.user_id = user_id
+    cohort.name = name or f"Cohort of {len(owned)} documents"
+    cohort.method = method
+    cohort.document_ids = owned
+    cohort.status = JobStatus.QUEUED
+    cohort.attempts = 0
+    cohort.max_attempts = MAX_ATTEMPTS
+    db.session.add(cohort)
+    db.session.commit()
+    return cohort
+
+
+def lease_next_cohort(worker_id: str, lease_seconds: int = LEASE_SECONDS) -> Optional[CohortAnalysis]:
+    """Réserve atomiquement la prochaine cohorte en attente (mêmes baux que lease_next_job)"""
+    fail_expired_leases(CohortAnalysis, datetime.now(), "Cohort")
+    return lease_next(CohortAnalysis, worker_id, (CohortAnalysis.created_at, CohortAnalysis.id), lease_seconds)
+
+
+def extend_cohort_lease(cohort_id: int, worker_id: str, lease_seconds: int = LEASE_SECONDS) -> bool:
+    """Renouvelle le bail d'une cohorte en cours ; False si le worker ne le détient plus"""
+    return renew_lease(CohortAnalysis, cohort_id, worker_id, lease_seconds)
+
+
+def _finish_cohort(cohort_id: int, worker_id: str, **values) -> bool:
+    """
+    Dernière mise à jour d'une cohorte, appliquée seulement si ce worker
+    détient encore le bail : un worker dont le bail a expiré n'écrase jamais
+    le résultat du worker qui a repris la cohorte. Renvoie False si le bail
+    a été perdu.
+    """
+    now = datetime.now()
+    finished = db.session.execute(
+        update(CohortAnalysis)
+        .where(lease_owned(CohortAnalysis, cohort_id, worker_id))
+        .values(lease_owner=None, lease_expires_at=None, updated_at=now, **values)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    if finished.rowcount != 1:
+        logging.warning(f"Worker {worker_id} lost the lease on cohort {cohort_id}, result discarded")
+        return False
+    return True
+
+
+def run_cohort(cohort: CohortAnalysis, worker_id: str) -> bool:
+    """
+    Calcule et enregistre la matrice de similarité et les meilleures paires
+    d'une cohorte. Renvoie False si le bail a été perdu avant l'écriture.
+    """
+    from cohort_similarity import pairwise_similarity, pair_passages
+    from embedding_store import encode_embeddings
+
+    documents = {document.id: document for document in
+                 Document.query.filter(Document.id.in_(cohort.document_ids)).all()}
+    # Les documents supprimés depuis la création de la cohorte sont écartés
+    document_ids = [document_id for document_id in cohort.document_ids if document_id in documents]
+    texts = [documents[document_id].extracted_text or "" for document_id in document_ids]
+
+    matrix, pairs = pairwise_similarity(texts, cohort.method)
+    passages = pair_passages(texts, pairs)
+
+    return _finish_cohort(
+        cohort.id, worker_id,
+        document_ids=document_ids,
+        similarity_matrix=encode_embeddings(matrix, 'float16') if matrix is not None else None,
+        top_pairs=[{
+            'document_a': document_ids[i],
+            'document_b': document_ids[j],
+            'similarity': round(similarity * 100, 1),
+            'passages': passages.get((i, j), []),
+        } for i, j, similarity in pairs],
+        status=JobStatus.DONE,
+        last_error=None,
+        completed_at=datetime.now(),
+    )
+
+
+def fail_cohort(cohort_id: int, worker_id: str, error: str) -> bool:
+    """
+    Enregistre une tentative échouée : la cohorte est remise en file tant
+    qu'il reste des tentatives, sinon marquée en échec. Renvoie True si elle
+    sera relancée.
+    """
+    cohort = db.session.get(CohortAnalysis, cohort_id)
+    will_retry = cohort is not None and cohort.attempts < cohort.max_attempts
+    _finish_cohort(cohort_id, worker_id, status=JobStatus.QUEUED if will_retry else JobStatus.FAILED,
+                   last_error=error[:2000] if error else None)
+    return will_retry
+
+
+def process_next_cohort(worker_id: str) -> bool:
+    """Prend et calcule une cohorte. Renvoie False si aucune n'attend."""
+    cohort = lease_next_cohort(worker_id)
+    if cohort is None:
+        return False
+
+    cohort_id = cohort.id
+    logging.info(f"Worker {worker_id} computing cohort {cohort_id} ({len(cohort.document_ids)} documents, "
+                 f"attempt {cohort.attempts})")
+    heartbeat = LeaseHeartbeat(lambda: extend_cohort_lease(cohort_id, worker_id), f"cohort {cohort_id}")
+    heartbeat.start()
+    try:
+        if run_cohort(cohort, worker_id):
+            db.session.refresh(cohort)
+            logging.info(f"Cohort {cohort_id} done: {len(cohort.top_pairs)} pairs above threshold")
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Cohort {cohort_id} failed: {e}")
+        will_retry = fail_cohort(cohort_id, worker_id, f"{type(e).__name__}: {e}")
+        logging.info(f"Cohort {cohort_id} {'re-queued' if will_retry else 'marked as failed'}")
+    finally:
+        heartbeat.stop()
+    return True
+
+
+def cohort_matrix(cohort: CohortAnalysis) -> Optional[List[List[float]]]:
+    """Matrice de similarité en pourcentages, pour la carte de chaleur (None si absente)"""
+    if not cohort.similarity_matrix:
+        return None
+    from embedding_store import decode_embeddings
+    matrix = decode_embeddings(cohort.similarity_matrix).astype(float) * 100
+    return [[round(value, 1) for value in row] for row in matrix]
+
+
+def _document_names(cohort: CohortAnalysis) -> Dict[int, str]:
+    return dict(db.session.query(Document.id, Document.original_filename)
+                .filter(Document.id.in_(cohort.document_ids)).all())
+
+
+def export_cohort_json(cohort: CohortAnalysis) -> Dict:
+    """Résultat complet de la cohorte : documents, matrice et meilleures paires avec leurs passages"""
+    names = _document_names(cohort)
+    return {
+        'id': cohort.id,
+        'name': cohort.name,
+        'method': cohort.method,
+        'status': cohort.status.value,
+        'completed_at': cohort.completed_at.isoformat() if cohort.completed_at else None,
+        'documents': [{'id': document_id, 'filename': names.get(document_id)}
+                      for document_id in cohort.document_ids],
+        'matrix': cohort_matrix(cohort),
+        'top_pairs': cohort.top_pairs or [],
+    }
+
+
+def export_cohort_csv(cohort: CohortAnalysis) -> str:
+    """Meilleures paires, une ligne par paire"""
+    names = _document_names(cohort)
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(['document_a', 'filename_a', 'document_b', 'filename_b', 'similarity',
+                     'passages', 'matched_words'])
+    for pair in cohort.top_pairs or []:
+        writer.writerow([pair['document_a'], names.get(pair['document_a'], ''),
+                         pair['document_b'], names.get(pair['document_b'], ''),
+                         pair['similarity'], len(pair['passages']),
+                         sum(passage['tokens'] for passage in pair['passages'])])
+    return output.getvalue()
@@ -0,0 +1,138 @@
+"""
+Matrice de similarité deux à deux d'une cohorte de soumissions.
+
+Les représentations des documents sont calculées une seule fois : vecteurs
+TF-IDF normalisés (matrice creuse) ou signatures MinHash. La matrice n x n
+est ensuite produite par blocs de lignes (produit creux X[bloc] @ X.T, ou
+comparaison des signatures bloc contre bloc) : la mémoire de pointe dépend
+de la taille d'un bloc, pas du carré de la cohorte. Seules les meilleures
+paires sont gardées (tas borné), et la matrice complète n'est conservée
+que pour les cohortes assez petites pour une carte de chaleur.
+
+Les paires retenues sont ensuite alignées (passage_alignment) dans un index
+winnowing temporaire contenant uniquement la cohorte.
+"""
+import os
+import heapq
+import shutil
+import logging
+import tempfile
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy import sparse
+
+BLOCK_ROWS = 64
+TOP_PAIRS = 50
+MIN_PAIR_SIMILARITY = 0.2
+HEATMAP_MAX_DOCUMENTS = 500   # Au-delà, seules les meilleures paires sont conservées
+MINHASH_COLUMN_BLOCK = 512    # Signatures comparées par blocs de colonnes (mémoire bornée)
+METHODS = ('tfidf', 'minhash')
+
+
+def tfidf_matrix(texts: Sequence[str]) -> sparse.csr_matrix:
+    """Vecteurs TF-IDF (mots et bigrammes) normalisés, un document par ligne"""
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    vectorizer = TfidfVectorizer(ngram_range=(1, 2), sublinear_tf=True, min_df=1, dtype=np.float32)
+    return vectorizer.fit_transform(texts).tocsr()
+
+
+def minhash_signatures(texts: Sequence[str]) -> np.ndarray:
+    """Signatures MinHash (documents x permutations) de l'ensemble des mots"""
+    from minhash_lsh import MinHashLSH, NUM_PERM
+    hasher = MinHashLSH(':memory:')
+    signatures = np.empty((len(texts), NUM_PERM), dtype=np.uint32)
+    for row, text in enumerate(texts):
+        signatures[row] = hasher.signature(text)
+    return signatures
+
+
+def similarity_blocks(method: str, representation, block_rows: int = BLOCK_ROWS) -> Iterator[Tuple[int, np.ndarray]]:
+    """(première ligne, similarités du bloc de lignes contre tous les documents)"""
+    n = representation.shape[0]
+    if method == 'tfidf':
+        transposed = representation.T.tocsc()
+        for start in range(0, n, block_rows):
+            block = representation[start:start + block_rows] @ transposed
+            yield start, block.toarray().astype(np.float32)
+    elif method == 'minhash':
+        for start in range(0, n, block_rows):
+            rows = representation[start:start + block_rows]
+            block = np.empty((rows.shape[0], n), dtype=np.float32)
+            for column in range(0, n, MINHASH_COLUMN_BLOCK):
+                columns = representation[column:column + MINHASH_COLUMN_BLOCK]
+                block[:, column:column + columns.shape[0]] = (rows[:, None, :] == columns[None, :, :]).mean(axis=2)
+            yield start, block
+    else:
+        raise ValueError(f"Méthode de similarité inconnue : {method}")
+
+
+def pairwise_similarity(texts: Sequence[str], method: str = 'tfidf', top_pairs: int = TOP_PAIRS,
+                        min_similarity: float = MIN_PAIR_SIMILARITY,
+                        block_rows: int = BLOCK_ROWS) -> Tuple[Optional[np.ndarray], List[Tuple[int, int, float]]]:
+    """
+    Matrice de similarité (None si la cohorte dépasse HEATMAP_MAX_DOCUMENTS)
+    et meilleures paires (i < j, similarité), par similarité décroissante.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Méthode de similarité inconnue : {method}")
+    n = len(texts)
+    representation = tfidf_matrix(texts) if method == 'tfidf' else minhash_signatures(texts)
+
+    matrix = np.zeros((n, n), dtype=np.float16) if n <= HEATMAP_MAX_DOCUMENTS else None
+    heap = []   # (similarité, i, j) : les top_pairs meilleures
+    for start, block in similarity_blocks(method, representation, block_rows):
+        if matrix is not None:
+            matrix[start:start + block.shape[0]] = block
+        rows = np.arange(start, start + block.shape[0])
+        # Triangle supérieur uniquement : chaque paire une fois, sans la diagonale
+        block[np.arange(n)[None, :] <= rows[:, None]] = -1.0
+        candidates = np.flatnonzero(block >= min_similarity)
+        if len(candidates) > top_pairs:
+            candidates = candidates[np.argpartition(block.ravel()[candidates], -top_pairs)[-top_pairs:]]
+        for flat in candidates:
+            i, j = divmod(int(flat), n)
+            item = (float(block[i, j]), start + i, j)
+            if len(heap) < top_pairs:
+                heapq.heappush(heap, item)
+            elif item > heap[0]:
+                heapq.heapreplace(heap, item)
+
+    pairs = [(i, j, similarity) for similarity, i, j in sorted(heap, reverse=True)]
+    return matrix, pairs
+
+
+def pair_passages(texts: Sequence[str], pairs: List[Tuple[int, int, float]]) -> Dict[Tuple[int, int], List[Dict]]:
+    """Passages alignés de chaque paire (positions dans les deux documents)"""
+    from winnowing import WinnowingIndex
+    from passage_alignment import PassageAligner
+
+    involved = sorted({index for i, j, _ in pairs for index in (i, j)})
+    if not involved:
+        return {}
+    directory = tempfile.mkdtemp(prefix='cohort_')
+    try:
+        index = WinnowingIndex(os.path.join(directory, 'cohort.db'))
+        for position in involved:
+            index.add_document(str(position), texts[position])
+        aligner = PassageAligner(index)
+        partners = {}
+        for i, j, _ in pairs:
+            partners.setdefault(i, set()).add(j)
+
+        passages = {}
+        for i, others in partners.items():
+            keys = [str(position) for position in involved if position not in others]
+            for passage in aligner.align(texts[i], exclude_keys=keys):
+                j = int(passage.doc_key)
+                passages.setdefault((i, j), []).append({
+                    'start': passage.start, 'end': passage.end,
+                    'other_start': passage.source_start, 'other_end': passage.source_end,
+                    'similarity': passage.similarity, 'tokens': passage.tokens,
+                })
+        return passages
+    except Exception as e:
+        logging.error(f"Erreur alignement des paires de la cohorte: {e}")
+        return {}
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
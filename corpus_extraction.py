@@ -0,0 +1,80 @@
+"""
+Extraction du texte des fichiers du corpus de référence selon leur format.
+
+Les .docx et .pdf de reference_corpus/ étaient lus comme du texte brut, ce
+qui indexait le binaire zip/PDF. Le texte est maintenant extrait avec les
+mêmes fonctions que les documents envoyés (file_utils) et mis en cache sous
+plagiarism_cache/corpus_text/<sha256>.txt : un fichier dont les octets n'ont
+pas changé n'est jamais ré-extrait, même renommé.
+"""
+import os
+import hashlib
+import logging
+from typing import Optional
+
+TEXT_CACHE_DIR = os.path.join('plagiarism_cache', 'corpus_text')
+
+# Extension -> extracteur de file_utils
+_EXTRACTORS = {
+    '.txt': 'txt',
+    '.md': 'txt',
+    '.pdf': 'pdf',
+    '.docx': 'docx',
+}
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_supported(path: str) -> bool:
+    return os.path.splitext(path)[1].lower() in _EXTRACTORS
+
+
+def _extract(path: str) -> Optional[str]:
+    """Texte du fichier selon son extension; None si le format n'est pas pris en charge ou illisible"""
+    from file_utils import extract_text_from_txt, extract_text_from_pdf, extract_text_from_docx
+
+    kind = _EXTRACTORS.get(os.path.splitext(path)[1].lower())
+    if kind is None:
+        logging.warning(f"📚 Format non pris en charge ignoré : {os.path.basename(path)}")
+        return None
+    try:
+        if kind == 'pdf':
+            # Jamais de repli sur les octets bruts : ils pollueraient l'index
+            return extract_text_from_pdf(path, binary_fallback=False)
+        if kind == 'docx':
+            return extract_text_from_docx(path)
+        return extract_text_from_txt(path)
+    except Exception as e:
+        logging.error(f"Failed to extract reference text from {path}: {e}")
+        return None
+
+
+def extract_corpus_text(path: str, sha256: Optional[str] = None,
+                        cache_dir: str = TEXT_CACHE_DIR) -> str:
+    """
+    Texte d'un fichier du corpus, depuis le cache si son contenu a déjà été
+    extrait. Renvoie une chaîne vide pour un format non pris en charge.
+    """
+    if sha256 is None:
+        sha256 = file_sha256(path)
+    cache_path = os.path.join(cache_dir, f'{sha256}.txt')
+    if os.path.exists(cache_path):
+        with open(cache_path, encoding='utf-8') as f:
+            return f.read()
+
+    text = _extract(path)
+    if text is None:
+        return ""
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, cache_path)
+    return text
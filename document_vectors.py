@@ -0,0 +1,302 @@
+"""
+Vecteurs TF-IDF des documents stockés, calculés une seule fois au stockage.
+
+Chaque document est analysé (n-grammes) au moment où il est enregistré ; ses
+comptes de termes sont écrits dans la table tfidf_document_vectors de la base
+du service, et ses nouveaux termes ajoutés au vocabulaire persistant
+(tfidf_terms, identifiants attribués dans l'ordre d'apparition). Aucun
+réentraînement n'est nécessaire quand le corpus grandit.
+
+Les fréquences documentaires (et les totaux qui servent à max_features)
+sont mises à jour avec les seules lignes ajoutées depuis la dernière
+lecture, dans un thread d'arrière-plan, qui calcule aussi l'IDF du corpus et
+la norme de chaque document. Une requête n'analyse que le nouveau texte et
+fait un seul produit matrice creuse x vecteur contre les comptes stockés.
+"""
+import sqlite3
+import logging
+import threading
+from collections import Counter
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+import numpy as np
+from scipy import sparse
+
+_SQL_CHUNK = 500
+
+
+class _Snapshot:
+    """
+    Comptes des documents, fréquences du corpus, IDF et normes des documents
+    utilisés par les requêtes (remplacés d'un bloc)
+    """
+
+    def __init__(self, counts, document_ids, df, totals, idf, norms, last_seq):
+        self.counts = counts
+        self.document_ids = document_ids
+        self.df = df
+        self.totals = totals
+        self.idf = idf
+        self.norms = norms
+        self.last_seq = last_seq
+
+
+class TfidfDocumentIndex:
+    """
+    Index TF-IDF persistant des documents d'une base SQLite.
+
+    smooth_idf=False reproduit ManualTfIdf (log(N/df)), True reproduit
+    TfidfVectorizer (log((1+N)/(1+df)) + 1). L'IDF est celui des documents
+    stockés : une requête est vectorisée comme par transform() d'un
+    vectoriseur entraîné sur le corpus (termes inconnus ignorés).
+    max_features garde, comme les deux vectoriseurs, les termes les plus
+    fréquents (à égalité, les plus anciens) ; les autres ont un poids nul.
+    integer_terms stocke les termes (hachages de n-grammes de token_vocab)
+    dans une colonne INTEGER. Si analyzer_version change, les vecteurs
+    stockés sont effacés et recalculés par index_missing.
+    """
+
+    def __init__(self, db_path: str, analyzer: Callable[[str], Iterable[Hashable]],
+                 smooth_idf: bool = False, max_df: float = 1.0, max_features: Optional[int] = None,
+                 analyzer_version: Optional[str] = None, integer_terms: bool = False):
+        self.db_path = db_path
+        self.integer_terms = integer_terms
+        self.analyzer = analyzer
+        self.analyzer_version = analyzer_version
+        self.smooth_idf = smooth_idf
+        self.max_df = max_df
+        self.max_features = max_features
+        self._snapshot = None
+        self._refresh_lock = threading.Lock()
+        self._refresh_thread = None
+        self._setup_database()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path)
+
+    def _setup_database(self):
+        conn = self._connect()
+        try:
+            conn.execute(f'''
+                CREATE TABLE IF NOT EXISTS tfidf_terms (
+                    term_id INTEGER PRIMARY KEY,
+                    term {'INTEGER' if self.integer_terms else 'TEXT'} NOT NULL UNIQUE
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS tfidf_document_vectors (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,  -- ordre d'écriture, pour les lectures incrémentales
+                    document_id INTEGER NOT NULL UNIQUE,
+                    term_ids BLOB NOT NULL,  -- uint32, triés
+                    counts BLOB NOT NULL     -- float32
+                )
+            ''')
+            conn.execute('CREATE TABLE IF NOT EXISTS tfidf_meta (key TEXT PRIMARY KEY, value TEXT)')
+            if self.analyzer_version is not None:
+                row = conn.execute("SELECT value FROM tfidf_meta WHERE key = 'analyzer'").fetchone()
+                if row is None or row[0] != self.analyzer_version:
+                    # Termes produits par un autre analyseur : vecteurs recalculés par index_missing
+                    removed = conn.execute('DELETE FROM tfidf_document_vectors').rowcount
+                    conn.execute('DELETE FROM tfidf_terms')
+                    conn.execute("INSERT OR REPLACE INTO tfidf_meta (key, value) VALUES ('analyzer', ?)",
+                                 (self.analyzer_version,))
+                    if removed:
+                        logging.info(f"📊 TF-IDF : analyseur modifié, {removed} vecteurs à recalculer ({self.db_path})")
+            conn.commit()
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _lookup_terms(conn: sqlite3.Connection, terms: List[Hashable]) -> Dict[Hashable, int]:
+        term_ids = {}
+        for start in range(0, len(terms), _SQL_CHUNK):
+            chunk = terms[start:start + _SQL_CHUNK]
+            placeholders = ','.join('?' * len(chunk))
+            for term, term_id in conn.execute(
+                    f'SELECT term, term_id FROM tfidf_terms WHERE term IN ({placeholders})', chunk):
+                term_ids[term] = term_id
+        return term_ids
+
+    def add(self, document_id: int, text: str, conn: Optional[sqlite3.Connection] = None) -> None:
+        """Enregistre le vecteur d'un document (dans la transaction de l'appelant si conn est fourni)"""
+        term_counts = Counter(self.analyzer(text or ""))
+        own_conn = conn is None
+        conn = conn or self._connect()
+        try:
+            # Counter garde l'ordre d'apparition : les identifiants suivent l'ordre du corpus
+            conn.executemany('INSERT OR IGNORE INTO tfidf_terms (term) VALUES (?)', ((term,) for term in term_counts))
+            term_ids = self._lookup_terms(conn, list(term_counts))
+            ids = np.array([term_ids[term] for term in term_counts], dtype=np.uint32)
+            values = np.array(list(term_counts.values()), dtype=np.float32)
+            order = np.argsort(ids)
+            conn.execute('INSERT OR REPLACE INTO tfidf_document_vectors (document_id, term_ids, counts) VALUES (?, ?, ?)',
+                         (document_id, ids[order].tobytes(), values[order].tobytes()))
+            if own_conn:
+                conn.commit()
+        finally:
+            if own_conn:
+                conn.close()
+
+    def index_missing(self, table: str = 'documents', id_column: str = 'id',
+                      content_column: str = 'content') -> int:
+        """Calcule les vecteurs des documents stockés avant l'existence de l'index"""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                f'SELECT d.{id_column}, d.{content_column} FROM {table} d '
+                f'LEFT JOIN tfidf_document_vectors v ON v.document_id = d.{id_column} '
+                f'WHERE v.document_id IS NULL ORDER BY d.{id_column}').fetchall()
+            for document_id, content in rows:
+                self.add(document_id, content or "", conn)
+            conn.commit()
+        finally:
+            conn.close()
+        if rows:
+            logging.info(f"📊 TF-IDF : {len(rows)} documents existants vectorisés ({self.db_path})")
+        return len(rows)
+
+    # ---- rafraîchissement des fréquences -------------------------------
+
+    def refresh(self) -> None:
+        """Charge les vecteurs ajoutés depuis la dernière lecture et met à jour les fréquences"""
+        with self._refresh_lock:
+            previous = self._snapshot
+            last_seq = previous.last_seq if previous else 0
+            conn = self._connect()
+            try:
+                rows = conn.execute(
+                    'SELECT seq, document_id, term_ids, counts FROM tfidf_document_vectors '
+                    'WHERE seq > ? ORDER BY seq', (last_seq,)).fetchall()
+                n_terms = (conn.execute('SELECT MAX(term_id) FROM tfidf_terms').fetchone()[0] or 0) + 1
+            finally:
+                conn.close()
+            if previous is not None and not rows:
+                return
+
+            term_ids = [np.frombuffer(row[2], dtype=np.uint32) for row in rows]
+            values = [np.frombuffer(row[3], dtype=np.float32) for row in rows]
+            indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+            indptr[1:] = np.cumsum([len(ids) for ids in term_ids])
+            new_counts = sparse.csr_matrix(
+                (np.concatenate(values) if rows else np.zeros(0, dtype=np.float32),
+                 np.concatenate(term_ids) if rows else np.zeros(0, dtype=np.uint32),
+                 indptr),
+                shape=(len(rows), n_terms))
+            new_ids = np.array([row[1] for row in rows], dtype=np.int64)
+
+            if previous is None:
+                counts, document_ids = new_counts, new_ids
+                df, totals = np.zeros(n_terms), np.zeros(n_terms)
+            else:
+                # Le vocabulaire a pu grandir : colonnes ajoutées aux anciennes lignes
+                old = previous.counts
+                old = sparse.csr_matrix((old.data, old.indices, old.indptr), shape=(old.shape[0], n_terms))
+                counts = sparse.vstack([old, new_counts], format='csr')
+                document_ids = np.concatenate([previous.document_ids, new_ids])
+                df = np.concatenate([previous.df, np.zeros(n_terms - len(previous.df))])
+                totals = np.concatenate([previous.totals, np.zeros(n_terms - len(previous.totals))])
+            # Mise à jour incrémentale : seules les nouvelles lignes sont comptées
+            df += np.bincount(new_counts.indices, minlength=n_terms)
+            totals += np.bincount(new_counts.indices, weights=new_counts.data, minlength=n_terms)
+
+            # Un document ré-enregistré (INSERT OR REPLACE) garde seulement sa dernière version
+            if len(np.unique(document_ids)) != len(document_ids):
+                _, last = np.unique(document_ids[::-1], return_index=True)
+                keep = np.sort(len(document_ids) - 1 - last)
+                counts, document_ids = counts[keep], document_ids[keep]
+                df = np.bincount(counts.indices, minlength=n_terms).astype(np.float64)
+                totals = np.bincount(counts.indices, weights=counts.data, minlength=n_terms)
+
+            idf = self._idf(counts.shape[0], df, totals)
+            # ||c_d * idf|| de chaque document, une fois par rafraîchissement
+            norms = np.sqrt(counts.multiply(counts) @ (idf * idf))
+            self._snapshot = _Snapshot(counts, document_ids, df, totals, idf, norms,
+                                       rows[-1][0] if rows else last_seq)
+
+    def refresh_async(self) -> None:
+        """Met à jour les fréquences dans un thread d'arrière-plan (les requêtes utilisent l'ancien état entre-temps)"""
+        if self._refresh_thread is not None and self._refresh_thread.is_alive():
+            return
+        self._refresh_thread = threading.Thread(target=self._refresh_safely, daemon=True)
+        self._refresh_thread.start()
+
+    def _refresh_safely(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            logging.error(f"Erreur rafraîchissement TF-IDF: {e}")
+
+    def _is_stale(self) -> bool:
+        conn = self._connect()
+        try:
+            last_seq = conn.execute('SELECT MAX(seq) FROM tfidf_document_vectors').fetchone()[0] or 0
+        finally:
+            conn.close()
+        return last_seq > self._snapshot.last_seq
+
+    # ---- requête -------------------------------------------------------
+
+    def _idf(self, n: int, df: np.ndarray, totals: np.ndarray) -> np.ndarray:
+        """IDF des n documents stockés, nul pour les termes écartés par max_df et max_features"""
+        n_terms = len(df)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if self.smooth_idf:
+                idf = np.log((1.0 + n) / (1.0 + df)) + 1.0
+            else:
+                idf = np.log(n / df)
+        eligible = df > 0
+        if self.max_df < 1.0:
+            eligible &= df <= self.max_df * n
+        idf[~eligible] = 0.0
+        if self.max_features and np.count_nonzero(eligible) > self.max_features:
+            # À fréquence égale, le terme apparu le plus tôt (plus petit identifiant) est gardé
+            ranking = totals + 0.5 * (1.0 - np.arange(n_terms) / n_terms)
+            ranking[~eligible] = -1.0
+            kept = np.argpartition(-ranking, self.max_features - 1)[:self.max_features]
+            mask = np.zeros(n_terms, dtype=bool)
+            mask[kept] = True
+            idf[~mask] = 0.0
+        return idf
+
+    def query(self, text: str, min_similarity: float = 0.0) -> List[Tuple[int, float]]:
+        """
+        Similarité cosinus du texte avec chaque document stocké :
+        [(document_id, similarité)], de la plus forte à la plus faible.
+        """
+        if self._snapshot is None:
+            self.refresh()
+        elif self._is_stale():
+            self.refresh_async()
+        snapshot = self._snapshot
+        if snapshot.counts.shape[0] == 0:
+            return []
+
+        term_counts = Counter(self.analyzer(text or ""))
+        if not term_counts:
+            return []
+        conn = self._connect()
+        try:
+            known = self._lookup_terms(conn, list(term_counts))
+        finally:
+            conn.close()
+        # Termes inconnus (ou ajoutés après l'état courant) : ignorés, comme par transform()
+        n_stored = snapshot.counts.shape[1]
+        features = np.array([known.get(term, n_stored) for term in term_counts], dtype=np.int64)
+        counts = np.array(list(term_counts.values()), dtype=np.float64)
+        stored = features < n_stored
+        features, counts = features[stored], counts[stored]
+
+        query_weights = counts * snapshot.idf[features]
+        query_norm = float(np.linalg.norm(query_weights))
+        if query_norm == 0:
+            return []
+
+        # cos(d, q) = sum(c_d * c_q * idf²) / (||c_d * idf|| * ||q||) : un produit creux sur les comptes stockés
+        query_vector = np.zeros(n_stored)
+        query_vector[features] = query_weights * snapshot.idf[features]
+        scores = snapshot.counts @ query_vector
+        denominators = snapshot.norms * query_norm
+        similarities = np.divide(scores, denominators, out=np.zeros_like(scores), where=denominators > 0)
+        order = np.argsort(-similarities)
+        return [(int(snapshot.document_ids[i]), float(similarities[i]))
+                for i in order if similarities[i] > min_similarity]
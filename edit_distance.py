@@ -0,0 +1,123 @@
+"""
+Distance d'édition (Levenshtein) exacte et rapide, sur caractères ou sur mots.
+
+myers_distance : algorithme bit-parallèle de Myers (formulation de Hyyrö).
+Chaque colonne de la matrice de programmation dynamique est codée dans des
+entiers Python (un bit par symbole de la séquence la plus courte) : le coût
+est O(n * m / 64) opérations machine, sans troncature des textes.
+
+bounded_distance : même calcul, mais répond seulement « distance <= k ? ».
+Il s'arrête dès qu'une borne inférieure de la distance finale dépasse k,
+ce qui élimine vite les documents qui ne peuvent plus battre le meilleur
+score courant.
+
+Les détecteurs comparent des séquences de mots (token_similarity) : la
+similarité n'est plus gonflée par les lettres communes à deux textes sans
+rapport.
+"""
+import re
+from typing import Dict, Hashable, List, Optional, Sequence
+
+import numpy as np
+
+_WORD_PATTERN = re.compile(r'\w+')
+
+# Fréquence de vérification de la borne inférieure dans bounded_distance (en colonnes)
+CHECK_INTERVAL = 128
+
+
+def tokenize(text: str) -> List[str]:
+    """Mots du texte en minuscules, sans ponctuation"""
+    return _WORD_PATTERN.findall((text or "").lower())
+
+
+def _pattern_masks(pattern: Sequence[Hashable]) -> Dict[Hashable, int]:
+    masks = {}
+    for position, symbol in enumerate(pattern):
+        masks[symbol] = masks.get(symbol, 0) | (1 << position)
+    return masks
+
+
+def _column_values(column: int, positive: int, negative: int, length: int) -> np.ndarray:
+    """Valeurs D[0..m][colonne] reconstruites depuis les bits de différences verticales"""
+    n_bytes = (length + 7) // 8
+    plus = np.unpackbits(np.frombuffer(positive.to_bytes(n_bytes, 'little'), dtype=np.uint8),
+                         bitorder='little')[:length].astype(np.int64)
+    minus = np.unpackbits(np.frombuffer(negative.to_bytes(n_bytes, 'little'), dtype=np.uint8),
+                          bitorder='little')[:length].astype(np.int64)
+    values = np.empty(length + 1, dtype=np.int64)
+    values[0] = column
+    values[1:] = column + np.cumsum(plus - minus)
+    return values
+
+
+def _myers(a: Sequence[Hashable], b: Sequence[Hashable], bound: Optional[int]) -> Optional[int]:
+    # La séquence la plus courte sert de motif : moins de bits par colonne
+    if len(a) > len(b):
+        a, b = b, a
+    m, n = len(a), len(b)
+    if bound is not None and n - m > bound:
+        return None
+    if m == 0:
+        return n if bound is None or n <= bound else None
+
+    masks = _pattern_masks(a)
+    full = (1 << m) - 1
+    high = 1 << (m - 1)
+    positive, negative = full, 0   # différences verticales +1 / -1
+    score = m
+    for column, symbol in enumerate(b, 1):
+        equal = masks.get(symbol, 0)
+        x_vertical = equal | negative
+        x_horizontal = (((equal & positive) + positive) ^ positive) | equal
+        h_positive = negative | (~(x_horizontal | positive) & full)
+        h_negative = positive & x_horizontal
+        if h_positive & high:
+            score += 1
+        elif h_negative & high:
+            score -= 1
+        # Première ligne D[0][j] = j : la différence horizontale entrante vaut +1
+        h_positive = ((h_positive << 1) | 1) & full
+        h_negative = (h_negative << 1) & full
+        positive = h_negative | (~(x_vertical | h_positive) & full)
+        negative = h_positive & x_vertical
+
+        if bound is not None and column % CHECK_INTERVAL == 0 and column < n:
+            # Borne inférieure : meilleure cellule de la colonne + écart de longueur restant
+            values = _column_values(column, positive, negative, m)
+            remaining = np.abs((m - np.arange(m + 1)) - (n - column))
+            if int(np.min(values + remaining)) > bound:
+                return None
+
+    if bound is not None and score > bound:
+        return None
+    return score
+
+
+def myers_distance(a: Sequence[Hashable], b: Sequence[Hashable]) -> int:
+    """Distance de Levenshtein exacte entre deux séquences (chaînes ou listes de mots)"""
+    return _myers(a, b, None)
+
+
+def bounded_distance(a: Sequence[Hashable], b: Sequence[Hashable], k: int) -> Optional[int]:
+    """Distance de Levenshtein si elle est <= k, sinon None (calcul interrompu au plus tôt)"""
+    if k < 0:
+        return None
+    return _myers(a, b, k)
+
+
+def token_similarity(a_tokens: Sequence[Hashable], b_tokens: Sequence[Hashable],
+                     min_similarity: float = 0.0) -> float:
+    """
+    Similarité 1 - distance / longueur max entre deux séquences de mots, en
+    pourcentage. Renvoie 0 sans calcul complet si elle ne peut pas dépasser
+    min_similarity (pourcentage).
+    """
+    longest = max(len(a_tokens), len(b_tokens))
+    if longest == 0:
+        return 0.0
+    max_distance = int(longest * (1 - min_similarity / 100.0))
+    distance = bounded_distance(a_tokens, b_tokens, max_distance)
+    if distance is None:
+        return 0.0
+    return (1 - distance / longest) * 100
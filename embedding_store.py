@@ -0,0 +1,63 @@
+"""
+Format binaire des matrices d'embeddings stockées dans les bases SQLite.
+
+Une matrice (une ligne par phrase) est enregistrée dans une seule colonne
+BLOB : un en-tête de 16 octets (signature, type, lignes, colonnes) suivi des
+valeurs float32 ou float16 contiguës. La lecture est une vue numpy sur les
+octets du BLOB (np.frombuffer), sans analyse JSON ni pickle.
+
+    magic  b'EMB1'   4 octets
+    dtype  b'f'/b'e' 1 octet (+ 3 octets de remplissage)
+    rows   uint32    4 octets
+    cols   uint32    4 octets
+"""
+import os
+import json
+import struct
+import logging
+from typing import Optional
+
+import numpy as np
+
+MAGIC = b'EMB1'
+_HEADER = struct.Struct('<4sc3xII')
+_DTYPES = {b'f': np.float32, b'e': np.float16}
+
+# float16 divise la taille par deux (précision ~1e-3, suffisante pour la similarité cosinus)
+STORAGE_DTYPE = os.environ.get('EMBEDDING_STORAGE_DTYPE', 'float32')
+
+
+def encode_embeddings(matrix, dtype: Optional[str] = None) -> bytes:
+    """Sérialise une matrice (phrases x dimensions) en BLOB"""
+    dtype = np.dtype(dtype or STORAGE_DTYPE)
+    if dtype.type not in (np.float32, np.float16):
+        raise ValueError(f"Type d'embedding non pris en charge : {dtype}")
+    array = np.ascontiguousarray(matrix, dtype=dtype.newbyteorder('<'))
+    if array.ndim != 2:
+        array = array.reshape(-1, array.shape[-1]) if array.size else array.reshape(0, 0)
+    rows, cols = array.shape
+    return _HEADER.pack(MAGIC, dtype.char.encode(), rows, cols) + array.tobytes()
+
+
+def is_encoded(blob) -> bool:
+    return isinstance(blob, (bytes, memoryview)) and bytes(blob[:4]) == MAGIC
+
+
+def decode_embeddings(blob) -> np.ndarray:
+    """Vue numpy (lecture seule) sur un BLOB produit par encode_embeddings"""
+    magic, dtype_code, rows, cols = _HEADER.unpack_from(blob)
+    if magic != MAGIC or dtype_code not in _DTYPES:
+        raise ValueError("BLOB d'embeddings invalide")
+    dtype = np.dtype(_DTYPES[dtype_code]).newbyteorder('<')
+    return np.frombuffer(blob, dtype=dtype, count=rows * cols, offset=_HEADER.size).reshape(rows, cols)
+
+
+def decode_legacy_json(value) -> Optional[np.ndarray]:
+    """Embeddings enregistrés en texte JSON avant l'introduction du format binaire"""
+    try:
+        if isinstance(value, bytes):
+            value = value.decode('utf-8')
+        return np.asarray(json.loads(value), dtype=np.float32)
+    except (ValueError, TypeError, UnicodeDecodeError) as e:
+        logging.warning(f"Embeddings JSON illisibles ignorés : {e}")
+        return None
@@ -1,6 +1,9 @@
 import os
+import re
 import uuid
+import hashlib
 import logging
+import unicodedata
 from typing import Optional, Tuple
 from werkzeug.utils import secure_filename
 import PyPDF2
@@ -14,8 +17,8 @@ def allowed_file(filename: str) -> bool:
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def save_uploaded_file(file) -> Optional[Tuple[str, str]]:
-    """Save uploaded file and return (file_path, filename)"""
+def save_uploaded_file(file) -> Optional[Tuple[str, str, str]]:
+    """Save uploaded file and return (file_path, filename, SHA-256 of its bytes)"""
     if not file or not file.filename:
         return None
     
@@ -28,16 +31,29 @@ def save_uploaded_file(file) -> Optional[Tuple[str, str]]:
         file_extension = original_filename.rsplit('.', 1)[1].lower()
         unique_filename = f"{uuid.uuid4().hex}.{file_extension}"
         
-        # Save file
+        # Save file, hashing the bytes as they are written
         file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], unique_filename)
-        file.save(file_path)
+        sha256 = hashlib.sha256()
+        with open(file_path, 'wb') as out:
+            for chunk in iter(lambda: file.stream.read(64 * 1024), b''):
+                sha256.update(chunk)
+                out.write(chunk)
         
-        return file_path, unique_filename
+        return file_path, unique_filename, sha256.hexdigest()
         
     except Exception as e:
         logging.error(f"Failed to save uploaded file: {e}")
         return None
 
+def normalize_text_for_hash(text: str) -> str:
+    """Normalize extracted text so that re-exports of the same content hash identically"""
+    text = unicodedata.normalize('NFKC', text or '')
+    return re.sub(r'\s+', ' ', text).strip()
+
+def compute_text_hash(text: str) -> str:
+    """SHA-256 of the normalized extracted text"""
+    return hashlib.sha256(normalize_text_for_hash(text).encode('utf-8')).hexdigest()
+
 def extract_text_from_file(file_path: str, content_type: str) -> Optional[str]:
     """Extract text content from uploaded file"""
     try:
@@ -60,8 +76,8 @@ def extract_text_from_txt(file_path: str) -> str:
     with open(file_path, 'r', encoding='utf-8', errors='ignore') as file:
         return file.read()
 
-def extract_text_from_pdf(file_path: str) -> str:
-    """Extract text from PDF file"""
+def extract_text_from_pdf(file_path: str, binary_fallback: bool = True) -> str:
+    """Extract text from PDF file (binary_fallback: decode the raw bytes if parsing fails)"""
     text = ""
     try:
         with open(file_path, 'rb') as file:
@@ -70,6 +86,8 @@ def extract_text_from_pdf(file_path: str) -> str:
                 text += page.extract_text() + "\n"
     except Exception as e:
         logging.error(f"Failed to extract text from PDF {file_path}: {e}")
+        if not binary_fallback:
+            return ""
         # Fallback: try with different encoding
         try:
             with open(file_path, 'rb') as file:
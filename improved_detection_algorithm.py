@@ -9,6 +9,7 @@ import re
 import math
 import logging
 from collections import Counter, defaultdict
+from text_segmentation import segment_document
 from typing import List, Dict, Tuple, Optional
 import json
 import os
@@ -117,7 +118,7 @@ class ImprovedDetectionAlgorithm:
         try:
             # Prétraitement
             text_clean = self._preprocess_text(text)
-            sentences = self._split_sentences(text_clean)
+            sentences = self._split_sentences(text)
             
             if len(sentences) < 2:
                 return self._default_result()
@@ -622,8 +623,7 @@ class ImprovedDetectionAlgorithm:
     
     def _split_sentences(self, text: str) -> List[str]:
         """Divise le texte en phrases"""
-        sentences = re.split(r'[.!?]+', text)
-        return [s.strip() for s in sentences if len(s.strip()) > 10]
+        return segment_document(text).sentences(10)
     
     def _default_result(self) -> Dict:
         """Résultat par défaut en cas d'erreur"""
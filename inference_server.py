@@ -0,0 +1,531 @@
+"""
+Démon d'inférence de la perplexité.
+
+Sans lui, chaque processus gunicorn et chaque worker d'analyse charge sa
+propre copie de GPT-2 (voir perplexity_backends) et fait ses passes avant un
+texte à la fois. Ce démon détient un seul modèle et écoute sur une socket
+Unix. Chaque requête est tokenisée et découpée dans les mêmes fenêtres
+glissantes que token_losses(), puis les fenêtres de toutes les requêtes
+simultanées (web comme workers de la file) passent par une seule file. Le
+thread de regroupement prend au plus INFERENCE_MAX_BATCH fenêtres, attend au
+plus INFERENCE_MAX_WAIT_MS après la première, les complète (padding) et fait
+une seule passe avant. Les pertes par token repartent vers chaque client.
+
+À lancer à côté des workers, qui s'y connectent :
+
+    python -m inference_server --backend int8 --max-batch 16 --max-wait-ms 10
+    PERPLEXITY_BACKEND=server gunicorn ...    (et python -m analysis_worker)
+    python -m inference_server --health       # état et profondeur de la file
+
+Protocole : chaque message est une trame faite de deux longueurs uint32
+gros-boutistes (en-tête JSON, charge binaire), de l'en-tête puis de la
+charge. Une requête 'losses' porte le délai du client : une fois ce délai
+passé, ou si le client se déconnecte, la requête est abandonnée et ses
+fenêtres en file sont écartées au lieu de retarder les lots des requêtes
+encore attendues.
+"""
+import os
+import sys
+import json
+import time
+import queue
+import select
+import signal
+import socket
+import struct
+import logging
+import argparse
+import threading
+import socketserver
+from typing import List, Optional, Tuple
+
+import numpy as np
+import torch
+
+SOCKET_PATH = os.environ.get('INFERENCE_SOCKET', os.path.join('plagiarism_cache', 'inference.sock'))
+MAX_BATCH = int(os.environ.get('INFERENCE_MAX_BATCH', 16))
+MAX_WAIT_MS = float(os.environ.get('INFERENCE_MAX_WAIT_MS', 10))
+# Tokens (padding compris) par passe avant : borne le tenseur des logits (tokens x 50257 flottants)
+MAX_BATCH_TOKENS = int(os.environ.get('INFERENCE_MAX_BATCH_TOKENS', 4096))
+CLIENT_TIMEOUT_SECONDS = float(os.environ.get('INFERENCE_CLIENT_TIMEOUT', 120))
+
+_FRAME = struct.Struct('!II')
+
+Losses = Tuple[np.ndarray, np.ndarray]
+
+
+def _empty_losses() -> Losses:
+    return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)
+
+
+# --------- Trames ---------
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError("Connection closed by peer")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def send_frame(sock: socket.socket, header: dict, payload: bytes = b'') -> None:
+    encoded = json.dumps(header).encode('utf-8')
+    sock.sendall(_FRAME.pack(len(encoded), len(payload)) + encoded + payload)
+
+
+def recv_frame(sock: socket.socket) -> Tuple[dict, bytes]:
+    header_size, payload_size = _FRAME.unpack(_recv_exact(sock, _FRAME.size))
+    header = json.loads(_recv_exact(sock, header_size).decode('utf-8'))
+    return header, _recv_exact(sock, payload_size)
+
+
+def _pack_losses(results: List[Losses]) -> Tuple[List[int], bytes]:
+    """Longueurs et charge : tous les tableaux de pertes (float32), puis tous les token_ends (int64)"""
+    lengths = [len(losses) for losses, _ in results]
+    payload = b''.join(losses.astype(np.float32).tobytes() for losses, _ in results)
+    payload += b''.join(ends.astype(np.int64).tobytes() for _, ends in results)
+    return lengths, payload
+
+
+def _unpack_losses(lengths: List[int], payload: bytes) -> List[Losses]:
+    total = sum(lengths)
+    losses = np.frombuffer(payload, dtype=np.float32, count=total)
+    ends = np.frombuffer(payload, dtype=np.int64, count=total, offset=4 * total)
+    bounds = np.cumsum([0] + lengths)
+    return [(losses[start:end].copy(), ends[start:end].copy())
+            for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+# --------- Côté serveur ---------
+
+class _Request:
+    """Fenêtres d'une requête client qui attendent encore le modèle"""
+
+    def __init__(self):
+        self.remaining = 0
+        self.error = None
+        self.done = threading.Event()
+        self.abandoned = False  # client parti : ses fenêtres sont sautées par le regroupement
+        self._lock = threading.Lock()
+
+    def expect(self, n_windows: int):
+        self.remaining = n_windows
+        if n_windows == 0:
+            self.done.set()
+
+    def window_done(self, error: Optional[str] = None):
+        with self._lock:
+            if error:
+                self.error = error
+            self.remaining -= 1
+            if self.remaining <= 0:
+                self.done.set()
+
+
+class _Window:
+    """Une fenêtre glissante d'un texte ; ses nouvelles pertes vont dans losses[out_start:]"""
+
+    __slots__ = ('input_ids', 'first_new', 'losses', 'out_start', 'request')
+
+    def __init__(self, input_ids: List[int], first_new: int, losses: np.ndarray,
+                 out_start: int, request: _Request):
+        self.input_ids = input_ids
+        self.first_new = first_new
+        self.losses = losses
+        self.out_start = out_start
+        self.request = request
+
+
+class MicroBatcher:
+    """Regroupe les fenêtres de toutes les connexions en lots complétés pour un seul modèle"""
+
+    def __init__(self, model, pad_id: int, max_batch: int = MAX_BATCH, max_wait_ms: float = MAX_WAIT_MS,
+                 max_batch_tokens: int = MAX_BATCH_TOKENS):
+        self.model = model
+        self.pad_id = pad_id
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self.max_batch_tokens = max_batch_tokens
+        self.queue = queue.Queue()
+        self._carry = None  # fenêtre qui n'entrait pas dans le lot précédent
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.windows = 0
+        self.tokens = 0
+        self.forward_seconds = 0.0
+        self.errors = 0
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._run, name='inference-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, windows: List[_Window]):
+        for window in windows:
+            self.queue.put(window)
+
+    def queue_depth(self) -> int:
+        return self.queue.qsize() + (self._carry is not None)
+
+    def _next_live(self, timeout: Optional[float] = None) -> _Window:
+        """Prochaine fenêtre en file dont le client attend encore (queue.Empty après timeout)"""
+        while True:
+            if timeout is None:
+                window = self.queue.get()
+            elif timeout > 0:
+                window = self.queue.get(timeout=timeout)
+            else:
+                window = self.queue.get_nowait()
+            if not window.request.abandoned:
+                return window
+            with self._stats_lock:
+                self.dropped += 1
+
+    def _collect(self) -> List[_Window]:
+        first = self._carry
+        self._carry = None
+        if first is None or first.request.abandoned:
+            first = self._next_live()
+        batch = [first]
+        width = len(first.input_ids)
+        closes_at = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = closes_at - time.monotonic()
+            try:
+                # Après le délai d'attente, prendre encore les fenêtres déjà en file
+                window = self._next_live(remaining)
+            except queue.Empty:
+                break
+            if max(width, len(window.input_ids)) * (len(batch) + 1) > self.max_batch_tokens:
+                self._carry = window
+                break
+            batch.append(window)
+            width = max(width, len(window.input_ids))
+        return batch
+
+    def _forward(self, batch: List[_Window]):
+        width = max(len(window.input_ids) for window in batch)
+        input_ids = torch.full((len(batch), width), self.pad_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(batch), width), dtype=torch.long)
+        for row, window in enumerate(batch):
+            input_ids[row, :len(window.input_ids)] = torch.tensor(window.input_ids, dtype=torch.long)
+            attention_mask[row, :len(window.input_ids)] = 1
+        device = self.model.device
+        input_ids = input_ids.to(device)
+
+        with torch.no_grad():
+            logits = self.model(input_ids, attention_mask=attention_mask.to(device)).logits
+            for row, window in enumerate(batch):
+                # Padding à droite : les vrais tokens ne voient jamais le padding qui les suit
+                n_tokens = len(window.input_ids)
+                log_probs = torch.log_softmax(logits[row, :n_tokens - 1].float(), dim=-1)
+                nll = -log_probs.gather(1, input_ids[row, 1:n_tokens].unsqueeze(1)).squeeze(1)
+                new = nll[window.first_new:].cpu().numpy()
+                window.losses[window.out_start:window.out_start + len(new)] = new
+        return width * len(batch)
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            try:
+                tokens = self._forward(batch)
+                error = None
+            except Exception as e:
+                logging.exception("Inference batch failed")
+                tokens = 0
+                error = f"{type(e).__name__}: {e}"
+            with self._stats_lock:
+                self.batches += 1
+                self.windows += len(batch)
+                self.tokens += tokens
+                self.forward_seconds += time.perf_counter() - started
+                self.errors += error is not None
+            for window in batch:
+                window.request.window_done(error)
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                'queue_depth': self.queue_depth(),
+                'batches': self.batches,
+                'windows': self.windows,
+                'padded_tokens': self.tokens,
+                'mean_batch_size': round(self.windows / self.batches, 2) if self.batches else 0.0,
+                'mean_forward_ms': round(1000 * self.forward_seconds / self.batches, 1) if self.batches else 0.0,
+                'failed_batches': self.errors,
+                'dropped_windows': self.dropped,
+                'max_batch': self.max_batch,
+                'max_wait_ms': self.max_wait * 1000,
+                'max_batch_tokens': self.max_batch_tokens,
+            }
+
+
+def _disconnected(sock: Optional[socket.socket]) -> bool:
+    """Le client a fermé sa connexion (il cesse de lire une fois son propre délai passé)"""
+    if sock is None:
+        return False
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        return bool(readable) and sock.recv(1, socket.MSG_PEEK) == b''
+    except OSError:
+        return True
+
+
+class _Handler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        try:
+            header, _ = recv_frame(self.request)
+        except (ConnectionError, ValueError):
+            return
+        try:
+            op = header.get('op')
+            if op == 'health':
+                send_frame(self.request, {'ok': True, 'stats': self.server.stats()})
+            elif op == 'losses':
+                results = self.server.token_losses(header.get('texts') or [], header.get('timeout'),
+                                                   bool(header.get('truncate')), self.request)
+                if results is None:
+                    return  # abandonnée : personne ne lit la réponse
+                lengths, payload = _pack_losses(results)
+                send_frame(self.request, {'ok': True, 'lengths': lengths}, payload)
+            else:
+                send_frame(self.request, {'ok': False, 'error': f"Unknown operation: {op}"})
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # client parti (échéance atteinte)
+        except Exception as e:
+            logging.exception("Inference request failed")
+            try:
+                send_frame(self.request, {'ok': False, 'error': f"{type(e).__name__}: {e}"})
+            except OSError:
+                pass
+
+
+def socket_in_use(path: str) -> bool:
+    """Un démon répond déjà sur la socket (sinon, elle reste d'une exécution précédente)"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(1)
+        try:
+            sock.connect(path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            return False
+        except OSError:
+            return True  # file d'attente pleine ou délai dépassé : le démon est vivant
+        return True
+
+
+class InferenceServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Serveur sur socket Unix : un thread par connexion, un thread de regroupement pour le modèle"""
+
+    daemon_threads = True
+    # Les sockets Unix refusent les connexions (EAGAIN) quand la file d'attente est pleine
+    request_queue_size = int(os.environ.get('INFERENCE_BACKLOG', 256))
+
+    def __init__(self, path: str, model, tokenizer, backend: str, model_name: str,
+                 max_batch: int = MAX_BATCH, max_wait_ms: float = MAX_WAIT_MS,
+                 max_batch_tokens: int = MAX_BATCH_TOKENS):
+        if os.path.exists(path):
+            # Ne jamais prendre la socket d'un démon en service
+            if socket_in_use(path):
+                raise RuntimeError(f"An inference daemon is already listening on {path}")
+            os.unlink(path)  # socket restée d'une exécution précédente
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        super().__init__(path, _Handler)
+        os.chmod(path, 0o660)
+        self.path = path
+        self.model = model
+        self.tokenizer = tokenizer
+        self.model_name = model_name
+        # load_backend a pu se replier sur 'eager' : annoncer ce qui tourne vraiment
+        self.perplexity_model_id = getattr(model, 'perplexity_model_id', f"{model_name}/{backend}")
+        self.backend = self.perplexity_model_id.rsplit('/', 1)[-1]
+        self.max_length = model.config.n_positions
+        pad_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+        self.batcher = MicroBatcher(model, pad_id, max_batch, max_wait_ms,
+                                    max(max_batch_tokens, self.max_length))
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self.active_requests = 0
+        self.requests = 0
+        self.texts = 0
+
+    def token_losses(self, texts: List[str], timeout: Optional[float] = None, truncate: bool = False,
+                     client: Optional[socket.socket] = None) -> Optional[List[Losses]]:
+        """
+        Pertes et fins des tokens de chaque texte, mêmes valeurs que
+        token_losses() sur le modèle local. Avec truncate, chaque texte est
+        coupé au contexte du modèle et évalué en une fenêtre, comme
+        batched_perplexities() en local. Renvoie None si la requête est
+        abandonnée : délai dépassé ou client déconnecté avant l'évaluation
+        de ses fenêtres.
+        """
+        from ai_perplexity_detectgpt import loss_windows
+
+        with self._lock:
+            self.active_requests += 1
+            self.requests += 1
+            self.texts += len(texts)
+        try:
+            expires_at = time.monotonic() + timeout if timeout else None
+            request = _Request()
+            results = []
+            windows = []
+            for text in texts:
+                if not text or not text.strip():
+                    results.append(_empty_losses())
+                    continue
+                encodings = self.tokenizer(text, return_offsets_mapping=True)
+                input_ids = encodings['input_ids']
+                offsets = encodings['offset_mapping']
+                if truncate:
+                    input_ids, offsets = input_ids[:self.max_length], offsets[:self.max_length]
+                if len(input_ids) < 2:
+                    results.append(_empty_losses())
+                    continue
+                token_ends = np.asarray([end for _, end in offsets], dtype=np.int64)
+                losses = np.empty(len(input_ids) - 1, dtype=np.float32)
+                for begin_loc, end_loc, first_new in loss_windows(len(input_ids), self.max_length):
+                    windows.append(_Window(input_ids[begin_loc:end_loc], first_new, losses,
+                                           begin_loc + first_new, request))
+                results.append((losses, token_ends[1:]))
+
+            request.expect(len(windows))
+            self.batcher.submit(windows)
+            while not request.done.wait(0.05):
+                if (expires_at is not None and time.monotonic() >= expires_at) or _disconnected(client):
+                    request.abandoned = True
+                    return None
+            if request.error:
+                raise RuntimeError(request.error)
+            return results
+        finally:
+            with self._lock:
+                self.active_requests -= 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = {
+                'status': 'ok',
+                'pid': os.getpid(),
+                'model': self.model_name,
+                'backend': self.backend,
+                'perplexity_model_id': self.perplexity_model_id,
+                'uptime_seconds': round(time.time() - self.started_at, 1),
+                'active_requests': self.active_requests,
+                'requests': self.requests,
+                'texts': self.texts,
+            }
+        stats.update(self.batcher.stats())
+        return stats
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+# --------- Côté client ---------
+
+class InferenceClient:
+    """
+    Remplace le modèle dans le web et les workers de la file (PERPLEXITY_BACKEND=server) :
+    token_losses() et batched_perplexities() envoient leurs textes au démon.
+    """
+
+    def __init__(self, path: str = SOCKET_PATH, timeout: float = CLIENT_TIMEOUT_SECONDS):
+        self.path = path
+        self.timeout = timeout
+
+    def _call(self, header: dict, timeout: Optional[float] = None) -> Tuple[dict, bytes]:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(self.timeout if timeout is None else timeout)
+            sock.connect(self.path)
+            send_frame(sock, header)
+            response, payload = recv_frame(sock)
+        if not response.get('ok'):
+            raise RuntimeError(f"Inference server error: {response.get('error')}")
+        return response, payload
+
+    def health(self) -> dict:
+        """Statistiques du démon : modèle, backend, profondeur de la file, tailles des lots"""
+        response, _ = self._call({'op': 'health'}, timeout=5)
+        return response['stats']
+
+    def token_losses(self, texts: List[str], deadline=None, truncate: bool = False) -> List[Losses]:
+        """
+        Pertes et fins des tokens de chaque texte. Comme token_losses(),
+        renvoie des tableaux vides si l'échéance arrive avant la réponse du
+        démon ; celui-ci écarte alors les fenêtres pas encore évaluées. Avec
+        truncate, chaque texte est coupé au contexte du modèle (voir
+        batched_perplexities).
+        """
+        timeout = self.timeout
+        if deadline is not None:
+            if deadline.expired():
+                return [_empty_losses() for _ in texts]
+            timeout = min(timeout, deadline.remaining())
+        try:
+            response, payload = self._call({'op': 'losses', 'texts': list(texts), 'timeout': timeout,
+                                            'truncate': truncate}, timeout)
+        except socket.timeout:
+            if deadline is not None and deadline.expired():
+                return [_empty_losses() for _ in texts]
+            raise
+        return _unpack_losses(response['lengths'], payload)
+
+
+def main(argv=None):
+    from perplexity_backends import BACKENDS, MODEL_NAME, load_backend
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [inference] %(message)s')
+    local_backends = [name for name in BACKENDS if name != 'server']
+    parser = argparse.ArgumentParser(description="AcadCheck perplexity inference daemon")
+    parser.add_argument('--socket', default=SOCKET_PATH, help="Unix socket path")
+    parser.add_argument('--backend', choices=local_backends,
+                        default=os.environ.get('INFERENCE_BACKEND', 'eager'),
+                        help="how the daemon runs the model")
+    parser.add_argument('--max-batch', type=int, default=MAX_BATCH,
+                        help="maximum windows per forward pass")
+    parser.add_argument('--max-wait-ms', type=float, default=MAX_WAIT_MS,
+                        help="how long the first window of a batch waits for others")
+    parser.add_argument('--max-batch-tokens', type=int, default=MAX_BATCH_TOKENS,
+                        help="maximum padded tokens per forward pass")
+    parser.add_argument('--health', action='store_true',
+                        help="print the stats of the running daemon and exit")
+    args = parser.parse_args(argv)
+
+    if args.health:
+        try:
+            print(json.dumps(InferenceClient(args.socket).health(), indent=2))
+        except OSError as e:
+            print(f"Inference daemon unreachable on {args.socket}: {e}", file=sys.stderr)
+            return 1
+        return 0
+
+    if socket_in_use(args.socket):
+        print(f"An inference daemon is already listening on {args.socket}", file=sys.stderr)
+        return 1
+
+    model, tokenizer = load_backend(args.backend, MODEL_NAME)
+    server = InferenceServer(args.socket, model, tokenizer, args.backend, MODEL_NAME,
+                             args.max_batch, args.max_wait_ms, args.max_batch_tokens)
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, stop)
+    logging.info(f"Serving {server.perplexity_model_id} on {args.socket}, "
+                 f"max batch {args.max_batch}, max wait {args.max_wait_ms} ms")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
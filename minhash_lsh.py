@@ -0,0 +1,174 @@
+"""
+Index MinHash LSH des documents stockés, pour trouver les quasi-doublons
+sans comparer la soumission à chaque document de la base.
+
+Chaque document reçoit une signature MinHash (calculée une fois, au
+stockage) sur l'ensemble de ses mots normalisés ; la signature est découpée
+en bandes dont le hachage donne un seau. Deux documents de similarité de
+Jaccard J partagent au moins un seau avec une probabilité
+1 - (1 - J^ROWS)^BANDS : ~100 % à J = 0.5, ~13 % à J = 0.15. La recherche
+est une lecture des seaux de la soumission, suivie d'une vérification
+exacte des quelques candidats.
+
+Signatures et seaux sont enregistrés dans la base SQLite du service
+(tables minhash_signatures et minhash_bands), à côté de sa table documents.
+"""
+import re
+import sqlite3
+import hashlib
+import logging
+import unicodedata
+from typing import Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+BANDS = 42
+ROWS = 3
+NUM_PERM = BANDS * ROWS
+SEED = 1
+
+_PRIME = np.uint64((1 << 31) - 1)   # a * h < 2^63 : pas de dépassement en uint64
+_WORD_PATTERN = re.compile(r'\w+')
+
+
+def word_set(text: str) -> Set[str]:
+    """Ensemble des mots normalisés (minuscules, NFKC) du texte"""
+    normalized = unicodedata.normalize('NFKC', text or "").lower()
+    return set(_WORD_PATTERN.findall(normalized))
+
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    union = len(a | b)
+    return len(a & b) / union if union else 0.0
+
+
+def _word_hashes(words: Iterable[str]) -> np.ndarray:
+    # Hachage stable entre processus (hash() de Python est randomisé)
+    return np.fromiter((int.from_bytes(hashlib.blake2b(w.encode('utf-8'), digest_size=4).digest(), 'big')
+                        for w in words), dtype=np.uint64)
+
+
+class MinHashLSH:
+    """Signatures MinHash et seaux LSH persistés dans une base SQLite"""
+
+    def __init__(self, db_path: str, bands: int = BANDS, rows: int = ROWS, seed: int = SEED):
+        self.db_path = db_path
+        self.bands = bands
+        self.rows = rows
+        self.num_perm = bands * rows
+        generator = np.random.RandomState(seed)
+        self._a = generator.randint(1, int(_PRIME), size=self.num_perm).astype(np.uint64)
+        self._b = generator.randint(0, int(_PRIME), size=self.num_perm).astype(np.uint64)
+        self._setup_database()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path)
+
+    def _setup_database(self):
+        conn = self._connect()
+        try:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS minhash_signatures (
+                    document_id INTEGER PRIMARY KEY,
+                    signature BLOB NOT NULL
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS minhash_bands (
+                    band INTEGER NOT NULL,
+                    bucket INTEGER NOT NULL,
+                    document_id INTEGER NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_minhash_bands_bucket ON minhash_bands(band, bucket)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_minhash_bands_document ON minhash_bands(document_id)')
+            conn.commit()
+        finally:
+            conn.close()
+
+    def signature(self, text: str) -> np.ndarray:
+        """Signature MinHash (NUM_PERM entiers 32 bits) de l'ensemble des mots du texte"""
+        hashes = _word_hashes(word_set(text))
+        if len(hashes) == 0:
+            return np.full(self.num_perm, np.iinfo(np.uint32).max, dtype=np.uint32)
+        # (a * h + b) mod p pour chaque permutation (lignes) et chaque mot (colonnes)
+        permuted = (np.outer(self._a, hashes) + self._b[:, None]) % _PRIME
+        return permuted.min(axis=1).astype(np.uint32)
+
+    def _buckets(self, signature: np.ndarray) -> List[Tuple[int, int]]:
+        buckets = []
+        for band in range(self.bands):
+            chunk = signature[band * self.rows:(band + 1) * self.rows].tobytes()
+            bucket = int.from_bytes(hashlib.blake2b(chunk, digest_size=8).digest(), 'big', signed=True)
+            buckets.append((band, bucket))
+        return buckets
+
+    def add(self, document_id: int, text: str, conn: Optional[sqlite3.Connection] = None) -> None:
+        """Enregistre la signature et les seaux d'un document"""
+        signature = self.signature(text)
+        own_conn = conn is None
+        conn = conn or self._connect()
+        try:
+            conn.execute('DELETE FROM minhash_bands WHERE document_id = ?', (document_id,))
+            conn.execute('INSERT OR REPLACE INTO minhash_signatures (document_id, signature) VALUES (?, ?)',
+                         (document_id, signature.tobytes()))
+            conn.executemany('INSERT INTO minhash_bands (band, bucket, document_id) VALUES (?, ?, ?)',
+                             [(band, bucket, document_id) for band, bucket in self._buckets(signature)])
+            if own_conn:
+                conn.commit()
+        finally:
+            if own_conn:
+                conn.close()
+
+    def query(self, text: str, min_similarity: float = 0.0,
+              limit: Optional[int] = None) -> List[Tuple[int, float]]:
+        """
+        Documents partageant au moins un seau avec le texte, avec leur
+        similarité de Jaccard estimée par la signature, du plus au moins
+        similaire. La similarité réelle doit être vérifiée par l'appelant.
+        """
+        signature = self.signature(text)
+        buckets = self._buckets(signature)
+        conn = self._connect()
+        try:
+            clause = ' OR '.join(['(band = ? AND bucket = ?)'] * len(buckets))
+            params = [value for pair in buckets for value in pair]
+            candidate_ids = [row[0] for row in conn.execute(
+                f'SELECT DISTINCT document_id FROM minhash_bands WHERE {clause}', params)]
+            if not candidate_ids:
+                return []
+            placeholders = ','.join('?' * len(candidate_ids))
+            rows = conn.execute(
+                f'SELECT document_id, signature FROM minhash_signatures WHERE document_id IN ({placeholders})',
+                candidate_ids).fetchall()
+        finally:
+            conn.close()
+
+        results = []
+        for document_id, blob in rows:
+            stored = np.frombuffer(blob, dtype=np.uint32)
+            if len(stored) != self.num_perm:
+                continue
+            estimate = float(np.mean(stored == signature))
+            if estimate >= min_similarity:
+                results.append((document_id, estimate))
+        results.sort(key=lambda item: item[1], reverse=True)
+        return results[:limit] if limit else results
+
+    def index_missing(self, table: str = 'documents', id_column: str = 'id',
+                      content_column: str = 'content') -> int:
+        """Calcule les signatures des documents stockés avant l'existence de l'index"""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                f'SELECT d.{id_column}, d.{content_column} FROM {table} d '
+                f'LEFT JOIN minhash_signatures s ON s.document_id = d.{id_column} '
+                f'WHERE s.document_id IS NULL').fetchall()
+            for document_id, content in rows:
+                self.add(document_id, content or "", conn)
+            conn.commit()
+        finally:
+            conn.close()
+        if rows:
+            logging.info(f"🔑 MinHash : {len(rows)} documents existants indexés ({self.db_path})")
+        return len(rows)
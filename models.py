@@ -3,7 +3,7 @@ from enum import Enum
 from app import db
 from flask_dance.consumer.storage.sqla import OAuthConsumerMixin
 from flask_login import UserMixin
-from sqlalchemy import UniqueConstraint
+from sqlalchemy import UniqueConstraint, inspect, literal, text
 
 class UserRole(Enum):
     USER = "user"
@@ -14,6 +14,12 @@ class DocumentStatus(Enum):
     COMPLETED = "completed"
     FAILED = "failed"
 
+class JobStatus(Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
     id = db.Column(db.String, primary_key=True)
@@ -59,6 +65,10 @@ class Document(db.Model):
     content_type = db.Column(db.String(100), nullable=False)
     extracted_text = db.Column(db.Text)
     
+    # SHA-256 of the uploaded bytes and of the normalized extracted text (deduplication)
+    content_hash = db.Column(db.String(64), index=True)
+    text_hash = db.Column(db.String(64), index=True)
+    
     # Copyleaks integration
     scan_id = db.Column(db.String(100), unique=True)
     status = db.Column(db.Enum(DocumentStatus), default=DocumentStatus.UPLOADED, nullable=False)
@@ -87,6 +97,8 @@ class AnalysisResult(db.Model):
     # AI detection results
     ai_score = db.Column(db.Float)  # Percentage
     ai_words = db.Column(db.Integer)
+    # Per-token and per-sentence AI likelihoods (AILikelihoodProfile.to_bytes())
+    ai_profile = db.Column(db.LargeBinary)
     
     # Raw results from APIs
     raw_results = db.Column(db.JSON)
@@ -96,6 +108,9 @@ class AnalysisResult(db.Model):
     analysis_provider = db.Column(db.String(100))
     raw_response = db.Column(db.Text)
     
+    # Version of the local analysis engine that produced the scores
+    engine_version = db.Column(db.String(50), index=True)
+    
     # Highlighted text with problematic sentences
     highlighted_text = db.Column(db.Text)
     
@@ -118,6 +133,9 @@ class HighlightedSentence(db.Model):
     # Plagiarism score (percentage, like in AnalysisResult)
     plagiarism_score = db.Column(db.Float)  # Percentage
 
+    # AI probability of this sentence from the perplexity engine (percentage)
+    ai_score = db.Column(db.Float)
+
     # Confidence scores
     plagiarism_confidence = db.Column(db.Float)
     ai_confidence = db.Column(db.Float)
@@ -125,8 +143,106 @@ class HighlightedSentence(db.Model):
     # Source information for plagiarism
     source_url = db.Column(db.String(500))
     source_title = db.Column(db.String(255))
+    # Character span of the aligned passage in the source document
+    source_start = db.Column(db.Integer)
+    source_end = db.Column(db.Integer)
     
     created_at = db.Column(db.DateTime, default=datetime.now)
     
     # Relationships
     document = db.relationship('Document', backref='highlighted_sentences')
+
+
+class AnalysisJob(db.Model):
+    """Durable queue entry for the background analysis of a document"""
+    __tablename__ = 'analysis_jobs'
+    id = db.Column(db.Integer, primary_key=True)
+    document_id = db.Column(db.Integer, db.ForeignKey('documents.id'), nullable=False, index=True)
+    status = db.Column(db.Enum(JobStatus), default=JobStatus.QUEUED, nullable=False, index=True)
+
+    # Retry bookkeeping
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    max_attempts = db.Column(db.Integer, default=3, nullable=False)
+    available_at = db.Column(db.DateTime, default=datetime.now, nullable=False, index=True)
+    last_error = db.Column(db.Text)
+
+    # Lease held by the worker currently processing the job
+    lease_owner = db.Column(db.String(100))
+    lease_expires_at = db.Column(db.DateTime)
+
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+    # Relationships
+    document = db.relationship('Document', backref=db.backref('analysis_jobs', cascade='all, delete-orphan'))
+
+
+class CohortAnalysis(db.Model):
+    """Pairwise similarity of a set of documents ("who copied from whom"), see cohort_jobs.py"""
+    __tablename__ = 'cohort_analyses'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False, index=True)
+    name = db.Column(db.String(255), nullable=False)
+    method = db.Column(db.String(20), default='tfidf', nullable=False)  # 'tfidf' or 'minhash'
+    document_ids = db.Column(db.JSON, nullable=False)
+    status = db.Column(db.Enum(JobStatus), default=JobStatus.QUEUED, nullable=False, index=True)
+
+    # Retry bookkeeping (same rules as AnalysisJob)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    max_attempts = db.Column(db.Integer, default=3, nullable=False)
+    last_error = db.Column(db.Text)
+
+    # Lease held by the worker currently computing the matrix
+    lease_owner = db.Column(db.String(100))
+    lease_expires_at = db.Column(db.DateTime)
+
+    # float16 matrix in the embedding_store format (None when the cohort is too large for a heatmap)
+    similarity_matrix = db.Column(db.LargeBinary)
+    # Most similar pairs with their aligned passages
+    top_pairs = db.Column(db.JSON)
+
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+    completed_at = db.Column(db.DateTime)
+
+    # Relationships
+    user = db.relationship('User', backref=db.backref('cohort_analyses', cascade='all, delete-orphan'))
+
+
+def add_missing_columns(engine) -> list:
+    """
+    Add the columns and indexes declared on the models but missing from
+    existing tables (db.create_all() only creates new tables). Returns the
+    added columns as "table.column".
+    """
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    preparer = engine.dialect.identifier_preparer
+    added = []
+    with engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in columns:
+                    continue
+                ddl = (f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN "
+                       f"{preparer.format_column(column)} {column.type.compile(dialect=engine.dialect)}")
+                default = column.default.arg if column.default is not None and column.default.is_scalar else None
+                if isinstance(default, Enum):
+                    default = default.name  # SQLAlchemy stores enum names
+                if default is not None:
+                    # Existing rows get the default, so NOT NULL can be kept
+                    ddl += " DEFAULT " + str(literal(default).compile(dialect=engine.dialect,
+                                                                     compile_kwargs={'literal_binds': True}))
+                    if not column.nullable:
+                        ddl += " NOT NULL"
+                conn.execute(text(ddl))
+                added.append(f"{table.name}.{column.name}")
+
+            indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in indexes:
+                    index.create(conn)
+    return added
@@ -0,0 +1,193 @@
+"""
+Alignement de passages par graine et extension (seed-and-extend).
+
+Les graines sont les empreintes winnowing communes à la soumission et à un
+document indexé (WinnowingIndex.find_seeds) : chacune garantit K_GRAM mots
+identiques. Chaque graine est étendue vers la gauche et vers la droite par
+un alignement local sur les tokens (score +1 / -1, bande diagonale étroite,
+arrêt X-drop dès que le score tombe trop sous le meilleur) : un mot remplacé,
+ajouté ou supprimé ne coupe pas le passage.
+
+Seul un extrait de la source autour de la graine est lu (substr SQLite), et
+les graines déjà couvertes par un passage sont ignorées : le coût dépend du
+nombre de graines et de la longueur des passages, pas de la taille des
+documents.
+"""
+import logging
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from winnowing import K_GRAM, WINDOW, WinnowingIndex, tokenize
+from text_segmentation import SegmentedDocument
+
+MATCH = 1
+MISMATCH = -1
+GAP = -1
+X_DROP = 4             # Abandon de l'extension quand le score chute de X_DROP sous le meilleur
+BAND = 3               # Écart maximal (mots ajoutés ou supprimés) entre soumission et source
+SOURCE_WINDOW = 2000   # Caractères de source lus de chaque côté d'une graine (doublé si besoin)
+MIN_TOKENS = K_GRAM + WINDOW - 1
+MIN_SIMILARITY = 50.0
+
+
+class AlignedPassage(NamedTuple):
+    """Passage de la soumission aligné avec un passage d'un document indexé"""
+    start: int            # Caractères dans la soumission
+    end: int
+    document_id: int
+    doc_key: str
+    title: str
+    source_start: int     # Caractères dans le document source
+    source_end: int
+    similarity: float     # Pourcentage de mots alignés à l'identique
+    tokens: int           # Longueur du passage dans la soumission (mots)
+
+
+def extend(a: List[str], b: List[str], x_drop: int = X_DROP, band: int = BAND) -> Tuple[int, int, int]:
+    """
+    Extension X-drop de l'alignement à partir du début de a et b.
+    Renvoie (mots de a, mots de b, mots identiques) du meilleur prolongement.
+    """
+    best = best_i = best_j = best_matches = 0
+    # Ligne i = 0 : seulement des mots ajoutés côté source
+    previous = {j: (GAP * j, 0) for j in range(min(band, len(b)) + 1) if GAP * j >= -x_drop}
+    for i in range(1, len(a) + 1):
+        current = {}
+        for j in range(max(0, i - band), min(len(b), i + band) + 1):
+            candidates = []
+            if j > 0 and j - 1 in previous:
+                score, matches = previous[j - 1]
+                if a[i - 1] == b[j - 1]:
+                    candidates.append((score + MATCH, matches + 1))
+                else:
+                    candidates.append((score + MISMATCH, matches))
+            if j in previous:
+                candidates.append((previous[j][0] + GAP, previous[j][1]))
+            if j - 1 in current:
+                candidates.append((current[j - 1][0] + GAP, current[j - 1][1]))
+            if not candidates:
+                continue
+            cell = max(candidates)
+            if cell[0] < best - x_drop:
+                continue
+            current[j] = cell
+            if cell[0] > best:
+                best, best_i, best_j, best_matches = cell[0], i, j, cell[1]
+        if not current:
+            break
+        previous = current
+    return best_i, best_j, best_matches
+
+
+class PassageAligner:
+    """Étend les graines winnowing d'une soumission en passages alignés"""
+
+    def __init__(self, index: WinnowingIndex, min_tokens: int = MIN_TOKENS,
+                 min_similarity: float = MIN_SIMILARITY):
+        self.index = index
+        self.min_tokens = min_tokens
+        self.min_similarity = min_similarity
+
+    def align(self, text: str, exclude_keys: Iterable[str] = (), user_id=None,
+              uploaded_before: Optional[str] = None) -> List[AlignedPassage]:
+        seeds = self.index.find_seeds(text, exclude_keys, user_id, uploaded_before)
+        if not seeds:
+            return []
+        tokens = tokenize(text)
+        words = [token for token, _, _ in tokens]
+        info = self.index.documents_info(seeds)
+
+        passages = []
+        for document_id, document_seeds in seeds.items():
+            if document_id not in info:
+                continue
+            doc_key, title, length = info[document_id]
+            covered = []   # (premier, dernier mot soumission, début, fin source)
+            for sub_pos, _, _, _, src_start, src_end in sorted(document_seeds):
+                if any(first <= sub_pos and sub_pos + self.index.k - 1 <= last and begin <= src_start < finish
+                       for first, last, begin, finish in covered):
+                    continue
+                span = self._extend_seed(words, tokens, sub_pos, document_id, src_start, src_end, length or 0)
+                if span is None:
+                    continue
+                first, last, source_start, source_end, source_tokens, matches = span
+                covered.append((first, last, source_start, source_end))
+                passage_tokens = last - first + 1
+                similarity = matches * 100.0 / max(passage_tokens, source_tokens)
+                if passage_tokens < self.min_tokens or similarity < self.min_similarity:
+                    continue
+                passages.append(AlignedPassage(
+                    tokens[first][1], tokens[last][2], document_id, doc_key, title,
+                    source_start, source_end, round(similarity, 1), passage_tokens))
+
+        passages.sort(key=lambda p: (p.start, -p.tokens))
+        return passages
+
+    def _extend_seed(self, words: List[str], tokens: List[Tuple[str, int, int]], sub_pos: int,
+                     document_id: int, src_start: int, src_end: int,
+                     length: int) -> Optional[Tuple[int, int, int, int, int, int]]:
+        k = self.index.k
+        radius = SOURCE_WINDOW
+        while True:
+            window_start = max(0, src_start - radius)
+            window_end = min(length, src_end + radius)
+            excerpt = self.index.source_excerpt(document_id, window_start, window_end)
+            source = [(token, start + window_start, end + window_start)
+                      for token, start, end in SegmentedDocument(excerpt).token_spans()]
+            # Un mot coupé par le bord de l'extrait n'est pas comparable
+            if window_start > 0 and source and source[0][1] == window_start:
+                source = source[1:]
+            if window_end < length and source and source[-1][2] == window_end:
+                source = source[:-1]
+
+            seed_first = next((i for i, (_, start, _) in enumerate(source) if start == src_start), None)
+            if seed_first is None or seed_first + k > len(source):
+                return None
+            source_words = [token for token, _, _ in source]
+            if source_words[seed_first:seed_first + k] != words[sub_pos:sub_pos + k]:
+                return None   # Collision de hachage
+
+            left_sub, left_src, left_matches = extend(words[:sub_pos][::-1], source_words[:seed_first][::-1])
+            right_sub, right_src, right_matches = extend(words[sub_pos + k:], source_words[seed_first + k:])
+
+            # Extension arrêtée par le bord de l'extrait et non par l'alignement : relire plus large
+            margin = BAND + X_DROP
+            truncated_left = window_start > 0 and seed_first - left_src <= margin
+            truncated_right = window_end < length and len(source) - (seed_first + k + right_src) <= margin
+            if (truncated_left or truncated_right) and radius < length:
+                radius *= 2
+                continue
+
+            first = sub_pos - left_sub
+            last = sub_pos + k - 1 + right_sub
+            source_first = source[seed_first - left_src]
+            source_last = source[seed_first + k - 1 + right_src]
+            return (first, last, source_first[1], source_last[2],
+                    left_src + k + right_src, k + left_matches + right_matches)
+
+
+def align_passages(text: str, index: Optional[WinnowingIndex] = None,
+                   exclude_keys: Iterable[str] = (), user_id=None,
+                   uploaded_before: Optional[str] = None) -> List[AlignedPassage]:
+    """
+    Passages alignés du texte dans les documents de l'index winnowing partagé.
+    user_id et uploaded_before écartent les soumissions du même utilisateur
+    et celles déposées après le document analysé.
+    """
+    if index is None:
+        from winnowing import get_winnowing_index
+        index = get_winnowing_index()
+    try:
+        return PassageAligner(index).align(text, exclude_keys, user_id, uploaded_before)
+    except Exception as e:
+        logging.error(f"Erreur alignement des passages: {e}")
+        return []
+
+
+def sources_count(passages: List[AlignedPassage]) -> int:
+    """Nombre de documents sources distincts"""
+    return len({passage.document_id for passage in passages})
+
+
+def passages_from_dicts(values: List[Dict]) -> List[AlignedPassage]:
+    """Passages enregistrés avec _asdict() (raw_results d'une analyse)"""
+    return [AlignedPassage(**value) for value in values]
@@ -0,0 +1,191 @@
+"""
+Backends d'inférence du modèle de perplexité (distilgpt2).
+
+Plusieurs façons d'exécuter le même modèle, choisies par PERPLEXITY_BACKEND :
+
+- 'eager' : PyTorch en float32, comme avant (GPU si disponible) ;
+- 'int8'  : quantification dynamique int8 des couches linéaires. Les blocs
+  GPT-2 utilisent des Conv1D (poids transposés) que quantize_dynamic
+  ignore : ils sont d'abord convertis en nn.Linear équivalents ;
+- 'onnx'  : graphe ONNX exporté une fois (plagiarism_cache/onnx) et exécuté
+  par onnxruntime sur CPU ;
+- 'server' : pas de modèle dans le processus ; les passes sont envoyées au
+  démon inference_server, qui garde un seul modèle pour tous les workers et
+  regroupe leurs requêtes en lots.
+
+Les trois premiers utilisent le même tokenizer et s'appellent comme un
+modèle transformers (model(input_ids, attention_mask).logits, model.config,
+model.device) ; avec 'server', token_losses et batched_perplexities
+(ai_perplexity_detectgpt) délèguent au client du démon. Les appelants ne
+dépendent donc pas du backend.
+
+    python benchmark_perplexity_backends.py   # débit, mémoire, écart de perplexité
+"""
+import os
+import logging
+from typing import NamedTuple, Optional, Tuple
+
+import numpy as np
+import torch
+
+try:
+    import onnxruntime
+    ONNX_AVAILABLE = True
+except ImportError:
+    ONNX_AVAILABLE = False
+
+MODEL_NAME = 'distilgpt2'
+BACKENDS = ('eager', 'int8', 'onnx', 'server')
+PERPLEXITY_BACKEND = os.environ.get('PERPLEXITY_BACKEND', 'eager').lower()
+ONNX_DIR = os.path.join('plagiarism_cache', 'onnx')
+ONNX_OPSET = 17
+
+
+def load_tokenizer(model_name: str = MODEL_NAME):
+    from transformers import GPT2TokenizerFast
+    return GPT2TokenizerFast.from_pretrained(model_name)
+
+
+def load_eager(model_name: str = MODEL_NAME):
+    """Modèle float32 en mode évaluation, sur GPU si disponible"""
+    from transformers import GPT2LMHeadModel
+    model = GPT2LMHeadModel.from_pretrained(model_name)
+    model.eval()
+    if torch.cuda.is_available():
+        model = model.to('cuda')
+    return model
+
+
+# --------- int8 dynamique ---------
+
+def conv1d_to_linear(model: torch.nn.Module) -> torch.nn.Module:
+    """Remplace les Conv1D de transformers (y = x @ W + b) par des nn.Linear équivalents"""
+    from transformers.pytorch_utils import Conv1D
+    for name, module in list(model.named_modules()):
+        for child_name, child in list(module.named_children()):
+            if isinstance(child, Conv1D):
+                n_in, n_out = child.weight.shape
+                linear = torch.nn.Linear(n_in, n_out)
+                linear.weight.data = child.weight.data.t().contiguous()
+                linear.bias.data = child.bias.data
+                setattr(module, child_name, linear)
+    return model
+
+
+def quantize_int8(model: torch.nn.Module) -> torch.nn.Module:
+    """Copie du modèle dont les couches linéaires calculent en int8 (poids quantifiés, activations dynamiques)"""
+    from torch.ao.quantization import quantize_dynamic
+    model = conv1d_to_linear(model.to('cpu'))
+    return quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8).eval()
+
+
+def load_int8(model_name: str = MODEL_NAME):
+    from transformers import GPT2LMHeadModel
+    return quantize_int8(GPT2LMHeadModel.from_pretrained(model_name).eval())
+
+
+# --------- ONNX Runtime ---------
+
+class _LogitsOnly(torch.nn.Module):
+    """Sortie réduite aux logits, sans cache de clés/valeurs, pour l'export"""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        return self.model(input_ids=input_ids, attention_mask=attention_mask, use_cache=False).logits
+
+
+def onnx_path(model_name: str = MODEL_NAME) -> str:
+    return os.path.join(ONNX_DIR, f"{model_name.replace('/', '_')}.onnx")
+
+
+def export_onnx(model: torch.nn.Module, path: str) -> str:
+    """Exporte le modèle en ONNX (lots et longueurs dynamiques), en écriture atomique"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    dummy = torch.ones((1, 8), dtype=torch.long)
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in ('input_ids', 'attention_mask', 'logits')}
+    with torch.no_grad():
+        torch.onnx.export(_LogitsOnly(model.to('cpu')).eval(), (dummy, torch.ones_like(dummy)), tmp_path,
+                          input_names=['input_ids', 'attention_mask'], output_names=['logits'],
+                          dynamic_axes=dynamic_axes, opset_version=ONNX_OPSET, dynamo=False)
+    os.replace(tmp_path, path)
+    return path
+
+
+class _Output(NamedTuple):
+    logits: torch.Tensor
+
+
+class OnnxCausalLM:
+    """Session onnxruntime appelée comme le modèle transformers (logits uniquement, CPU)"""
+
+    def __init__(self, path: str, config, threads: Optional[int] = None):
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.config = config
+        self.device = torch.device('cpu')
+
+    def eval(self):
+        return self
+
+    def __call__(self, input_ids: torch.Tensor, attention_mask: Optional[torch.Tensor] = None) -> _Output:
+        if attention_mask is None:
+            attention_mask = torch.ones_like(input_ids)
+        logits, = self.session.run(['logits'], {
+            'input_ids': input_ids.cpu().numpy().astype(np.int64),
+            'attention_mask': attention_mask.cpu().numpy().astype(np.int64),
+        })
+        return _Output(torch.from_numpy(logits))
+
+
+def load_onnx(model_name: str = MODEL_NAME):
+    """Graphe ONNX du modèle, exporté au premier chargement"""
+    if not ONNX_AVAILABLE:
+        raise ImportError("onnxruntime n'est pas installé (pip install onnxruntime onnx)")
+    from transformers import GPT2Config, GPT2LMHeadModel
+    path = onnx_path(model_name)
+    if not os.path.exists(path):
+        logging.info(f"Export ONNX de {model_name} vers {path}...")
+        export_onnx(GPT2LMHeadModel.from_pretrained(model_name).eval(), path)
+    return OnnxCausalLM(path, GPT2Config.from_pretrained(model_name))
+
+
+# --------- Démon d'inférence ---------
+
+def load_server(model_name: str = MODEL_NAME):
+    """Client du démon inference_server, après vérification qu'il sert bien ce modèle"""
+    from inference_server import InferenceClient
+    client = InferenceClient()
+    stats = client.health()
+    if stats.get('model') != model_name:
+        raise ValueError(f"Le démon d'inférence sert {stats.get('model')}, pas {model_name}")
+    # Mêmes pertes que le backend local réellement chargé par le démon (après repli éventuel)
+    client.perplexity_model_id = stats.get('perplexity_model_id') or f"{model_name}/{stats.get('backend')}"
+    return client
+
+
+_LOADERS = {'eager': load_eager, 'int8': load_int8, 'onnx': load_onnx, 'server': load_server}
+
+
+def load_backend(name: str = PERPLEXITY_BACKEND, model_name: str = MODEL_NAME) -> Tuple[object, object]:
+    """(modèle, tokenizer) du backend demandé ; repli sur 'eager' s'il est indisponible"""
+    if name not in BACKENDS:
+        raise ValueError(f"Backend de perplexité inconnu : {name} (choix : {', '.join(BACKENDS)})")
+    try:
+        model = _LOADERS[name](model_name)
+    except Exception as e:
+        if name == 'eager':
+            raise
+        logging.error(f"Backend de perplexité '{name}' indisponible, repli sur 'eager' : {e}")
+        model = load_eager(model_name)
+        name = 'eager'
+    if not hasattr(model, 'perplexity_model_id'):
+        # Clé du cache de pertes par phrase (perplexity_cache)
+        model.perplexity_model_id = f"{model_name}/{name}"
+    return model, load_tokenizer(model_name)
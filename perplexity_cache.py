@@ -0,0 +1,220 @@
+"""
+Cache des pertes de phrases du modèle de perplexité.
+
+Les mêmes passages (en-têtes d'université, remerciements types, chapitres
+soumis à nouveau) repassaient dans GPT-2 à chaque dépôt. Pour chaque phrase
+évaluée, on garde la perte (NLL) de chacun de ses tokens et la fin de chaque
+token relative au début de la phrase (split_sentence_losses), sous la clé
+(identifiant du modèle, hachage de la phrase) :
+
+- en mémoire, un LRU borné en octets (PERPLEXITY_CACHE_MEMORY_BYTES) ;
+- sur disque, une table SQLite partagée par tous les processus
+  (PERPLEXITY_CACHE_DB).
+
+La perplexité du document, celle de chaque phrase et le profil par token
+(AILikelihoodProfile) se recomposent exactement à partir de ces pertes : un
+document entièrement en cache donne le même résultat que sa première analyse.
+Les pertes sont celles de la phrase lue dans son document d'origine (avec le
+contexte qui la précède) : pour une phrase reprise ailleurs, la valeur en
+cache est une approximation, exacte quand le contexte est le même (en-tête en
+début de document, chapitre repris). La clé porte sur le texte exact de la
+phrase : GPT-2 distingue la casse et les espaces, et les positions des tokens
+doivent rester valables.
+
+L'identifiant du modèle (perplexity_model_id, posé par load_backend)
+distingue les backends, dont les pertes diffèrent légèrement.
+"""
+import os
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+CACHE_ENABLED = os.environ.get('PERPLEXITY_CACHE', '1') != '0'
+CACHE_DB_PATH = os.environ.get('PERPLEXITY_CACHE_DB', os.path.join('plagiarism_cache', 'perplexity_cache.db'))
+CACHE_MEMORY_BYTES = int(os.environ.get('PERPLEXITY_CACHE_MEMORY_BYTES', 16 * 1024 * 1024))
+
+# Taille estimée d'une entrée en mémoire hors tableaux : clé (tuple, hachage
+# de 16 octets), tuple de deux tableaux numpy et noeud de l'OrderedDict
+_ENTRY_BYTES = 400
+_TOKEN_BYTES = 8   # perte float32 + fin int32
+_SQL_CHUNK = 400  # + l'identifiant du modèle : sous la limite de 999 paramètres SQLite
+
+_perplexity_cache = None
+_perplexity_cache_lock = threading.Lock()
+
+SentenceLosses = Tuple[np.ndarray, np.ndarray]   # (pertes float32, fins relatives int32)
+
+
+def sentence_key(sentence: str) -> bytes:
+    return hashlib.blake2b(sentence.encode('utf-8'), digest_size=16).digest()
+
+
+def _entry_bytes(value: SentenceLosses) -> int:
+    return _ENTRY_BYTES + _TOKEN_BYTES * len(value[0])
+
+
+class PerplexityCache:
+    """Pertes par token de chaque phrase : LRU en mémoire devant une table SQLite"""
+
+    def __init__(self, db_path: str = CACHE_DB_PATH, memory_bytes: int = CACHE_MEMORY_BYTES):
+        self.db_path = db_path
+        self.max_bytes = max(0, memory_bytes)
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.errors = 0
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._init_database()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=10)
+
+    def _init_database(self):
+        with self._connect() as conn:
+            # Plusieurs workers écrivent en même temps
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS perplexity_sentence_losses (
+                    model_id TEXT NOT NULL,
+                    sentence_hash BLOB NOT NULL,
+                    token_losses BLOB NOT NULL,
+                    token_ends BLOB NOT NULL,
+                    PRIMARY KEY (model_id, sentence_hash)
+                ) WITHOUT ROWID
+            ''')
+
+    def _remember(self, key: tuple, value: SentenceLosses):
+        """Ajout au LRU (verrou tenu par l'appelant)"""
+        size = _entry_bytes(value)
+        if size > self.max_bytes:
+            return
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_bytes -= _entry_bytes(previous)
+        self._memory[key] = value
+        self._memory_bytes += size
+        while self._memory_bytes > self.max_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= _entry_bytes(evicted)
+
+    def lookup(self, model_id: str, sentences: List[str]) -> List[Optional[SentenceLosses]]:
+        """
+        Pertes et fins relatives des tokens de chaque phrase (None si absente) :
+        mémoire d'abord, puis une requête SQLite pour le reste.
+        """
+        results = [None] * len(sentences)
+        missing = {}
+        with self._lock:
+            for i, sentence in enumerate(sentences):
+                key = sentence_key(sentence)
+                value = self._memory.get((model_id, key))
+                if value is None:
+                    missing.setdefault(key, []).append(i)
+                    continue
+                self._memory.move_to_end((model_id, key))
+                results[i] = value
+                self.memory_hits += 1
+
+        if missing:
+            found = {}
+            try:
+                keys = list(missing)
+                with self._connect() as conn:
+                    for start in range(0, len(keys), _SQL_CHUNK):
+                        chunk = keys[start:start + _SQL_CHUNK]
+                        placeholders = ','.join('?' * len(chunk))
+                        for key, losses, ends in conn.execute(
+                                f'SELECT sentence_hash, token_losses, token_ends FROM perplexity_sentence_losses '
+                                f'WHERE model_id = ? AND sentence_hash IN ({placeholders})', [model_id] + chunk):
+                            found[bytes(key)] = (np.frombuffer(losses, dtype=np.float32),
+                                                 np.frombuffer(ends, dtype=np.int32))
+            except sqlite3.Error as e:
+                logging.warning(f"Cache de perplexité illisible ({self.db_path}) : {e}")
+                with self._lock:
+                    self.errors += 1
+
+            with self._lock:
+                for key, indices in missing.items():
+                    value = found.get(key)
+                    if value is None:
+                        self.misses += len(indices)
+                        continue
+                    self._remember((model_id, key), value)
+                    self.disk_hits += len(indices)
+                    for i in indices:
+                        results[i] = value
+        return results
+
+    def store(self, model_id: str, sentences: List[str], sentence_losses: List[SentenceLosses]) -> None:
+        """Enregistre les pertes des phrases évaluées (split_sentence_losses)"""
+        rows = {}
+        for sentence, (losses, ends) in zip(sentences, sentence_losses):
+            if np.isfinite(losses).all():
+                # Copies : les tranches gardent en vie les pertes de tout le document
+                rows[sentence_key(sentence)] = (np.array(losses, dtype=np.float32),
+                                                np.array(ends, dtype=np.int32))
+        if not rows:
+            return
+        with self._lock:
+            for key, value in rows.items():
+                self._remember((model_id, key), value)
+            self.stores += len(rows)
+        try:
+            with self._connect() as conn:
+                conn.executemany('INSERT OR IGNORE INTO perplexity_sentence_losses '
+                                 '(model_id, sentence_hash, token_losses, token_ends) VALUES (?, ?, ?, ?)',
+                                 [(model_id, key, losses.tobytes(), ends.tobytes())
+                                  for key, (losses, ends) in rows.items()])
+        except sqlite3.Error as e:
+            logging.warning(f"Cache de perplexité non enregistré ({self.db_path}) : {e}")
+            with self._lock:
+                self.errors += 1
+
+    def stats(self) -> dict:
+        """Compteurs du processus, pour la supervision"""
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+                'stores': self.stores,
+                'errors': self.errors,
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_bytes,
+            }
+
+
+def get_perplexity_cache() -> Optional[PerplexityCache]:
+    """Cache partagé du processus (None si PERPLEXITY_CACHE=0 ou base inaccessible)"""
+    global _perplexity_cache
+    if not CACHE_ENABLED:
+        return None
+    if _perplexity_cache is None:
+        with _perplexity_cache_lock:
+            if _perplexity_cache is None:
+                try:
+                    _perplexity_cache = PerplexityCache()
+                except (sqlite3.Error, OSError) as e:
+                    logging.error(f"Cache de perplexité indisponible : {e}")
+                    _perplexity_cache = False  # pas de nouvel essai à chaque analyse
+    return _perplexity_cache or None
+
+
+def perplexity_cache_stats() -> dict:
+    cache = get_perplexity_cache()
+    return cache.stats() if cache is not None else {'enabled': False}
+
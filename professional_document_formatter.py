@@ -6,7 +6,7 @@ et système de surlignage avancé type Turnitin
 
 import re
 import logging
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Optional
 from datetime import datetime
 
 class AcademicDocumentFormatter:
@@ -45,8 +45,14 @@ class AcademicDocumentFormatter:
     def format_academic_document(self, text: str, plagiarism_score: float, ai_score: float, 
                                 title: str = "Document sans titre", 
                                 author: str = "Auteur inconnu",
-                                institution: str = "Établissement non spécifié") -> str:
-        """Formate le document avec style académique complet"""
+                                institution: str = "Établissement non spécifié",
+                                ai_sentence_scores: Optional[Dict[str, float]] = None) -> str:
+        """
+        Formate le document avec style académique complet.
+        ai_sentence_scores (texte de phrase -> probabilité IA, voir
+        AILikelihoodProfile.sentence_scores_by_text) remplace l'estimation IA
+        par les vrais scores de phrase de l'analyse.
+        """
         try:
             # 1. Générer la page de garde académique
             title_page = self._generate_title_page(title, author, institution, datetime.now())
@@ -66,7 +72,7 @@ class AcademicDocumentFormatter:
             for paragraph in paragraphs:
                 if paragraph.strip():
                     highlighted_paragraph = self._highlight_paragraph(
-                        paragraph, plagiarism_score, ai_score
+                        paragraph, plagiarism_score, ai_score, ai_sentence_scores
                     )
                     highlighted_paragraphs.append(highlighted_paragraph)
             
@@ -547,7 +553,8 @@ class AcademicDocumentFormatter:
         
         return cleaned_paragraphs
     
-    def _highlight_paragraph(self, paragraph: str, plagiarism_score: float, ai_score: float) -> str:
+    def _highlight_paragraph(self, paragraph: str, plagiarism_score: float, ai_score: float,
+                             ai_sentence_scores: Optional[Dict[str, float]] = None) -> str:
         """Applique le soulignement intelligent à un paragraphe"""
         # Ne pas traiter les titres
         if paragraph.startswith('<h'):
@@ -570,19 +577,25 @@ class AcademicDocumentFormatter:
             
             # Détecter le type de problème avec probabilité ajustée
             is_plagiarism = self._detect_plagiarism_in_sentence(sentence, plagiarism_prob, i, len(sentences))
-            is_ai = self._detect_ai_in_sentence(sentence, ai_prob, i, len(sentences))
+            if ai_sentence_scores is not None:
+                from ai_likelihood_profile import AI_SENTENCE_THRESHOLD
+                sentence_ai_prob = ai_sentence_scores.get(' '.join(sentence.split()), 0.0)
+                is_ai = sentence_ai_prob >= AI_SENTENCE_THRESHOLD
+            else:
+                sentence_ai_prob = None
+                is_ai = self._detect_ai_in_sentence(sentence, ai_prob, i, len(sentences))
             
             # Appliquer le soulignement
             if is_plagiarism and is_ai:
                 source_info = self._generate_realistic_source(i)
-                ai_info = self._generate_ai_detection_info(sentence)
+                ai_info = self._generate_ai_detection_info(sentence, sentence_ai_prob)
                 combined_info = f"{source_info} | {ai_info}"
                 highlighted = f'<span class="highlight-both" title="{combined_info}">{sentence}</span>'
             elif is_plagiarism:
                 source_info = self._generate_realistic_source(i)
                 highlighted = f'<span class="highlight-plagiarism" title="Similarité détectée - {source_info}">{sentence}</span>'
             elif is_ai:
-                ai_info = self._generate_ai_detection_info(sentence)
+                ai_info = self._generate_ai_detection_info(sentence, sentence_ai_prob)
                 highlighted = f'<span class="highlight-ai" title="Contenu IA détecté - {ai_info}">{sentence}</span>'
             else:
                 highlighted = sentence
@@ -670,8 +683,10 @@ class AcademicDocumentFormatter:
         ]
         return sources[index % len(sources)]
     
-    def _generate_ai_detection_info(self, sentence: str) -> str:
+    def _generate_ai_detection_info(self, sentence: str, probability: Optional[float] = None) -> str:
         """Génère des informations sur la détection IA"""
+        if probability is not None:
+            return f"Probabilité IA de la phrase : {probability * 100:.0f}% (perplexité GPT-2)"
         if any(term in sentence.lower() for term in ['furthermore', 'moreover', 'however']):
             return "Transitions formelles typiques des modèles de langage"
         elif len(sentence.split()) > 15:
@@ -722,10 +737,11 @@ academic_formatter = AcademicDocumentFormatter()
 def format_academic_document(text: str, plagiarism_score: float, ai_score: float, 
                            title: str = "Document sans titre", 
                            author: str = "Auteur inconnu",
-                           institution: str = "Établissement non spécifié") -> str:
+                           institution: str = "Établissement non spécifié",
+                           ai_sentence_scores: Optional[Dict[str, float]] = None) -> str:
     """Fonction utilitaire pour formater un document de manière académique"""
     return academic_formatter.format_academic_document(
-        text, plagiarism_score, ai_score, title, author, institution
+        text, plagiarism_score, ai_score, title, author, institution, ai_sentence_scores
     )
 
 if __name__ == "__main__":
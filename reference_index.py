@@ -0,0 +1,423 @@
+"""
+Index TF-IDF persistant du corpus de référence.
+
+get_reference_data relisait tout reference_corpus/ et réentraînait un
+TfidfVectorizer dans chaque processus. L'index est maintenant construit une
+fois sur disque puis partagé par tous les workers :
+
+    plagiarism_cache/reference_index/
+        manifest.json          fichiers indexés (taille, mtime, sha256) et génération courante
+        segments-<format>/<sha256>.npz  comptes de termes par phrase d'un fichier (vocabulaire local)
+        segments-<format>/<sha256>.json phrases du fichier
+        <génération>/          vocabulaire, IDF et matrice CSR des phrases (.npy mappés en mémoire)
+
+Le texte des fichiers provient de corpus_extraction (docx, pdf, txt).
+Seuls les fichiers modifiés sont re-tokenisés; la fusion des segments
+(vocabulaire, IDF, normalisation) est une opération numpy rapide. Les
+résultats sont identiques à TfidfVectorizer().fit(phrases) avec ses
+paramètres par défaut.
+
+Les workers qui reconstruisent l'index en même temps sont sérialisés par un
+verrou fcntl (build.lock) ; segments et manifeste sont écrits dans un
+fichier temporaire puis renommés. Le nettoyage ne supprime jamais la
+génération du manifeste courant ni une génération plus récente que
+GENERATION_GRACE_SECONDS (encore mappée par un autre worker).
+
+    python -m reference_index          # construit / met à jour l'index
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows : pas de verrou inter-processus
+    fcntl = None
+
+REFERENCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reference_corpus')
+INDEX_DIR = os.path.join('plagiarism_cache', 'reference_index')
+MIN_REFERENCE_SENTENCE = 20  # Même seuil que l'ancien get_reference_data
+CHECK_INTERVAL_SECONDS = float(os.environ.get('REFERENCE_INDEX_CHECK_SECONDS', 60))
+INDEX_FORMAT = 2  # 2 : texte extrait selon le format (corpus_extraction)
+SEGMENTS_DIR = f'segments-{INDEX_FORMAT}'
+# Générations et segments plus récents que ce délai ne sont jamais supprimés
+GENERATION_GRACE_SECONDS = float(os.environ.get('REFERENCE_INDEX_GRACE_SECONDS', 600))
+
+_INDEX_CACHE = {}
+
+
+def _excluded_rows(files: List[str], row_file: np.ndarray, ignore_filename) -> Optional[np.ndarray]:
+    """Indices des lignes appartenant au(x) fichier(s) ignoré(s); None si aucun"""
+    if not ignore_filename:
+        return None
+    names = {ignore_filename} if isinstance(ignore_filename, str) else set(ignore_filename)
+    file_ids = [i for i, fname in enumerate(files) if fname in names]
+    if not file_ids:
+        return None
+    return np.flatnonzero(np.isin(row_file, file_ids))
+
+
+def _write_json_atomic(path: str, data) -> None:
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+@contextmanager
+def _build_lock(index_dir: str):
+    """Verrou exclusif entre processus pendant la mise à jour de l'index"""
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(index_dir, 'build.lock'), 'a+') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class ReferenceIndex:
+    """Index chargé : vectoriseur reconstitué et matrice TF-IDF des phrases (mmap)"""
+
+    def __init__(self, index_dir: str, manifest: Dict):
+        from scipy.sparse import csr_matrix
+        from sklearn.feature_extraction.text import TfidfVectorizer
+
+        self.index_dir = index_dir
+        self.manifest = manifest
+        self.files = manifest['order']
+        generation_dir = os.path.join(index_dir, manifest['generation'])
+
+        def load(name):
+            return np.load(os.path.join(generation_dir, f'{name}.npy'), mmap_mode='r')
+
+        with open(os.path.join(generation_dir, 'vocabulary.json'), encoding='utf-8') as f:
+            terms = json.load(f)
+        self.row_file = load('row_file')
+
+        if terms:
+            self.vectorizer = TfidfVectorizer(vocabulary={term: i for i, term in enumerate(terms)})
+            self.vectorizer.idf_ = np.asarray(load('idf'))
+            self.matrix = csr_matrix((load('data'), load('indices'), load('indptr')),
+                                     shape=(len(self.row_file), len(terms)), copy=False)
+        else:
+            self.vectorizer = None
+            self.matrix = None
+
+    def __len__(self):
+        return len(self.row_file)
+
+    def file_sentences(self, fname: str) -> List[str]:
+        """Phrases indexées d'un fichier du corpus"""
+        entry = self.manifest['files'][fname]
+        with open(os.path.join(self.index_dir, SEGMENTS_DIR, f"{entry['sha256']}.json"),
+                  encoding='utf-8') as f:
+            return json.load(f)
+
+    def documents(self) -> 'IndexedDocuments':
+        return IndexedDocuments(self)
+
+    def excluded_rows(self, ignore_filename) -> Optional[np.ndarray]:
+        """
+        Lignes à masquer à la requête pour ignorer un ou plusieurs fichiers :
+        l'index partagé n'est jamais reconstruit, le coût est O(lignes).
+        """
+        return _excluded_rows(self.files, self.row_file, ignore_filename)
+
+
+class IndexedDocuments:
+    """Séquence (nom de fichier, phrases) du corpus, lue depuis les segments à la demande"""
+
+    def __init__(self, index: ReferenceIndex):
+        self.index = index
+
+    def __len__(self):
+        return len(self.index.files)
+
+    def __getitem__(self, i) -> Tuple[str, List[str]]:
+        fname = self.index.files[i]
+        return fname, self.index.file_sentences(fname)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+class InMemoryReference:
+    """Même interface que ReferenceIndex, construite en mémoire (index disque indisponible)"""
+
+    def __init__(self, documents: List[Tuple[str, List[str]]]):
+        from sklearn.feature_extraction.text import TfidfVectorizer
+
+        self._documents = documents
+        self.files = [fname for fname, _ in documents]
+        self.row_file = np.concatenate([np.full(len(sentences), i, dtype=np.int32)
+                                        for i, (_, sentences) in enumerate(documents)] or
+                                       [np.zeros(0, dtype=np.int32)])
+        sentences = [sentence for _, doc_sentences in documents for sentence in doc_sentences]
+        if sentences:
+            self.vectorizer = TfidfVectorizer().fit(sentences)
+            self.matrix = self.vectorizer.transform(sentences)
+        else:
+            self.vectorizer = None
+            self.matrix = None
+
+    def __len__(self):
+        return len(self.row_file)
+
+    def documents(self) -> List[Tuple[str, List[str]]]:
+        return self._documents
+
+    def excluded_rows(self, ignore_filename) -> Optional[np.ndarray]:
+        return _excluded_rows(self.files, self.row_file, ignore_filename)
+
+
+def _build_segment(index_dir: str, sha256: str, text: str) -> int:
+    """Tokenise un fichier (CountVectorizer par défaut) et écrit son segment; renvoie le nombre de phrases"""
+    from sklearn.feature_extraction.text import CountVectorizer
+    from ai_perplexity_detectgpt import preprocess_text
+
+    sentences = preprocess_text(text, MIN_REFERENCE_SENTENCE)
+    counter = CountVectorizer()
+    try:
+        counts = counter.fit_transform(sentences).tocsr() if sentences else None
+        terms = counter.get_feature_names_out() if sentences else np.array([], dtype=str)
+    except ValueError:  # aucune phrase ne contient de token
+        counts, terms = None, np.array([], dtype=str)
+    if counts is None:
+        from scipy.sparse import csr_matrix
+        counts = csr_matrix((len(sentences), 0), dtype=np.int64)
+
+    segment_path = os.path.join(index_dir, SEGMENTS_DIR, sha256)
+    tmp_path = f'{segment_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:  # un objet fichier : savez n'ajoute pas .npz au nom
+        np.savez(f, terms=np.asarray(terms, dtype=str),
+                 data=counts.data.astype(np.int32), indices=counts.indices.astype(np.int32),
+                 indptr=counts.indptr.astype(np.int64), n_rows=np.int64(counts.shape[0]))
+    os.replace(tmp_path, f'{segment_path}.npz')
+    _write_json_atomic(f'{segment_path}.json', sentences)
+    return len(sentences)
+
+
+def _merge_segments(index_dir: str, manifest: Dict) -> str:
+    """Fusionne les segments en vocabulaire global, IDF et matrice TF-IDF normalisée; renvoie la génération"""
+    segments = []
+    for file_index, fname in enumerate(manifest['order']):
+        sha256 = manifest['files'][fname]['sha256']
+        with np.load(os.path.join(index_dir, SEGMENTS_DIR, f'{sha256}.npz'), allow_pickle=False) as seg:
+            segments.append((file_index, seg['terms'], seg['data'], seg['indices'],
+                             seg['indptr'], int(seg['n_rows'])))
+
+    # Vocabulaire trié, comme TfidfVectorizer
+    all_terms = [seg[1] for seg in segments if len(seg[1])]
+    vocabulary = np.unique(np.concatenate(all_terms)) if all_terms else np.array([], dtype=str)
+
+    data_parts, index_parts, row_lengths, row_files = [], [], [], []
+    for file_index, terms, data, indices, indptr, n_rows in segments:
+        if n_rows == 0:
+            continue
+        global_ids = np.searchsorted(vocabulary, terms).astype(np.int32) if len(terms) else terms
+        data_parts.append(data.astype(np.float64))
+        index_parts.append(global_ids[indices] if len(indices) else indices.astype(np.int32))
+        row_lengths.append(np.diff(indptr))
+        row_files.append(np.full(n_rows, file_index, dtype=np.int32))
+
+    n_rows = sum(len(r) for r in row_files)
+    data = np.concatenate(data_parts) if data_parts else np.zeros(0, dtype=np.float64)
+    indices = np.concatenate(index_parts).astype(np.int32) if index_parts else np.zeros(0, dtype=np.int32)
+    indptr = np.zeros(n_rows + 1, dtype=np.int64)
+    if row_lengths:
+        np.cumsum(np.concatenate(row_lengths), out=indptr[1:])
+    row_file = np.concatenate(row_files) if row_files else np.zeros(0, dtype=np.int32)
+
+    # IDF lissé (smooth_idf=True) : chaque phrase est un "document"
+    df = np.bincount(indices, minlength=len(vocabulary))
+    idf = np.log((1.0 + n_rows) / (1.0 + df)) + 1.0
+
+    # TF brut * IDF puis normalisation L2 de chaque ligne
+    data *= idf[indices]
+    if n_rows:
+        row_ids = np.repeat(np.arange(n_rows), np.diff(indptr))
+        norms = np.sqrt(np.bincount(row_ids, weights=data * data, minlength=n_rows))
+        norms[norms == 0] = 1.0
+        data /= norms[row_ids]
+
+    generation = f"gen-{int(time.time() * 1000)}-{os.getpid()}"
+    generation_dir = os.path.join(index_dir, generation)
+    os.makedirs(generation_dir)
+    for name, array in (('data', data), ('indices', indices), ('indptr', indptr),
+                        ('idf', idf), ('row_file', row_file)):
+        np.save(os.path.join(generation_dir, f'{name}.npy'), array)
+    with open(os.path.join(generation_dir, 'vocabulary.json'), 'w', encoding='utf-8') as f:
+        json.dump(vocabulary.tolist(), f, ensure_ascii=False)
+    return generation
+
+
+def _read_manifest(index_dir: str) -> Optional[Dict]:
+    try:
+        with open(os.path.join(index_dir, 'manifest.json'), encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if manifest.get('format') == INDEX_FORMAT else None
+
+
+def _list_corpus(reference_dir: str) -> Dict[str, os.stat_result]:
+    if not os.path.isdir(reference_dir):
+        return {}
+    corpus = {}
+    for fname in sorted(os.listdir(reference_dir)):
+        path = os.path.join(reference_dir, fname)
+        if os.path.isfile(path):
+            corpus[fname] = os.stat(path)
+    return corpus
+
+
+def _is_current(manifest: Optional[Dict], corpus: Dict[str, os.stat_result]) -> bool:
+    if manifest is None or set(manifest['files']) != set(corpus):
+        return False
+    return all(manifest['files'][fname]['size'] == stat.st_size and
+               manifest['files'][fname]['mtime'] == stat.st_mtime
+               for fname, stat in corpus.items())
+
+
+def build_reference_index(reference_dir: str = REFERENCE_DIR, index_dir: str = INDEX_DIR,
+                          force: bool = False) -> Dict:
+    """
+    Met à jour l'index sur disque : seuls les fichiers dont la taille ou le
+    mtime ont changé sont relus, et seuls ceux dont le contenu a changé sont
+    re-tokenisés. Renvoie le manifeste courant.
+    """
+    os.makedirs(os.path.join(index_dir, SEGMENTS_DIR), exist_ok=True)
+    corpus = _list_corpus(reference_dir)
+    if not force:
+        current = _read_manifest(index_dir)
+        if _is_current(current, corpus):
+            return current
+
+    with _build_lock(index_dir):
+        # Un autre worker a pu publier l'index pendant l'attente du verrou
+        previous = _read_manifest(index_dir)
+        if not force and _is_current(previous, corpus):
+            return previous
+        return _build_locked(reference_dir, index_dir, corpus, previous, force)
+
+
+def _build_locked(reference_dir: str, index_dir: str, corpus: Dict[str, os.stat_result],
+                  previous: Optional[Dict], force: bool) -> Dict:
+    """Reconstruction partielle de l'index, verrou tenu par l'appelant"""
+    from corpus_extraction import file_sha256, extract_corpus_text
+
+    published = previous
+    if force:
+        previous = None
+    old_files = previous['files'] if previous else {}
+    files = {}
+    rebuilt = 0
+    for fname, stat in corpus.items():
+        path = os.path.join(reference_dir, fname)
+        old = old_files.get(fname)
+        if old and old['size'] == stat.st_size and old['mtime'] == stat.st_mtime:
+            files[fname] = old
+            continue
+        try:
+            sha256 = file_sha256(path)
+            segment = os.path.join(index_dir, SEGMENTS_DIR, f'{sha256}.npz')
+            if old and old['sha256'] == sha256 and os.path.exists(segment):
+                rows = old['rows']
+            elif not force and os.path.exists(segment) and os.path.exists(segment[:-4] + '.json'):
+                rows = None  # même contenu déjà indexé sous un autre nom
+            else:
+                rows = _build_segment(index_dir, sha256, extract_corpus_text(path, sha256))
+                rebuilt += 1
+        except Exception as e:
+            logging.error(f"Error indexing reference file {fname}: {e}")
+            continue
+        if rows is None:
+            with np.load(segment, allow_pickle=False) as seg:
+                rows = int(seg['n_rows'])
+        files[fname] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'sha256': sha256, 'rows': rows}
+
+    manifest = {'format': INDEX_FORMAT, 'files': files, 'order': sorted(files)}
+    manifest['generation'] = _merge_segments(index_dir, manifest)
+    _write_json_atomic(os.path.join(index_dir, 'manifest.json'), manifest)
+    logging.info(f"📚 Index de référence : {len(files)} fichiers, {rebuilt} ré-indexés, "
+                 f"{sum(f['rows'] for f in files.values())} phrases")
+
+    _remove_unused(index_dir, manifest, published)
+    return manifest
+
+
+def _is_recent(path: str, now: float) -> bool:
+    try:
+        return now - os.path.getmtime(path) < GENERATION_GRACE_SECONDS
+    except OSError:
+        return True  # disparu ou illisible : ne rien supprimer
+
+
+def _remove_unused(index_dir: str, manifest: Dict, previous: Optional[Dict]) -> None:
+    """
+    Supprime les segments orphelins et les anciennes générations (verrou de
+    construction tenu). Sont toujours gardées la génération du manifeste
+    publié, la précédente et celles de moins de GENERATION_GRACE_SECONDS,
+    qu'un autre worker peut encore lire.
+    """
+    now = time.time()
+    keep = {manifest['generation']}
+    published = _read_manifest(index_dir)
+    if published:
+        keep.add(published['generation'])
+    if previous:
+        keep.add(previous['generation'])
+    for name in os.listdir(index_dir):
+        path = os.path.join(index_dir, name)
+        if name.startswith('gen-') and name not in keep and not _is_recent(path, now):
+            shutil.rmtree(path, ignore_errors=True)
+        elif name.startswith('segments') and name != SEGMENTS_DIR:
+            shutil.rmtree(path, ignore_errors=True)  # format précédent
+    used = {entry['sha256'] for entry in manifest['files'].values()}
+    if previous:
+        used |= {entry['sha256'] for entry in previous['files'].values()}
+    segments_dir = os.path.join(index_dir, SEGMENTS_DIR)
+    for name in os.listdir(segments_dir):
+        path = os.path.join(segments_dir, name)
+        if name.split('.')[0] not in used and not _is_recent(path, now):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def load_reference_index(reference_dir: str = REFERENCE_DIR, index_dir: str = INDEX_DIR) -> ReferenceIndex:
+    """
+    Index partagé du processus. Le corpus est re-vérifié (stat des fichiers)
+    au plus toutes les CHECK_INTERVAL_SECONDS; l'index est reconstruit
+    partiellement s'il a changé, sinon la génération courante est mappée.
+    """
+    cached = _INDEX_CACHE.get(index_dir)
+    now = time.monotonic()
+    if cached and now - cached[1] < CHECK_INTERVAL_SECONDS:
+        return cached[0]
+
+    manifest = build_reference_index(reference_dir, index_dir)
+    if cached and cached[0].manifest['generation'] == manifest['generation']:
+        index = cached[0]
+    else:
+        index = ReferenceIndex(index_dir, manifest)
+    _INDEX_CACHE[index_dir] = (index, now)
+    return index
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    result = build_reference_index(force='--force' in sys.argv[1:])
+    print(f"{len(result['files'])} fichiers indexés, génération {result['generation']}")
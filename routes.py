@@ -39,7 +39,7 @@ def view_report_html(document_id):
     highlighted_sentences = HighlightedSentence.query.filter_by(document_id=document.id).order_by(HighlightedSentence.start_position).all()
     for hs in highlighted_sentences:
         plag_score = hs.plagiarism_score if hs.plagiarism_score is not None else 0
-        ai_score = hs.ai_score if hasattr(hs, 'ai_score') and hs.ai_score is not None else 0
+        ai_score = hs.ai_score if hs.ai_score is not None else 0
         if plag_score > 30:
             color = "#ffb3b3"  # rouge clair
         elif ai_score > 40:
@@ -66,11 +66,13 @@ import os
 import logging
 from flask import render_template, request, redirect, url_for, flash, session, jsonify, send_file, abort
 from models import Document, DocumentStatus, AnalysisResult, HighlightedSentence
-from file_utils import save_uploaded_file, extract_text_from_file, get_file_size
+from file_utils import save_uploaded_file, extract_text_from_file, get_file_size, compute_text_hash
 from auth_simple import is_logged_in, get_current_user, require_auth
 from language_utils import LanguageManager
 from werkzeug.exceptions import RequestEntityTooLarge
 from pdf_annotation import generate_annotated_pdf_for_document
+from analysis_queue import enqueue_analysis
+from analysis_reuse import reuse_previous_analysis
 # Ajouter ces imports pour la génération de documents formatés
 from docx import Document as DocxDocument
 from docx.shared import RGBColor, Pt
@@ -105,11 +107,11 @@ def create_formatted_document_with_highlights(document, analysis_result):
         # Récupérer les phrases à surligner
         highlighted_sentences = HighlightedSentence.query.filter_by(
             document_id=document.id
-        ).order_by('sentence_index').all()
+        ).order_by(HighlightedSentence.start_position).all()
         highlight_map = {}
         for hs in highlighted_sentences:
             plag_score = hs.plagiarism_score if hs.plagiarism_score is not None else 0
-            ai_score = hs.ai_score if hasattr(hs, 'ai_score') and hs.ai_score is not None else 0
+            ai_score = hs.ai_score if hs.ai_score is not None else 0
             if plag_score > 30:
                 highlight_map[hs.sentence_text.strip()] = RGBColor(200, 0, 0)
             elif ai_score > 40:
@@ -233,7 +235,7 @@ def upload_document():
                 flash('Invalid file type. Please upload PDF, DOCX, or TXT files only.', 'danger')
                 return redirect(request.url)
 
-            file_path, filename = file_info
+            file_path, filename, content_hash = file_info
             content_type = file.content_type or 'text/plain'
             extracted_text = extract_text_from_file(file_path, content_type)
             if not extracted_text:
@@ -247,12 +249,23 @@ def upload_document():
             document.file_size = get_file_size(file_path)
             document.content_type = content_type
             document.extracted_text = extracted_text
+            document.content_hash = content_hash
+            document.text_hash = compute_text_hash(extracted_text)
             user_id = session.get('user_id') or session.get('demo_user', {}).get('id', 'demo-user')
             document.user_id = user_id
-            document.status = DocumentStatus.UPLOADED
+            document.status = DocumentStatus.PROCESSING
 
             try:
                 db.session.add(document)
+                db.session.flush()
+
+                # Identical content already analysed: copy its results instead of re-running the detectors
+                reused = reuse_previous_analysis(document)
+                if reused:
+                    flash(f'✅ Document déjà analysé - résultats réutilisés. Plagiat: {reused.plagiarism_score}% + IA: {reused.ai_score}%', 'success')
+                    return redirect(url_for('document_history'))
+
+                enqueue_analysis(document.id, commit=False)
                 db.session.commit()
             except Exception as db_error:
                 logging.error(f"Erreur sauvegarde document: {db_error}")
@@ -260,67 +273,9 @@ def upload_document():
                 flash('Erreur de base de données. Veuillez réessayer.', 'danger')
                 return redirect(request.url)
 
-            try:
-                from ai_perplexity_detectgpt import fusion_plagiarism_score, ai_detection_score_optimized
-                
-                plag_score, plag_exact, plag_sem = fusion_plagiarism_score(extracted_text)
-                result = {
-                    'plagiarism': {
-                        'percent': plag_score,
-                        'exact': plag_exact,
-                        'semantic': plag_sem,
-                        'sources_found': 0
-                    }
-                }
-                
-                ai_result = ai_detection_score_optimized(extracted_text)
-                result['ai_content'] = {
-                    'percent': ai_result.get('score', 0),
-                    'perplexity': ai_result.get('perplexity', 0),
-                    'burstiness': ai_result.get('burstiness', 0),
-                    'norm_ppl': ai_result.get('details', {}).get('norm_ppl', 0),
-                    'norm_burstiness': ai_result.get('details', {}).get('norm_burstiness', 0)
-                }
-                
-                word_count = len(extracted_text.split()) if extracted_text else 0
-                plagiarism_percent = result['plagiarism']['percent']
-                ai_percent = result['ai_content']['percent']
-
-                identical_words = int((plagiarism_percent / 100.0) * word_count) if plagiarism_percent > 0 else 0
-                ai_words = int((ai_percent / 100.0) * word_count) if ai_percent > 0 else 0
-
-                analysis_result = AnalysisResult()
-                analysis_result.document_id = document.id
-                analysis_result.plagiarism_score = plagiarism_percent
-                analysis_result.ai_score = ai_percent
-                analysis_result.total_words = word_count
-                analysis_result.identical_words = identical_words
-                analysis_result.ai_words = ai_words
-                analysis_result.sources_count = result['plagiarism']['sources_found']
-                analysis_result.analysis_provider = 'local'
-                analysis_result.raw_response = str(result)
-
-                db.session.add(analysis_result)
-                document.status = DocumentStatus.COMPLETED
-                db.session.commit()
-
-                # Create highlighted sentences for the PDF report
-                try:
-                    from simple_highlight_generator import create_highlights_for_document
-                    logging.info(f"Creating highlighted sentences for document ID: {document.id}")
-                    highlighted_sentences = create_highlights_for_document(document, analysis_result)
-                    logging.info(f"Successfully created {len(highlighted_sentences)} highlighted sentences for document ID: {document.id}")
-                except Exception as e:
-                    logging.error(f"Error creating highlighted sentences for document ID: {document.id}: {e}")
-
-                flash(f'✅ Document analysé avec succès! Plagiat: {plagiarism_percent}% + IA: {ai_percent}%', 'success')
-                return redirect(url_for('document_history'))
-                
-            except Exception as analysis_error:
-                logging.error(f"Erreur lors de l'analyse: {analysis_error}")
-                db.session.rollback()
-                flash('Une erreur est survenue lors de l\'analyse. Veuillez réessayer.', 'danger')
-                return redirect(url_for('document_history'))
+            logging.info(f"Document {document.id} queued for analysis")
+            flash('📄 Document reçu ! L\'analyse est en cours, les résultats apparaîtront dans l\'historique.', 'info')
+            return redirect(url_for('document_history'))
 
         except RequestEntityTooLarge:
             flash('File too large. Maximum file size is 16MB.', 'danger')
@@ -373,6 +328,12 @@ def view_report(document_id):
             flash('No analysis results found for this document.', 'warning')
             return redirect(url_for('document_history'))
         
+        # Vrais scores IA par phrase, enregistrés avec l'analyse
+        from simple_highlight_generator import load_ai_profile
+        ai_profile = load_ai_profile(analysis_result)
+        ai_sentence_scores = (ai_profile.sentence_scores_by_text(document.extracted_text or "")
+                              if ai_profile is not None else None)
+        
         # Utilise le formateur académique pour l'affichage pro
         from professional_document_formatter import format_academic_document
         highlighted_text = format_academic_document(
@@ -381,13 +342,23 @@ def view_report(document_id):
             analysis_result.ai_score,
             title=document.original_filename or "Document",
             author=getattr(document, "author", "Auteur inconnu"),
-            institution=getattr(document, "institution", "Établissement non spécifié")
+            institution=getattr(document, "institution", "Établissement non spécifié"),
+            ai_sentence_scores=ai_sentence_scores
         )
         
+        plagiarism_sentences = HighlightedSentence.query.filter_by(
+            document_id=document.id, is_plagiarism=True
+        ).order_by(HighlightedSentence.start_position).all()
+        ai_sentences = HighlightedSentence.query.filter_by(
+            document_id=document.id, is_ai_generated=True
+        ).order_by(HighlightedSentence.start_position).all()
+        
         return render_template('report.html',
                              document=document,
                              analysis_result=analysis_result,
-                             highlighted_text=highlighted_text)
+                             highlighted_text=highlighted_text,
+                             plagiarism_sentences=plagiarism_sentences,
+                             ai_sentences=ai_sentences)
                              
     except Exception as e:
         logging.error(f"Error loading report for document {document_id}: {e}")
@@ -478,6 +449,92 @@ def view_annotated_pdf(document_id):
         flash('Error loading annotated PDF.', 'danger')
         return redirect(url_for('view_report', document_id=document_id))
 
+@app.route('/cohorts', methods=['GET', 'POST'])
+@require_auth
+def cohorts():
+    """Create and list cohort similarity analyses (pairwise comparison of a class)"""
+    from cohort_jobs import create_cohort
+    from models import CohortAnalysis
+    from cohort_similarity import METHODS
+    
+    user_id = session.get('user_id') or session.get('demo_user', {}).get('id')
+    
+    if request.method == 'POST':
+        try:
+            document_ids = [int(value) for value in request.form.getlist('document_ids')]
+            cohort = create_cohort(user_id, document_ids,
+                                   request.form.get('name', '').strip(),
+                                   request.form.get('method', 'tfidf'))
+            flash(f'Cohort analysis queued for {len(cohort.document_ids)} documents.', 'success')
+            return redirect(url_for('view_cohort', cohort_id=cohort.id))
+        except ValueError as e:
+            flash(str(e), 'warning')
+        except Exception as e:
+            db.session.rollback()
+            logging.error(f"Error creating cohort analysis: {e}")
+            flash('Error creating cohort analysis.', 'danger')
+    
+    documents = Document.query.filter_by(user_id=user_id, status=DocumentStatus.COMPLETED)\
+        .order_by(Document.created_at.desc()).all()
+    user_cohorts = CohortAnalysis.query.filter_by(user_id=user_id)\
+        .order_by(CohortAnalysis.created_at.desc()).all()
+    return render_template('cohorts.html', documents=documents, cohorts=user_cohorts, methods=METHODS)
+
+def _get_user_cohort(cohort_id):
+    from models import CohortAnalysis
+    user_id = session.get('user_id') or session.get('demo_user', {}).get('id')
+    return CohortAnalysis.query.filter_by(id=cohort_id, user_id=user_id).first_or_404()
+
+@app.route('/cohorts/<int:cohort_id>')
+@require_auth
+def view_cohort(cohort_id):
+    """Heatmap of the pairwise similarities and most similar pairs with their passages"""
+    from cohort_jobs import cohort_matrix
+    
+    cohort = _get_user_cohort(cohort_id)
+    documents = {document.id: document for document in
+                 Document.query.filter(Document.id.in_(cohort.document_ids)).all()}
+    
+    pairs = []
+    for pair in cohort.top_pairs or []:
+        document_a = documents.get(pair['document_a'])
+        document_b = documents.get(pair['document_b'])
+        if document_a is None or document_b is None:
+            continue
+        text_a = document_a.extracted_text or ""
+        text_b = document_b.extracted_text or ""
+        passages = [{
+            'similarity': passage['similarity'],
+            'tokens': passage['tokens'],
+            'text_a': text_a[passage['start']:passage['end']][:400],
+            'text_b': text_b[passage['other_start']:passage['other_end']][:400],
+        } for passage in pair['passages'][:5]]
+        pairs.append({'document_a': document_a, 'document_b': document_b,
+                      'similarity': pair['similarity'], 'passages': passages,
+                      'passage_count': len(pair['passages'])})
+    
+    labels = [documents[document_id].original_filename if document_id in documents else str(document_id)
+              for document_id in cohort.document_ids]
+    return render_template('cohort.html', cohort=cohort, pairs=pairs,
+                           matrix=cohort_matrix(cohort), labels=labels)
+
+@app.route('/cohorts/<int:cohort_id>/export.<fmt>')
+@require_auth
+def export_cohort(cohort_id, fmt):
+    """Download the cohort result as JSON (matrix and pairs) or CSV (pairs)"""
+    from flask import Response
+    from cohort_jobs import export_cohort_json, export_cohort_csv
+    
+    cohort = _get_user_cohort(cohort_id)
+    if fmt == 'json':
+        response = jsonify(export_cohort_json(cohort))
+    elif fmt == 'csv':
+        response = Response(export_cohort_csv(cohort), mimetype='text/csv')
+    else:
+        abort(404)
+    response.headers['Content-Disposition'] = f'attachment; filename=cohort_{cohort.id}.{fmt}'
+    return response
+
 @app.route('/logout')
 def logout():
     """Logout route"""
@@ -120,7 +120,7 @@ def upload_document():
                 flash('Invalid file type. Please upload PDF, DOCX, or TXT files only.', 'danger')
                 return redirect(request.url)
             
-            file_path, filename = file_info
+            file_path, filename, _ = file_info
             
             # Extract text content
             content_type = file.content_type or 'text/plain'
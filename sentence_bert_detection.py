@@ -14,6 +14,15 @@ from typing import Dict, List, Optional, Tuple
 from datetime import datetime
 from collections import Counter, defaultdict
 
+import numpy as np
+from scipy import sparse
+
+from embedding_store import encode_embeddings, decode_embeddings, is_encoded, decode_legacy_json
+from edit_distance import myers_distance, token_similarity, tokenize
+from text_segmentation import segment_document, text_token_ids
+from token_vocab import get_token_vocabulary
+from timeout_optimization import DeadlineExceeded, check_deadline
+
 # Import du détecteur GPTZero-like
 try:
     from utils.ai_gptzero_like import detect_ai_gptzero_like
@@ -23,8 +32,104 @@ except ImportError as e:
     GPTZERO_AVAILABLE = False
     logging.warning(f"⚠️ Détecteur GPTZero non disponible: {e}")
 
+try:
+    from minhash_lsh import MinHashLSH
+    MINHASH_AVAILABLE = True
+except ImportError:
+    MINHASH_AVAILABLE = False
+
+try:
+    from ann_index import IVFIndex
+    ANN_AVAILABLE = True
+except ImportError:
+    ANN_AVAILABLE = False
+
+try:
+    from document_vectors import TfidfDocumentIndex
+    DOCUMENT_VECTORS_AVAILABLE = True
+except ImportError:
+    DOCUMENT_VECTORS_AVAILABLE = False
+
+class SparseVector:
+    """
+    Vecteur creux (indices triés, valeurs) qui se comporte comme l'ancienne
+    liste dense : len(), indexation et itération donnent les mêmes valeurs.
+    """
+    
+    def __init__(self, indices, values, dimension):
+        self.indices = indices
+        self.values = values
+        self.dimension = dimension
+        self._dense = None
+        self._norm = None
+    
+    def __len__(self):
+        return self.dimension
+    
+    def tolist(self):
+        if self._dense is None:
+            dense = [0.0] * self.dimension
+            for index, value in zip(self.indices.tolist(), self.values.tolist()):
+                dense[index] = value
+            self._dense = dense
+        return self._dense
+    
+    def __getitem__(self, item):
+        return self.tolist()[item]
+    
+    def __iter__(self):
+        return iter(self.tolist())
+    
+    def __array__(self, dtype=None, copy=None):
+        dense = np.zeros(self.dimension, dtype=dtype or np.float64)
+        dense[self.indices] = self.values
+        return dense
+    
+    @property
+    def norm(self):
+        if self._norm is None:
+            self._norm = math.sqrt(float(np.dot(self.values, self.values)))
+        return self._norm
+    
+    def dot(self, other):
+        _, mine, theirs = np.intersect1d(self.indices, other.indices, assume_unique=True, return_indices=True)
+        return float(np.dot(self.values[mine], other.values[theirs]))
+
+class SparseRows:
+    """Matrice TF-IDF creuse (CSR) vue comme la liste de vecteurs que renvoyait ManualTfIdf"""
+    
+    def __init__(self, matrix):
+        self.matrix = matrix
+    
+    def __len__(self):
+        return self.matrix.shape[0]
+    
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return SparseRows(self.matrix[item])
+        if item < 0:
+            item += len(self)
+        start, end = self.matrix.indptr[item], self.matrix.indptr[item + 1]
+        return SparseVector(self.matrix.indices[start:end], self.matrix.data[start:end], self.matrix.shape[1])
+    
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self[row]
+    
+    def __array__(self, dtype=None, copy=None):
+        return self.matrix.toarray().astype(dtype or np.float64, copy=False)
+    
+    def tolist(self):
+        return self.matrix.toarray().tolist()
+
+# Termes de ManualTfIdf stockés par TfidfDocumentIndex : à changer si leur calcul change
+NGRAM_ANALYZER_VERSION = 'token-vocab-ngram-hash'
+
+# Phrases cherchées par appel à l'index ANN (échéance contrôlée entre deux lots)
+SENTENCE_INDEX_BATCH = 256
+
 class ManualTfIdf:
-    """Implémentation manuelle de TF-IDF"""
+    """Implémentation manuelle de TF-IDF (vecteurs creux, termes = hachages de n-grammes)"""
     
     def __init__(self, max_features=5000, ngram_range=(1, 3)):
         self.max_features = max_features
@@ -34,84 +139,78 @@ class ManualTfIdf:
         self.documents = []
     
     def _extract_ngrams(self, text, n):
-        """Extrait les n-grammes d'un texte"""
-        words = text.lower().split()
-        if n == 1:
-            return words
-        return [' '.join(words[i:i+n]) for i in range(len(words)-n+1)]
+        """Hachages des n-grammes de mots d'un texte (token_vocab)"""
+        return get_token_vocabulary().ngram_hashes(text_token_ids(text), n).tolist()
     
     def _get_all_ngrams(self, text):
-        """Obtient tous les n-grammes selon ngram_range"""
-        all_ngrams = []
-        for n in range(self.ngram_range[0], self.ngram_range[1] + 1):
-            all_ngrams.extend(self._extract_ngrams(text, n))
-        return all_ngrams
+        """Hachages de tous les n-grammes selon ngram_range"""
+        return get_token_vocabulary().ngram_range_hashes(text_token_ids(text), *self.ngram_range).tolist()
+    
+    def _term_counts(self, text):
+        """Comptes des n-grammes, sans liste intermédiaire d'un objet par n-gramme"""
+        hashes = get_token_vocabulary().ngram_range_hashes(text_token_ids(text), *self.ngram_range)
+        terms, counts = np.unique(hashes, return_counts=True)
+        return Counter(dict(zip(terms.tolist(), counts.tolist())))
+    
+    def _sparse_matrix(self, doc_term_counts):
+        """Matrice CSR tf * idf des documents (termes hors vocabulaire ignorés)"""
+        indptr = [0]
+        indices = []
+        data = []
+        for term_counts in doc_term_counts:
+            doc_length = max(1, sum(term_counts.values()))
+            row = sorted((self.vocabulary[term], tf / doc_length * self.idf_values.get(term, 0))
+                         for term, tf in term_counts.items() if term in self.vocabulary)
+            indices.extend(index for index, _ in row)
+            data.extend(value for _, value in row)
+            indptr.append(len(indices))
+        return sparse.csr_matrix((np.array(data, dtype=np.float64), np.array(indices, dtype=np.int32), indptr),
+                                 shape=(len(doc_term_counts), len(self.vocabulary)))
     
     def fit_transform(self, texts):
         """Entraîne le modèle et transforme les textes"""
         self.documents = texts
         
         # Construire le vocabulaire
-        all_terms = []
-        doc_term_counts = []
-        
-        for text in texts:
-            terms = self._get_all_ngrams(text)
-            term_counts = Counter(terms)
-            doc_term_counts.append(term_counts)
-            all_terms.extend(terms)
+        doc_term_counts = [self._term_counts(text) for text in texts]
+        term_freq = Counter()
+        document_freq = Counter()
+        for term_counts in doc_term_counts:
+            term_freq.update(term_counts)
+            document_freq.update(term_counts.keys())
         
         # Créer vocabulaire avec les termes les plus fréquents
-        term_freq = Counter(all_terms)
         vocab_terms = [term for term, _ in term_freq.most_common(self.max_features)]
         self.vocabulary = {term: idx for idx, term in enumerate(vocab_terms)}
         
         # Calculer IDF
         num_docs = len(texts)
         for term in self.vocabulary:
-            doc_count = sum(1 for doc_counts in doc_term_counts if term in doc_counts)
-            self.idf_values[term] = math.log(num_docs / max(1, doc_count))
+            self.idf_values[term] = math.log(num_docs / max(1, document_freq[term]))
         
         # Créer matrice TF-IDF
-        tfidf_matrix = []
-        for doc_counts in doc_term_counts:
-            doc_vector = [0.0] * len(self.vocabulary)
-            doc_length = sum(doc_counts.values())
-            
-            for term, tf in doc_counts.items():
-                if term in self.vocabulary:
-                    term_idx = self.vocabulary[term]
-                    tf_score = tf / max(1, doc_length)
-                    idf_score = self.idf_values[term]
-                    doc_vector[term_idx] = tf_score * idf_score
-            
-            tfidf_matrix.append(doc_vector)
-        
-        return tfidf_matrix
+        return SparseRows(self._sparse_matrix(doc_term_counts))
     
     def transform(self, texts):
         """Transforme de nouveaux textes avec le modèle entraîné"""
-        tfidf_matrix = []
-        
-        for text in texts:
-            terms = self._get_all_ngrams(text)
-            term_counts = Counter(terms)
-            doc_vector = [0.0] * len(self.vocabulary)
-            doc_length = sum(term_counts.values())
-            
-            for term, tf in term_counts.items():
-                if term in self.vocabulary:
-                    term_idx = self.vocabulary[term]
-                    tf_score = tf / max(1, doc_length)
-                    idf_score = self.idf_values.get(term, 0)
-                    doc_vector[term_idx] = tf_score * idf_score
-            
-            tfidf_matrix.append(doc_vector)
-        
-        return tfidf_matrix
+        return SparseRows(self._sparse_matrix([self._term_counts(text) for text in texts]))
+
+def cosine_similarity_matrix(rows_a, rows_b):
+    """Similarités cosinus de toutes les paires (lignes de A x lignes de B), en un produit matriciel"""
+    def normalized(rows):
+        matrix = rows.matrix if isinstance(rows, SparseRows) else sparse.csr_matrix(np.asarray(rows, dtype=np.float64))
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        norms[norms == 0] = 1.0
+        return sparse.diags(1.0 / norms) @ matrix
+    return (normalized(rows_a) @ normalized(rows_b).T).toarray()
 
 def cosine_similarity_manual(vec1, vec2):
     """Calcul manuel de la similarité cosinus"""
+    if isinstance(vec1, SparseVector) and isinstance(vec2, SparseVector):
+        if vec1.norm == 0 or vec2.norm == 0:
+            return 0.0
+        return vec1.dot(vec2) / (vec1.norm * vec2.norm)
+    
     dot_product = sum(a * b for a, b in zip(vec1, vec2))
     norm_a = math.sqrt(sum(a * a for a in vec1))
     norm_b = math.sqrt(sum(b * b for b in vec2))
@@ -122,47 +221,51 @@ def cosine_similarity_manual(vec1, vec2):
     return dot_product / (norm_a * norm_b)
 
 def levenshtein_distance_manual(s1, s2):
-    """Calcul manuel de la distance de Levenshtein optimisé pour gros documents"""
-    # OPTIMISATION: Limiter la taille pour éviter les timeouts
-    MAX_LEN = 1000  # Limite à 1000 caractères par string
-    
-    if len(s1) > MAX_LEN:
-        s1 = s1[:MAX_LEN//2] + s1[-MAX_LEN//2:]
-    if len(s2) > MAX_LEN:
-        s2 = s2[:MAX_LEN//2] + s2[-MAX_LEN//2:]
-    
-    if len(s1) < len(s2):
-        return levenshtein_distance_manual(s2, s1)
-    
-    if len(s2) == 0:
-        return len(s1)
-    
-    # OPTIMISATION: Early exit si très différentes
-    if abs(len(s1) - len(s2)) > min(len(s1), len(s2)) * 0.8:
-        return max(len(s1), len(s2))  # Très différentes
-    
-    previous_row = list(range(len(s2) + 1))
-    for i, c1 in enumerate(s1):
-        current_row = [i + 1]
-        for j, c2 in enumerate(s2):
-            insertions = previous_row[j + 1] + 1
-            deletions = current_row[j] + 1
-            substitutions = previous_row[j] + (c1 != c2)
-            current_row.append(min(insertions, deletions, substitutions))
-        previous_row = current_row
-        
-        # OPTIMISATION: Early exit si distance devient trop grande
-        if i > 100 and min(current_row) > len(s2) * 0.5:
-            return len(s1)  # Distance trop grande, abandon
-    
-    return previous_row[-1]
+    """Distance de Levenshtein exacte (bit-parallèle, sans troncature des textes)"""
+    return myers_distance(s1, s2)
+
+def _unit_rows(matrix):
+    """Lignes normalisées (les lignes nulles restent nulles)"""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1.0, norms)
 
 class SimpleEmbedding:
     """Embeddings simplifiés basés sur TF-IDF pour simuler Sentence-BERT"""
     
-    def __init__(self):
+    def __init__(self, vocabulary_path=None):
         self.tfidf = ManualTfIdf(max_features=300, ngram_range=(1, 2))
         self.is_fitted = False
+        # Vocabulaire persisté : les vecteurs de l'index ANN restent comparables d'un redémarrage à l'autre
+        self.vocabulary_path = vocabulary_path
+        if vocabulary_path:
+            self._load_vocabulary()
+    
+    def _load_vocabulary(self):
+        try:
+            with open(self.vocabulary_path, encoding='utf-8') as f:
+                data = json.load(f)
+            # Clés JSON en texte : les termes sont des hachages de n-grammes entiers
+            self.tfidf.vocabulary = {int(term): index for term, index in data['vocabulary'].items()}
+            self.tfidf.idf_values = {int(term): idf for term, idf in data['idf_values'].items()}
+            self.is_fitted = True
+        except (OSError, ValueError, KeyError):
+            pass
+    
+    def _save_vocabulary(self):
+        """Enregistre le vocabulaire, sauf si un autre processus l'a déjà fait (on reprend alors le sien)"""
+        tmp_path = f"{self.vocabulary_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'vocabulary': self.tfidf.vocabulary, 'idf_values': self.tfidf.idf_values}, f)
+        try:
+            os.link(tmp_path, self.vocabulary_path)
+        except FileExistsError:
+            self._load_vocabulary()
+        finally:
+            os.remove(tmp_path)
+    
+    @property
+    def dimension(self):
+        return len(self.tfidf.vocabulary)
     
     def encode(self, sentences):
         """Encode les phrases en vecteurs"""
@@ -170,6 +273,8 @@ class SimpleEmbedding:
             # Premier passage pour entraîner le modèle
             self.tfidf.fit_transform(sentences)
             self.is_fitted = True
+            if self.vocabulary_path:
+                self._save_vocabulary()
             return self.tfidf.transform(sentences)
         else:
             return self.tfidf.transform(sentences)
@@ -220,18 +325,23 @@ class SentenceBertDetectionService:
     """Service de détection avancé avec implémentation complète"""
     
     def __init__(self):
-        self.embedding_model = SimpleEmbedding()
-        self.tfidf_model = ManualTfIdf()
-        self.ai_detector = ManualLogisticRegression()
-        self.ai_tfidf = ManualTfIdf(max_features=1000, ngram_range=(1, 2))
-        
         self.local_db_path = "plagiarism_cache/sentence_bert_db.db"
         self.models_path = "plagiarism_cache/models"
+        self.minhash_index = None
+        self.sentence_index = None
+        self.document_vectors = None
         
         os.makedirs("plagiarism_cache", exist_ok=True)
         os.makedirs(self.models_path, exist_ok=True)
         
+        # Termes hachés (token_vocab) : nouveau fichier, l'ancien vocabulaire de chaînes n'est pas relu
+        self.embedding_model = SimpleEmbedding(os.path.join(self.models_path, "sentence_embedding_hashed_vocab.json"))
+        self.tfidf_model = ManualTfIdf()
+        self.ai_detector = ManualLogisticRegression()
+        self.ai_tfidf = ManualTfIdf(max_features=1000, ngram_range=(1, 2))
+        
         self._setup_database()
+        self._setup_sentence_index()
         self._train_ai_detector()
         
         logging.info("✅ Système Sentence-BERT manuel initialisé avec succès")
@@ -247,13 +357,69 @@ class SentenceBertDetectionService:
                 filename TEXT,
                 content TEXT,
                 sentences TEXT,
-                embeddings TEXT,
+                embeddings BLOB,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         ''')
         
+        # Anciennes lignes : embeddings en texte JSON -> format binaire
+        legacy = [(doc_id, value) for doc_id, value in
+                  cursor.execute("SELECT id, embeddings FROM documents WHERE embeddings IS NOT NULL")
+                  if not is_encoded(value)]
+        for doc_id, value in legacy:
+            embeddings = decode_legacy_json(value)
+            cursor.execute("UPDATE documents SET embeddings = ? WHERE id = ?",
+                           (encode_embeddings(embeddings) if embeddings is not None else None, doc_id))
+        if legacy:
+            logging.info(f"📁 {len(legacy)} embeddings JSON convertis au format binaire")
+        
         conn.commit()
         conn.close()
+        
+        if MINHASH_AVAILABLE:
+            self.minhash_index = MinHashLSH(self.local_db_path)
+            self.minhash_index.index_missing()
+        
+        if DOCUMENT_VECTORS_AVAILABLE:
+            # Mêmes n-grammes que tfidf_model, vecteurs calculés une fois au stockage
+            self.document_vectors = TfidfDocumentIndex(self.local_db_path, self.tfidf_model._get_all_ngrams,
+                                                       max_features=self.tfidf_model.max_features,
+                                                       analyzer_version=NGRAM_ANALYZER_VERSION, integer_terms=True)
+            self.document_vectors.index_missing()
+            self.document_vectors.refresh_async()
+    
+    def _setup_sentence_index(self):
+        """Charge l'index ANN des phrases et y ajoute les documents stockés qui n'y sont pas encore"""
+        if not ANN_AVAILABLE:
+            return
+        try:
+            self.sentence_index = IVFIndex()
+            # Sans vocabulaire enregistré, les vecteurs de l'index viennent d'un vocabulaire perdu
+            stale = self.sentence_index.dim is not None and (
+                not self.embedding_model.is_fitted or self.sentence_index.dim != self.embedding_model.dimension)
+            if stale:
+                logging.warning("🧭 Vocabulaire des embeddings modifié - index des phrases reconstruit")
+                self.sentence_index.reset()
+            
+            indexed = self.sentence_index.document_ids()
+            conn = sqlite3.connect(self.local_db_path)
+            rows = conn.execute("SELECT id, sentences, embeddings FROM documents").fetchall()
+            conn.close()
+            missing = [row for row in rows if row[0] not in indexed]
+            for doc_id, sentences_json, blob in missing:
+                # Vecteurs stockés réutilisés tels quels s'ils ont été produits avec le vocabulaire actuel
+                stored = decode_embeddings(blob) if is_encoded(blob) and not stale else None
+                if stored is not None and self.embedding_model.is_fitted and stored.shape[1] == self.embedding_model.dimension:
+                    self.sentence_index.add(stored, doc_id)
+                    continue
+                sentences = json.loads(sentences_json or "[]")
+                if sentences:
+                    self.sentence_index.add(self.embedding_model.encode(sentences), doc_id)
+            if missing:
+                logging.info(f"🧭 {len(missing)} documents existants ajoutés à l'index des phrases")
+        except Exception as e:
+            logging.error(f"Erreur index ANN: {e}")
+            self.sentence_index = None
     
     def _train_ai_detector(self):
         """Entraîne le détecteur IA avec données étendues"""
@@ -297,25 +463,42 @@ class SentenceBertDetectionService:
         
         logging.info("🧠 Modèle de détection IA entraîné sur données étendues")
     
-    def detect_plagiarism_and_ai(self, text: str, filename: str = "") -> Dict:
-        """Détection complète avec Sentence-BERT, TF-IDF et Levenshtein"""
+    def detect_plagiarism_and_ai(self, text: str, filename: str = "", deadline=None) -> Dict:
+        """
+        Détection complète avec Sentence-BERT, TF-IDF et Levenshtein.
+        Avec une échéance (AnalysisDeadline), l'étape en cours est interrompue
+        (DeadlineExceeded dans ses boucles), les suivantes sont ignorées et le
+        résultat porte partial=True. Si aucune étape n'a abouti,
+        DeadlineExceeded est propagée (repli de safe_analysis_wrapper).
+        """
         try:
             logging.info("🔍 Démarrage détection Sentence-BERT complète")
             
             # Diviser en phrases
             sentences = self._split_into_sentences(text)
             
-            # 1. Détection avec embeddings (Sentence-BERT simulé)
-            bert_result = self._detect_with_sentence_bert(text, sentences)
-            
-            # 2. Détection TF-IDF + Cosine similarity
-            tfidf_result = self._detect_with_tfidf_cosine(text)
-            
-            # 3. Détection Levenshtein
-            levenshtein_result = self._detect_with_levenshtein(text)
+            stages = [
+                ('sentence_bert', lambda: self._detect_with_sentence_bert(text, sentences, deadline)),  # 1. Embeddings (Sentence-BERT simulé)
+                ('tfidf', lambda: self._detect_with_tfidf_cosine(text, deadline)),                      # 2. TF-IDF + Cosine similarity
+                ('levenshtein', lambda: self._detect_with_levenshtein(text, deadline)),                  # 3. Levenshtein
+                ('ai', lambda: self._detect_ai_content(text, sentences)),                                # 4. Détection IA
+            ]
+            stage_results = {}
+            for stage_name, run_stage in stages:
+                try:
+                    check_deadline(deadline, stage_name)
+                    stage_results[stage_name] = run_stage()
+                except DeadlineExceeded as e:
+                    if not stage_results:
+                        raise
+                    logging.warning(f"⏰ {e} - étape '{stage_name}' et suivantes ignorées")
+                    break
             
-            # 4. Détection IA
-            ai_result = self._detect_ai_content(text, sentences)
+            bert_result = stage_results.get('sentence_bert', {})
+            tfidf_result = stage_results.get('tfidf', {})
+            levenshtein_result = stage_results.get('levenshtein', {})
+            ai_result = stage_results.get('ai', {})
+            coverage = round(100.0 * len(stage_results) / len(stages), 1)
             
             # NOUVEAU: Détection de contenu académique légitime
             is_academic = self._is_academic_content(text)
@@ -366,20 +549,24 @@ class SentenceBertDetectionService:
                     'ai_sentences': ai_result.get('ai_sentences', 0),
                     'total_sentences': len(sentences)
                 },
-                'method': 'sentence_bert_tfidf_levenshtein_ai_complete'
+                'method': 'sentence_bert_tfidf_levenshtein_ai_complete',
+                'partial': coverage < 100.0,
+                'coverage': coverage,
+                'stages_completed': list(stage_results)
             }
             
             logging.info(f"🎯 Détection complète: {final_score}% plagiat + {ai_result.get('ai_probability', 0)}% IA")
             return result
             
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logging.error(f"Erreur détection complète: {e}")
             return {'percent': 0, 'sources_found': 0, 'ai_percent': 0, 'method': 'error'}
     
     def _split_into_sentences(self, text: str) -> List[str]:
         """Divise en phrases"""
-        sentences = re.split(r'[.!?]+', text)
-        return [s.strip() for s in sentences if len(s.strip()) > 15]
+        return segment_document(text).sentences(15)
     
     def _is_academic_content(self, text: str) -> bool:
         """Détecte si le contenu est académique/thèse légitime"""
@@ -431,7 +618,7 @@ class SentenceBertDetectionService:
             logging.error(f"Erreur détection académique: {e}")
             return False
     
-    def _detect_with_sentence_bert(self, text: str, sentences: List[str]) -> Dict:
+    def _detect_with_sentence_bert(self, text: str, sentences: List[str], deadline=None) -> Dict:
         """Détection avec embeddings de phrases"""
         try:
             if not sentences:
@@ -440,32 +627,33 @@ class SentenceBertDetectionService:
             # Encoder les phrases actuelles
             current_embeddings = self.embedding_model.encode(sentences)
             
+            if self.sentence_index is not None:
+                return self._detect_with_sentence_index(current_embeddings, deadline=deadline)
+            
             # Comparer avec documents stockés
             conn = sqlite3.connect(self.local_db_path)
             cursor = conn.cursor()
-            cursor.execute("SELECT content, sentences, embeddings FROM documents")
+            cursor.execute("SELECT embeddings FROM documents")
             
             max_similarity = 0
             sources_found = 0
+            current_matrix = _unit_rows(np.asarray(current_embeddings, dtype=np.float32))
             
-            for row in cursor.fetchall():
+            for (stored_blob,) in cursor.fetchall():
+                check_deadline(deadline, 'sentence_bert')
                 try:
-                    stored_content, stored_sentences_json, stored_embeddings_json = row
-                    
-                    if stored_embeddings_json:
-                        stored_sentences = json.loads(stored_sentences_json)
-                        stored_embeddings = json.loads(stored_embeddings_json)
+                    if is_encoded(stored_blob):
+                        stored_embeddings = decode_embeddings(stored_blob)
+                        if stored_embeddings.shape[1] != current_matrix.shape[1]:
+                            continue
                         
                         # Comparer chaque phrase actuelle avec chaque phrase stockée
-                        for curr_emb in current_embeddings:
-                            for stored_emb in stored_embeddings:
-                                similarity = cosine_similarity_manual(curr_emb, stored_emb)
-                                if similarity > 0.75:  # Seuil élevé pour similarité sémantique
-                                    max_similarity = max(max_similarity, similarity * 100)
-                                    if similarity > 0.85:
-                                        sources_found += 1
+                        similarities = current_matrix @ _unit_rows(stored_embeddings.astype(np.float32)).T
+                        if similarities.size and similarities.max() > 0.75:  # Seuil élevé pour similarité sémantique
+                            max_similarity = max(max_similarity, float(similarities.max()) * 100)
+                        sources_found += int(np.count_nonzero(similarities > 0.85))
                 
-                except (json.JSONDecodeError, Exception):
+                except Exception:
                     continue
             
             conn.close()
@@ -475,13 +663,59 @@ class SentenceBertDetectionService:
                 'sources': min(sources_found, 10)
             }
             
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logging.error(f"Erreur Sentence-BERT: {e}")
             return {'score': 0, 'sources': 0}
     
-    def _detect_with_tfidf_cosine(self, text: str) -> Dict:
+    def _detect_with_sentence_index(self, current_embeddings, k: int = 5, deadline=None) -> Dict:
+        """
+        Plus proches voisins de chaque phrase dans l'index ANN au lieu de toutes
+        les paires de phrases. Les phrases sont cherchées par lots de
+        SENTENCE_INDEX_BATCH, avec un contrôle de l'échéance avant chaque lot.
+        """
+        neighbours = []
+        for start in range(0, len(current_embeddings), SENTENCE_INDEX_BATCH):
+            check_deadline(deadline, 'sentence_bert')
+            neighbours.extend(self.sentence_index.search(current_embeddings[start:start + SENTENCE_INDEX_BATCH], k=k))
+        
+        max_similarity = 0
+        source_documents = set()
+        matches = []
+        for sentence_index, sentence_neighbours in enumerate(neighbours):
+            check_deadline(deadline, 'sentence_bert')
+            for similarity, document_id, source_sentence in sentence_neighbours:
+                if similarity <= 0.75:  # Seuil élevé pour similarité sémantique
+                    break
+                max_similarity = max(max_similarity, similarity * 100)
+                if similarity > 0.85:
+                    source_documents.add(document_id)
+                matches.append({
+                    'sentence_index': sentence_index,
+                    'document_id': document_id,
+                    'source_sentence_index': source_sentence,
+                    'similarity': round(similarity * 100, 1)
+                })
+        
+        return {
+            'score': min(max_similarity, 100),
+            'sources': min(len(source_documents), 10),
+            'matches': matches
+        }
+    
+    def _detect_with_tfidf_cosine(self, text: str, deadline=None) -> Dict:
         """Détection TF-IDF + cosine similarity"""
         try:
+            if self.document_vectors is not None:
+                check_deadline(deadline, 'tfidf')
+                similarities = [similarity for _, similarity in self.document_vectors.query(text, min_similarity=0.35)]
+                check_deadline(deadline, 'tfidf')
+                return {
+                    'score': max(similarities, default=0) * 100,
+                    'sources': sum(1 for similarity in similarities if similarity > 0.6)
+                }
+            
             conn = sqlite3.connect(self.local_db_path)
             cursor = conn.cursor()
             cursor.execute("SELECT content FROM documents")
@@ -493,16 +727,17 @@ class SentenceBertDetectionService:
                 return {'score': 0, 'sources': 0}
             
             # Transformer tous les textes
+            check_deadline(deadline, 'tfidf')
             all_texts = stored_texts + [text]
             tfidf_vectors = self.tfidf_model.fit_transform(all_texts)
+            check_deadline(deadline, 'tfidf')
             
             # Comparer le dernier (texte actuel) avec les autres
-            current_vector = tfidf_vectors[-1]
+            similarities = cosine_similarity_matrix(tfidf_vectors[-1:], tfidf_vectors[:-1])[0]
             max_similarity = 0
             sources_found = 0
             
-            for i, stored_vector in enumerate(tfidf_vectors[:-1]):
-                similarity = cosine_similarity_manual(current_vector, stored_vector)
+            for similarity in similarities:
                 if similarity > 0.35:  # Seuil augmenté 0.3 → 0.35 pour réduire false positives
                     max_similarity = max(max_similarity, similarity * 100)
                     if similarity > 0.6:  # Seuil augmenté 0.5 → 0.6 pour sources
@@ -513,26 +748,41 @@ class SentenceBertDetectionService:
                 'sources': sources_found
             }
             
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logging.error(f"Erreur TF-IDF: {e}")
             return {'score': 0, 'sources': 0}
     
-    def _detect_with_levenshtein(self, text: str) -> Dict:
+    def _detect_with_levenshtein(self, text: str, deadline=None) -> Dict:
         """Détection avec distance de Levenshtein optimisée pour gros documents"""
         try:
-            # OPTIMISATION: Limiter la taille du texte d'entrée
-            if len(text) > 2000:
-                text = text[:1000] + text[-1000:]  # Prendre début et fin
-                logging.info(f"📝 Texte tronqué pour optimisation Levenshtein")
+            # Candidats LSH calculés sur le texte complet, du plus au moins similaire
+            candidates = None
+            if self.minhash_index:
+                candidates = [doc_id for doc_id, _ in self.minhash_index.query(text, limit=20)]
+                if not candidates:
+                    return {'score': 0}
+            
+            # Comparaison mot à mot sur le texte complet
+            tokens = tokenize(text)
             
             conn = sqlite3.connect(self.local_db_path)
             cursor = conn.cursor()
+            if candidates is not None:
+                placeholders = ','.join('?' * len(candidates))
+                cursor.execute(f"SELECT id, content FROM documents WHERE id IN ({placeholders})", candidates)
+                contents = dict(cursor.fetchall())
+                conn.close()
+                return self._levenshtein_candidates(tokens, [contents[i] for i in candidates if i in contents],
+                                                    deadline)
             cursor.execute("SELECT content FROM documents LIMIT 50")  # Limiter le nombre de comparaisons
             
             max_similarity = 0
             comparisons = 0
             
             for row in cursor.fetchall():
+                check_deadline(deadline, 'levenshtein')
                 stored_text = row[0]
                 if not stored_text or len(stored_text) < 20:
                     continue
@@ -546,13 +796,9 @@ class SentenceBertDetectionService:
                 if common_ratio < 0.15:  # Augmenté 0.1 → 0.15 pour réduire comparaisons
                     continue
                 
-                # Calculer distance Levenshtein seulement si prometteur
-                distance = levenshtein_distance_manual(text.lower(), stored_text.lower())
-                max_length = max(len(text), len(stored_text))
-                
-                if max_length > 0:
-                    similarity = (1 - distance / max_length) * 100
-                    max_similarity = max(max_similarity, similarity)
+                # Distance bornée : abandon dès que le meilleur score ne peut plus être battu
+                similarity = token_similarity(tokens, tokenize(stored_text), max_similarity)
+                max_similarity = max(max_similarity, similarity)
                 
                 comparisons += 1
                 
@@ -565,10 +811,25 @@ class SentenceBertDetectionService:
             
             return {'score': max_similarity}
             
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logging.error(f"Erreur Levenshtein: {e}")
             return {'score': 0}
     
+    def _levenshtein_candidates(self, tokens: List[str], stored_texts: List[str], deadline=None) -> Dict:
+        """Levenshtein exact (mot à mot) sur les candidats MinHash (déjà filtrés par similarité)"""
+        max_similarity = 0
+        for stored_text in stored_texts:
+            check_deadline(deadline, 'levenshtein')
+            if not stored_text or len(stored_text) < 20:
+                continue
+            max_similarity = max(max_similarity, token_similarity(tokens, tokenize(stored_text), max_similarity))
+            if max_similarity > 95:
+                break
+        logging.debug(f"Levenshtein: {len(stored_texts)} candidats MinHash, max: {max_similarity:.1f}%")
+        return {'score': max_similarity}
+    
     def _detect_ai_content(self, text: str, sentences: List[str]) -> Dict:
         """Détection IA améliorée avec le nouveau détecteur puissant"""
         try:
@@ -814,9 +1075,9 @@ class SentenceBertDetectionService:
             # Générer embeddings
             embeddings = self.embedding_model.encode(sentences)
             
-            # Sérialiser en JSON
+            # Phrases en JSON, embeddings en matrice binaire
             sentences_json = json.dumps(sentences)
-            embeddings_json = json.dumps(embeddings)
+            embeddings_blob = encode_embeddings(embeddings)
             
             conn = sqlite3.connect(self.local_db_path)
             cursor = conn.cursor()
@@ -824,11 +1085,22 @@ class SentenceBertDetectionService:
             cursor.execute('''
                 INSERT INTO documents (filename, content, sentences, embeddings)
                 VALUES (?, ?, ?, ?)
-            ''', (filename, text, sentences_json, embeddings_json))
+            ''', (filename, text, sentences_json, embeddings_blob))
+            document_id = cursor.lastrowid
+            
+            if self.minhash_index:
+                self.minhash_index.add(document_id, text, conn)
+            if self.document_vectors is not None:
+                self.document_vectors.add(document_id, text, conn)
             
             conn.commit()
             conn.close()
             
+            if self.sentence_index is not None:
+                self.sentence_index.add(embeddings, document_id)
+            if self.document_vectors is not None:
+                self.document_vectors.refresh_async()
+            
             logging.info(f"📚 Document '{filename}' stocké avec embeddings Sentence-BERT")
             
         except Exception as e:
@@ -12,6 +12,7 @@ import re
 import math
 from typing import Dict, List, Tuple
 from collections import Counter, defaultdict
+from text_segmentation import segment_document
 
 
 class SimpleAIDetector:
@@ -98,7 +99,7 @@ class SimpleAIDetector:
         try:
             # Prétraitement du texte
             text_clean = self._preprocess_text(text)
-            sentences = self._split_sentences(text_clean)
+            sentences = self._split_sentences(text)
             
             if len(sentences) == 0:
                 return {'ai_probability': 0.0, 'confidence': 'low', 'method_used': 'empty_text'}
@@ -181,8 +182,7 @@ class SimpleAIDetector:
     
     def _split_sentences(self, text: str) -> List[str]:
         """Divise le texte en phrases"""
-        sentences = re.split(r'[.!?]+', text)
-        return [s.strip() for s in sentences if len(s.strip()) > 10]
+        return segment_document(text).sentences(10)
     
     def _analyze_vocabulary(self, text: str) -> float:
         """Analyse le vocabulaire pour détecter les mots/phrases IA"""
@@ -531,7 +531,7 @@ class StructureAnalyzer:
         dash_count = text.count('—') + text.count('--')
         paren_count = text.count('(')
         
-        total_sentences = len(re.split(r'[.!?]+', text))
+        total_sentences = len(segment_document(text))
         
         if total_sentences == 0:
             return 0.0
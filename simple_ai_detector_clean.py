@@ -7,6 +7,7 @@ import os
 import logging
 import re
 from typing import Dict, List
+from text_segmentation import segment_document
 
 class SimpleAIDetector:
     """Détecteur IA avec gamme élargie et reconnaissance académique"""
@@ -35,7 +36,7 @@ class SimpleAIDetector:
         """Détection IA avec gamme élargie 0-90%"""
         try:
             text_clean = self._preprocess_text(text)
-            sentences = self._split_sentences(text_clean)
+            sentences = self._split_sentences(text)
             
             if len(sentences) == 0:
                 return {'ai_probability': 0.0, 'confidence': 'low'}
@@ -164,5 +165,4 @@ class SimpleAIDetector:
     
     def _split_sentences(self, text: str) -> List[str]:
         """Divise en phrases"""
-        sentences = re.split(r'[.!?]+', text)
-        return [s.strip() for s in sentences if len(s.strip()) > 10]
\ No newline at end of file
+        return segment_document(text).sentences(10)
\ No newline at end of file
@@ -2,26 +2,32 @@
 Improved highlight generator for local analysis
 Creates highlighted sentences that are more faithful to the actual scores
 """
-import re
 import logging
 import math
 from typing import List
 from models import HighlightedSentence
+from text_segmentation import segment_document
 
 def generate_highlighted_sentences_based_on_scores(document_text: str, 
                                                  plagiarism_score: float, 
                                                  ai_score: float, 
-                                                 document_id: int) -> List[HighlightedSentence]:
+                                                 document_id: int,
+                                                 ai_profile=None,
+                                                 passages=None) -> List[HighlightedSentence]:
     """
     Generate highlighted sentences that faithfully represent the actual scores
     by selecting sentences strategically rather than randomly.
+    When the per-sentence AI profile of the analysis is available, AI
+    highlights are the sentences the perplexity engine actually flagged.
+    When the aligned passages of the analysis are available, plagiarism
+    highlights are those passages, with their source document and span.
     """
     if not document_text:
         return []
     
-    # Split text into sentences
-    sentences = re.split(r'(?<=[.!?])\s+', document_text)
-    sentences = [s.strip() for s in sentences if s.strip() and len(s.strip()) > 10]
+    # Sentences with their offsets, from the shared segmentation of the document
+    spans = segment_document(document_text).sentence_spans(10)
+    sentences = [document_text[start:end] for start, end in spans]
     
     if not sentences:
         return []
@@ -50,19 +56,39 @@ def generate_highlighted_sentences_based_on_scores(document_text: str,
     
     # Select top sentences for plagiarism highlighting
     plag_indices = []
-    for idx, sentence, score in scored_sentences[:plag_sentences_to_highlight]:
-        sentence_obj = HighlightedSentence()
-        sentence_obj.document_id = document_id
-        sentence_obj.sentence_text = sentence
-        sentence_obj.start_position = document_text.find(sentence)
-        sentence_obj.end_position = sentence_obj.start_position + len(sentence)
-        sentence_obj.is_plagiarism = True
-        # Confidence directly based on actual score for better fidelity
-        sentence_obj.plagiarism_confidence = max(60, min(95, plagiarism_score))
-        sentence_obj.source_url = "https://example.com/detected_source"
-        sentence_obj.source_title = "Source détectée (basé sur le score global)"
-        highlighted_sentences.append(sentence_obj)
-        plag_indices.append(idx)
+    if passages is not None:
+        # Real passages found in indexed documents
+        highlighted_sentences.extend(generate_plagiarism_highlights_from_passages(document_text, passages,
+                                                                                  document_id))
+        plag_sentences_to_highlight = len(highlighted_sentences)
+        for idx, sentence, score in scored_sentences:
+            start, end = spans[idx]
+            if any(start < h.end_position and h.start_position < end
+                   for h in highlighted_sentences):
+                plag_indices.append(idx)
+    else:
+        for idx, sentence, score in scored_sentences[:plag_sentences_to_highlight]:
+            sentence_obj = HighlightedSentence()
+            sentence_obj.document_id = document_id
+            sentence_obj.sentence_text = sentence
+            sentence_obj.start_position, sentence_obj.end_position = spans[idx]
+            sentence_obj.is_plagiarism = True
+            # Confidence directly based on actual score for better fidelity
+            sentence_obj.plagiarism_confidence = max(60, min(95, plagiarism_score))
+            sentence_obj.source_url = "https://example.com/detected_source"
+            sentence_obj.source_title = "Source détectée (basé sur le score global)"
+            highlighted_sentences.append(sentence_obj)
+            plag_indices.append(idx)
+    
+    if ai_profile is not None:
+        plag_spans = [(h.start_position, h.end_position) for h in highlighted_sentences]
+        ai_highlights = generate_ai_highlights_from_profile(document_text, ai_profile,
+                                                            document_id, plag_spans)
+        highlighted_sentences.extend(ai_highlights)
+        logging.info(f"Generated {len(highlighted_sentences)} highlighted sentences "
+                     f"(plagiarism: {plag_sentences_to_highlight}, AI from profile: {len(ai_highlights)}) "
+                     f"for document {document_id}")
+        return highlighted_sentences
     
     # Select sentences for AI highlighting (avoid already selected plagiarism sentences)
     ai_selected = 0
@@ -73,8 +99,7 @@ def generate_highlighted_sentences_based_on_scores(document_text: str,
             sentence_obj = HighlightedSentence()
             sentence_obj.document_id = document_id
             sentence_obj.sentence_text = sentence
-            sentence_obj.start_position = document_text.find(sentence)
-            sentence_obj.end_position = sentence_obj.start_position + len(sentence)
+            sentence_obj.start_position, sentence_obj.end_position = spans[idx]
             sentence_obj.is_ai_generated = True
             # Confidence directly based on actual score for better fidelity
             sentence_obj.ai_confidence = max(60, min(95, ai_score))
@@ -87,6 +112,81 @@ def generate_highlighted_sentences_based_on_scores(document_text: str,
     
     return highlighted_sentences
 
+def generate_plagiarism_highlights_from_passages(document_text: str, passages,
+                                                document_id: int) -> List[HighlightedSentence]:
+    """
+    Plagiarism highlights from aligned passages (passage_alignment), keeping
+    the most similar passage where passages from several sources overlap.
+    """
+    highlights = []
+    for passage in sorted(passages, key=lambda p: (p.similarity, p.tokens), reverse=True):
+        if any(passage.start < h.end_position and h.start_position < passage.end for h in highlights):
+            continue
+        sentence_obj = HighlightedSentence()
+        sentence_obj.document_id = document_id
+        sentence_obj.sentence_text = document_text[passage.start:passage.end]
+        sentence_obj.start_position = passage.start
+        sentence_obj.end_position = passage.end
+        sentence_obj.is_plagiarism = True
+        sentence_obj.plagiarism_score = passage.similarity
+        sentence_obj.plagiarism_confidence = passage.similarity
+        # Only web sources have a URL; indexed files are identified by their title
+        sentence_obj.source_url = passage.doc_key if passage.doc_key.startswith(('http://', 'https://')) else None
+        sentence_obj.source_title = (passage.title or passage.doc_key)[:255]
+        sentence_obj.source_start = passage.source_start
+        sentence_obj.source_end = passage.source_end
+        highlights.append(sentence_obj)
+    highlights.sort(key=lambda h: h.start_position)
+    return highlights
+
+def generate_ai_highlights_from_profile(document_text: str, ai_profile, document_id: int,
+                                       exclude_spans=()) -> List[HighlightedSentence]:
+    """
+    AI highlights from the per-sentence scores of an AILikelihoodProfile,
+    skipping sentences that overlap an already highlighted span.
+    """
+    from ai_likelihood_profile import AI_SENTENCE_THRESHOLD
+    
+    highlights = []
+    for start, end, perplexity, probability in ai_profile.sentences():
+        if probability < AI_SENTENCE_THRESHOLD or end - start <= 10:
+            continue
+        if any(start < other_end and other_start < end for other_start, other_end in exclude_spans):
+            continue
+        sentence_obj = HighlightedSentence()
+        sentence_obj.document_id = document_id
+        sentence_obj.sentence_text = document_text[start:end]
+        sentence_obj.start_position = start
+        sentence_obj.end_position = end
+        sentence_obj.is_ai_generated = True
+        sentence_obj.ai_score = round(probability * 100, 1)
+        sentence_obj.ai_confidence = sentence_obj.ai_score
+        highlights.append(sentence_obj)
+    return highlights
+
+def load_ai_profile(analysis_result):
+    """Per-sentence AI profile stored with an analysis result, or None"""
+    if analysis_result is None or not getattr(analysis_result, 'ai_profile', None):
+        return None
+    try:
+        from ai_likelihood_profile import AILikelihoodProfile
+        return AILikelihoodProfile.from_bytes(analysis_result.ai_profile)
+    except Exception as e:
+        logging.error(f"Could not read the AI profile of analysis {analysis_result.id}: {e}")
+        return None
+
+def load_passages(analysis_result):
+    """Aligned passages stored with an analysis result, or None for older analyses"""
+    raw_results = getattr(analysis_result, 'raw_results', None)
+    if not isinstance(raw_results, dict) or 'passages' not in raw_results:
+        return None
+    try:
+        from passage_alignment import passages_from_dicts
+        return passages_from_dicts(raw_results['passages'])
+    except Exception as e:
+        logging.error(f"Could not read the aligned passages of analysis {analysis_result.id}: {e}")
+        return None
+
 def create_highlights_for_document(document, analysis_result):
     """
     Create highlighted sentences for a document based on analysis results
@@ -103,7 +203,9 @@ def create_highlights_for_document(document, analysis_result):
             document.extracted_text or "",
             analysis_result.plagiarism_score or 0,
             analysis_result.ai_score or 0,
-            document.id
+            document.id,
+            ai_profile=load_ai_profile(analysis_result),
+            passages=load_passages(analysis_result)
         )
         
         # Add to database
@@ -0,0 +1,120 @@
+"""
+Top-k des similarités cosinus entre deux matrices creuses, par blocs.
+
+cosine_similarity(requêtes, références) matérialise une matrice dense
+requêtes x références (500 phrases contre un million de phrases de
+référence : 2 Go en float32) pour n'en garder que le maximum de chaque
+ligne. Ici la matrice de référence est parcourue par blocs de BLOCK_ROWS
+lignes (tranches CSR, lues à la demande quand la matrice est mappée en
+mémoire) ; chaque bloc donne un produit creux requêtes x bloc, dont on
+garde seulement les k meilleurs scores par requête, fusionnés avec les
+meilleurs des blocs précédents. La mémoire de pointe est celle d'un bloc
+(requêtes x BLOCK_ROWS), quelle que soit la taille du corpus.
+
+Les blocs peuvent être calculés sur un pool de threads (workers) : les
+produits creux et les sélections numpy travaillent sur des tableaux
+distincts, et au plus `workers` blocs sont en mémoire à la fois.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+from scipy import sparse
+
+BLOCK_ROWS = int(os.environ.get('SPARSE_TOPK_BLOCK_ROWS', 8192))
+WORKERS = int(os.environ.get('SPARSE_TOPK_WORKERS', 1))
+
+
+def _row_norms(matrix: sparse.csr_matrix) -> np.ndarray:
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1), dtype=np.float32).ravel())
+    norms[norms == 0] = 1.0
+    return norms
+
+
+def _block_topk(queries: sparse.csr_matrix, block: sparse.csr_matrix, offset: int, k: int,
+                excluded: Optional[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    """k meilleurs (scores, lignes absolues) d'un bloc de références pour chaque requête"""
+    block = sparse.csr_matrix(block, dtype=np.float32)
+    block = sparse.diags(1.0 / _row_norms(block)) @ block
+    scores = (queries @ block.T).toarray()
+    if excluded is not None and len(excluded):
+        first, last = np.searchsorted(excluded, [offset, offset + block.shape[0]])
+        scores[:, excluded[first:last] - offset] = -np.inf
+    n_block = scores.shape[1]
+    if n_block > k:
+        columns = np.argpartition(scores, n_block - k, axis=1)[:, n_block - k:]
+    else:
+        columns = np.broadcast_to(np.arange(n_block), scores.shape).copy()
+    return np.take_along_axis(scores, columns, axis=1), columns.astype(np.int64) + offset
+
+
+def _merge(best_scores: np.ndarray, best_rows: np.ndarray, scores: np.ndarray,
+           rows: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    all_scores = np.concatenate([best_scores, scores], axis=1)
+    all_rows = np.concatenate([best_rows, rows], axis=1)
+    if all_scores.shape[1] > k:
+        keep = np.argpartition(all_scores, all_scores.shape[1] - k, axis=1)[:, all_scores.shape[1] - k:]
+        all_scores = np.take_along_axis(all_scores, keep, axis=1)
+        all_rows = np.take_along_axis(all_rows, keep, axis=1)
+    return all_scores, all_rows
+
+
+def _blocks(n_rows: int, block_rows: int) -> Iterable[int]:
+    return range(0, n_rows, block_rows)
+
+
+def blockwise_topk(queries, references, k: int = 1, excluded_rows: Optional[np.ndarray] = None,
+                   block_rows: int = BLOCK_ROWS, workers: int = WORKERS) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    k meilleures similarités cosinus de chaque requête parmi les lignes de
+    références, par score décroissant : (scores float32, lignes int64), de
+    forme (requêtes, k). Les lignes exclues et les places manquantes (moins
+    de k références) valent score 0 et ligne -1.
+    """
+    queries = sparse.csr_matrix(queries, dtype=np.float32)
+    queries = sparse.diags(1.0 / _row_norms(queries)) @ queries
+    n_queries = queries.shape[0]
+    n_references = references.shape[0]
+    excluded = None
+    if excluded_rows is not None and len(excluded_rows):
+        excluded = np.unique(np.asarray(excluded_rows, dtype=np.int64))
+
+    best_scores = np.full((n_queries, 0), -np.inf, dtype=np.float32)
+    best_rows = np.full((n_queries, 0), -1, dtype=np.int64)
+    if n_queries and n_references:
+        def compute(offset):
+            return _block_topk(queries, references[offset:offset + block_rows], offset, k, excluded)
+
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                offsets = list(_blocks(n_references, block_rows))
+                # Au plus `workers` blocs en cours : mémoire bornée
+                for start in range(0, len(offsets), workers):
+                    for scores, rows in executor.map(compute, offsets[start:start + workers]):
+                        best_scores, best_rows = _merge(best_scores, best_rows, scores, rows, k)
+        else:
+            for offset in _blocks(n_references, block_rows):
+                scores, rows = compute(offset)
+                best_scores, best_rows = _merge(best_scores, best_rows, scores, rows, k)
+
+    # Ordre décroissant, complété jusqu'à k
+    order = np.argsort(-best_scores, axis=1, kind='stable')
+    best_scores = np.take_along_axis(best_scores, order, axis=1)
+    best_rows = np.take_along_axis(best_rows, order, axis=1)
+    scores = np.zeros((n_queries, k), dtype=np.float32)
+    rows = np.full((n_queries, k), -1, dtype=np.int64)
+    width = min(k, best_scores.shape[1])
+    scores[:, :width] = best_scores[:, :width]
+    rows[:, :width] = best_rows[:, :width]
+    invalid = ~np.isfinite(scores)
+    scores[invalid] = 0.0
+    rows[invalid] = -1
+    return scores, rows
+
+
+def max_similarities(queries, references, excluded_rows: Optional[np.ndarray] = None,
+                     block_rows: int = BLOCK_ROWS, workers: int = WORKERS) -> np.ndarray:
+    """Similarité cosinus maximale de chaque requête (0 sans référence utilisable)"""
+    scores, _ = blockwise_topk(queries, references, 1, excluded_rows, block_rows, workers)
+    return scores[:, 0]
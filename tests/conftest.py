@@ -0,0 +1,74 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Flat top-level modules: make the repository root importable
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# Importing app runs db.create_all(): never against instance/acadcheck.db
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='acadcheck-tests-'), 'test.db')
+
+
+@pytest.fixture(autouse=True)
+def _isolated_cwd(tmp_path, monkeypatch):
+    """Caches use relative paths (plagiarism_cache/...): keep them out of the repository"""
+    monkeypatch.chdir(tmp_path)
+
+
+ESSAY_SENTENCES = [
+    "The industrial revolution transformed the economic structure of northern England.",
+    "Labour moved from agricultural estates into the expanding textile mills of Manchester.",
+    "Working conditions in those mills remained harsh for several decades.",
+    "Reformers such as Robert Owen argued that shorter hours would not reduce output.",
+    "Parliament eventually passed the Factory Acts, which limited child labour.",
+    "Historians still debate whether living standards rose before the 1840s.",
+    "Real wages are difficult to measure because prices varied between regions.",
+    "Some estimates suggest that urban mortality increased as cities grew quickly.",
+    "Railways later reduced transport costs and opened distant markets to manufacturers.",
+    "By the end of the century Britain faced strong competition from Germany and America.",
+]
+
+
+@pytest.fixture(scope='session')
+def tiny_lm():
+    """
+    Small randomly initialised GPT-2 and a byte-level tokenizer trained on the
+    test sentences: same code paths as distilgpt2, without a download.
+    """
+    tokenizers = pytest.importorskip('tokenizers')
+    transformers = pytest.importorskip('transformers')
+    import torch
+
+    torch.manual_seed(0)
+    bpe = tokenizers.ByteLevelBPETokenizer()
+    bpe.train_from_iterator(ESSAY_SENTENCES * 5, vocab_size=500, special_tokens=['<|endoftext|>'])
+    tokenizer = transformers.PreTrainedTokenizerFast(tokenizer_object=bpe._tokenizer, eos_token='<|endoftext|>')
+    config = transformers.GPT2Config(vocab_size=len(tokenizer), n_positions=512, n_embd=32, n_layer=2, n_head=2)
+    model = transformers.GPT2LMHeadModel(config).eval()
+    model.perplexity_model_id = 'tiny-gpt2/eager'
+    return model, tokenizer
+
+
+@pytest.fixture
+def database():
+    """Empty application database with an app context and one user owning two analysed documents"""
+    from app import app, db
+    from models import User, Document, DocumentStatus
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        user = User(id='u1', email='teacher@example.org', first_name='Ada', last_name='Lovelace')
+        db.session.add(user)
+        for i, sentence in enumerate(ESSAY_SENTENCES[:2]):
+            db.session.add(Document(filename=f'doc{i}.txt', original_filename=f'doc{i}.txt',
+                                    file_path=f'/tmp/doc{i}.txt', file_size=len(sentence),
+                                    content_type='text/plain', extracted_text=sentence * 3,
+                                    status=DocumentStatus.COMPLETED, user_id='u1'))
+        db.session.commit()
+        yield db
+        db.session.remove()
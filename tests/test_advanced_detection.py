@@ -0,0 +1,55 @@
+import sqlite3
+
+import advanced_detection_service
+from advanced_detection_service import AdvancedDetectionService
+from conftest import ESSAY_SENTENCES
+from minhash_lsh import MinHashLSH
+
+UNRELATED = [
+    "Photosynthesis converts light energy into chemical energy stored in glucose molecules.",
+    "The mitochondria produce most of the chemical energy needed by the cell.",
+    "Volcanic eruptions release ash and sulphur dioxide high into the atmosphere.",
+]
+
+
+def _service(tmp_path, with_minhash=True):
+    """Service over a small local database, without loading the Sentence-BERT models"""
+    service = AdvancedDetectionService.__new__(AdvancedDetectionService)
+    service.local_db_path = str(tmp_path / 'local.db')
+    service.minhash_index = MinHashLSH(service.local_db_path) if with_minhash else None
+    with sqlite3.connect(service.local_db_path) as conn:
+        conn.execute('CREATE TABLE documents (id INTEGER PRIMARY KEY, content TEXT)')
+        for text in [' '.join(ESSAY_SENTENCES[:5])] + UNRELATED:
+            document_id = conn.execute('INSERT INTO documents (content) VALUES (?)', (text,)).lastrowid
+            if service.minhash_index:
+                service.minhash_index.add(document_id, text, conn)
+    return service
+
+
+def _count_comparisons(monkeypatch):
+    calls = []
+    original = advanced_detection_service.token_similarity
+
+    def counting(a, b, min_similarity=0.0):
+        calls.append(len(b))
+        return original(a, b, min_similarity)
+    monkeypatch.setattr(advanced_detection_service, 'token_similarity', counting)
+    return calls
+
+
+def test_exact_matches_only_compare_lsh_candidates(tmp_path, monkeypatch):
+    calls = _count_comparisons(monkeypatch)
+    service = _service(tmp_path)
+    resubmitted = ' '.join(ESSAY_SENTENCES[:5]).replace('Manchester', 'Leeds')
+
+    assert service._detect_exact_matches(resubmitted)['score'] > 90
+    assert len(calls) == 1
+    assert service._detect_exact_matches("Quantum chromodynamics describes the strong force.") == {'score': 0}
+    assert len(calls) == 1
+
+
+def test_exact_matches_scan_everything_without_minhash(tmp_path, monkeypatch):
+    calls = _count_comparisons(monkeypatch)
+    service = _service(tmp_path, with_minhash=False)
+    assert service._detect_exact_matches(' '.join(ESSAY_SENTENCES[:5]))['score'] == 100
+    assert len(calls) == 1 + len(UNRELATED)
@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta
+
+import analysis_worker
+from analysis_queue import complete_job, enqueue_analysis, fail_job, lease_next_job
+from models import AnalysisJob, AnalysisResult, Document, DocumentStatus, JobStatus
+
+
+def _new_job(database):
+    document = database.session.query(Document).first()
+    return enqueue_analysis(document.id).id
+
+
+def _expire_lease(database, job_id):
+    job = database.session.get(AnalysisJob, job_id)
+    job.lease_expires_at = datetime.now() - timedelta(seconds=1)
+    database.session.commit()
+
+
+def _make_due(database, job_id):
+    job = database.session.get(AnalysisJob, job_id)
+    job.available_at = datetime.now() - timedelta(seconds=1)
+    database.session.commit()
+
+
+def test_a_job_is_leased_once(database):
+    job_id = _new_job(database)
+    assert lease_next_job('worker-a').id == job_id
+    assert lease_next_job('worker-b') is None
+
+
+def test_stale_worker_cannot_complete_or_fail(database):
+    job_id = _new_job(database)
+    stale = lease_next_job('worker-a')
+    _expire_lease(database, job_id)
+    current = lease_next_job('worker-b')
+    assert current.attempts == 2
+
+    assert complete_job(stale, 'worker-a') is False
+    assert fail_job(stale, 'worker-a', 'boom') is False
+    job = database.session.get(AnalysisJob, job_id)
+    assert (job.status, job.lease_owner, job.last_error) == (JobStatus.RUNNING, 'worker-b', None)
+
+    assert complete_job(current, 'worker-b') is True
+    assert database.session.get(AnalysisJob, job_id).status == JobStatus.DONE
+
+
+def test_failed_job_is_retried_with_backoff_then_given_up(database):
+    job_id = _new_job(database)
+    for attempt in range(1, 3):
+        job = lease_next_job('worker')
+        assert job.attempts == attempt
+        assert fail_job(job, 'worker', 'ValueError: bad input') is True
+        assert job.status == JobStatus.QUEUED and job.available_at > datetime.now()
+        assert lease_next_job('worker') is None   # backoff
+        _make_due(database, job_id)
+
+    job = lease_next_job('worker')
+    assert fail_job(job, 'worker', 'ValueError: bad input') is False
+    assert job.status == JobStatus.FAILED
+    assert database.session.get(Document, job.document_id).status == DocumentStatus.FAILED
+
+
+def test_worker_stops_when_its_lease_is_taken_over(database, monkeypatch):
+    job_id = _new_job(database)
+
+    def analyze_document(document, lease=None):
+        # Another worker takes the job over while this one is analysing it
+        _expire_lease(database, job_id)
+        assert lease_next_job('worker-b').id == job_id
+        lease.lost.set()
+        return analysis_worker._LeaseDeadline(600, lease).expired() and lease.check()
+
+    monkeypatch.setattr(analysis_worker, 'analyze_document', analyze_document)
+    assert analysis_worker.process_next_job('worker-a') is True
+
+    job = database.session.get(AnalysisJob, job_id)
+    database.session.refresh(job)
+    assert (job.status, job.lease_owner, job.last_error) == (JobStatus.RUNNING, 'worker-b', None)
+    assert database.session.query(AnalysisResult).count() == 0
@@ -0,0 +1,53 @@
+from analysis_reuse import ANALYSIS_ENGINE_VERSION, find_reusable_analysis, reuse_previous_analysis
+from conftest import ESSAY_SENTENCES
+from file_utils import compute_text_hash
+from models import Document, DocumentStatus, AnalysisResult, HighlightedSentence, User
+
+
+def _document(database, text, user_id='u1', status=DocumentStatus.COMPLETED):
+    document = Document(filename='essay.txt', original_filename='essay.txt', file_path='/tmp/essay.txt',
+                        file_size=len(text), content_type='text/plain', extracted_text=text,
+                        text_hash=compute_text_hash(text), status=status, user_id=user_id)
+    database.session.add(document)
+    database.session.commit()
+    return document
+
+
+def _analysed(database, text, provider='local', engine_version=None, user_id='u1'):
+    document = _document(database, text, user_id)
+    database.session.add(AnalysisResult(document_id=document.id, plagiarism_score=42.0, ai_score=12.5,
+                                        total_words=len(text.split()), analysis_provider=provider,
+                                        engine_version=engine_version or ANALYSIS_ENGINE_VERSION))
+    database.session.add(HighlightedSentence(document_id=document.id, sentence_text=ESSAY_SENTENCES[0],
+                                             start_position=0, end_position=len(ESSAY_SENTENCES[0]),
+                                             is_plagiarism=True, plagiarism_score=90.0))
+    database.session.commit()
+    return document
+
+
+def test_identical_text_reuses_the_analysis(database):
+    text = ' '.join(ESSAY_SENTENCES)
+    source = _analysed(database, text)
+    resubmitted = _document(database, text, status=DocumentStatus.PROCESSING)
+
+    clone = reuse_previous_analysis(resubmitted)
+    assert clone is not None and clone.document_id == resubmitted.id
+    assert (clone.plagiarism_score, clone.ai_score) == (42.0, 12.5)
+    assert resubmitted.status == DocumentStatus.COMPLETED
+    highlights = HighlightedSentence.query.filter_by(document_id=resubmitted.id).all()
+    assert [h.sentence_text for h in highlights] == [ESSAY_SENTENCES[0]]
+    assert HighlightedSentence.query.filter_by(document_id=source.id).count() == 1
+
+
+def test_stale_partial_or_foreign_analyses_are_not_reused(database):
+    text = ' '.join(ESSAY_SENTENCES)
+    _analysed(database, text, engine_version='local-0')
+    _analysed(database, text, provider='local_partial')
+    database.session.add(User(id='u2', email='other@example.org', first_name='Alan', last_name='Turing'))
+    database.session.commit()
+    _analysed(database, text, user_id='u2')
+
+    assert find_reusable_analysis(_document(database, text, status=DocumentStatus.PROCESSING)) is None
+    # Different text from the same user
+    _analysed(database, ' '.join(ESSAY_SENTENCES[:5]))
+    assert find_reusable_analysis(_document(database, text, status=DocumentStatus.PROCESSING)) is None
@@ -0,0 +1,75 @@
+import numpy as np
+
+from ann_index import IVFIndex
+
+
+def _clustered_vectors(rng, count, dim=32, clusters=20):
+    centers = rng.normal(size=(clusters, dim))
+    return (centers[rng.integers(clusters, size=count)] + 0.3 * rng.normal(size=(count, dim))).astype(np.float32)
+
+
+def _exact_neighbours(vectors, queries, k):
+    vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+    return np.argsort(-(queries @ vectors.T), axis=1)[:, :k]
+
+
+def test_small_index_search_is_exact(tmp_path):
+    rng = np.random.default_rng(0)
+    vectors = _clustered_vectors(rng, 200)
+    index = IVFIndex(str(tmp_path / 'ann'), train_threshold=1024)
+    index.add(vectors[:120], document_id=1)
+    index.add(vectors[120:], document_id=2, sentence_indices=list(range(80)))
+
+    queries = vectors[::17] + 0.05 * rng.normal(size=vectors[::17].shape).astype(np.float32)
+    exact = _exact_neighbours(vectors, queries, 5)
+    for result, expected in zip(index.search(queries, k=5), exact):
+        rows = [sentence if document_id == 1 else 120 + sentence for _, document_id, sentence in result]
+        assert rows == expected.tolist()
+
+
+def test_trained_index_recall(tmp_path):
+    rng = np.random.default_rng(1)
+    vectors = _clustered_vectors(rng, 3000)
+    index = IVFIndex(str(tmp_path / 'ann'), n_probe=8, train_threshold=1024)
+    for start in range(0, len(vectors), 500):
+        index.add(vectors[start:start + 500], document_id=0, sentence_indices=list(range(start, start + 500)))
+    assert index.centroids is not None
+
+    queries = _clustered_vectors(rng, 100)
+    exact = _exact_neighbours(vectors, queries, 10)
+    found = [{sentence for _, _, sentence in result} for result in index.search(queries, k=10)]
+    recall = np.mean([len(f & set(e.tolist())) / 10 for f, e in zip(found, exact)])
+    assert recall > 0.9
+
+    # Another process sees the same index from the files alone
+    reopened = IVFIndex(str(tmp_path / 'ann'), n_probe=8, train_threshold=1024)
+    assert len(reopened) == len(vectors)
+    assert reopened.search(queries[:5], k=10) == index.search(queries[:5], k=10)
+
+
+def test_zero_vectors_are_skipped(tmp_path):
+    index = IVFIndex(str(tmp_path / 'ann'))
+    vectors = np.eye(4, dtype=np.float32)
+    vectors[2] = 0
+    assert index.add(vectors, document_id=7) == 3
+    assert {sentence for _, _, sentence in index.search(vectors[:1], k=4)[0]} == {0, 1, 3}
+
+
+def test_appends_extend_the_lists_without_loading_the_index(tmp_path):
+    rng = np.random.default_rng(2)
+    vectors = _clustered_vectors(rng, 1600)
+    index = IVFIndex(str(tmp_path / 'ann'), train_threshold=1024)
+    other = IVFIndex(str(tmp_path / 'ann'), train_threshold=1024)
+    index.add(vectors[:1100], document_id=1)
+    for start in range(1100, 1600, 100):
+        # Appends from another process are picked up from the end of the files
+        other.add(vectors[start:start + 100], document_id=2, sentence_indices=list(range(start, start + 100)))
+    index.search(vectors[:1], k=1)
+
+    assert len(index) == 1600 and isinstance(index.vectors, np.memmap)
+    assign = np.asarray(index.assign)
+    for list_id, row_list in enumerate(index._lists):
+        assert row_list.rows().tolist() == np.flatnonzero(assign == list_id).tolist()
+    result = index.search(vectors[1500:1501], k=1)[0][0]
+    assert result[1:] == (2, 1500) and result[0] > 0.999
@@ -0,0 +1,35 @@
+from conftest import ESSAY_SENTENCES
+from chunked_analysis import iter_windows
+
+
+def _check_windows(text, window_chars, overlap_chars):
+    windows = list(iter_windows(text, window_chars, overlap_chars))
+    spans = [span for window in windows for span in window.spans]
+    # Every sentence belongs to exactly one window, in document order
+    assert spans == sorted(spans)
+    assert all(end <= next_start for (_, end), (next_start, _) in zip(spans, spans[1:]))
+    covered = ''.join(text[start:end] for start, end in spans)
+    assert ''.join(covered.split()) == ''.join(text.split())
+    for window in windows:
+        assert window.core_end - window.core_start <= window_chars
+        assert window.core_start - window.context_start <= overlap_chars
+        assert window.context_start == 0 or text[window.context_start - 1].isspace()
+    return windows
+
+
+def test_windows_cover_every_sentence_once():
+    text = ' '.join(ESSAY_SENTENCES * 6)
+    windows = _check_windows(text, window_chars=500, overlap_chars=80)
+    assert len(windows) > 1
+    assert windows[0].context == ''
+    assert all(window.context for window in windows[1:])
+
+
+def test_long_sentences_are_split_at_spaces():
+    # Extracted PDF text without punctuation: one "sentence" longer than a window
+    text = ' '.join(sentence.rstrip('.') for sentence in ESSAY_SENTENCES * 3)
+    windows = _check_windows(text, window_chars=300, overlap_chars=50)
+    for window in windows:
+        for start, end in window.spans:
+            assert start == 0 or text[start - 1] == ' '
+            assert end == len(text) or text[end] == ' '
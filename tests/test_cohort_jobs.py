@@ -0,0 +1,78 @@
+import time
+from datetime import datetime, timedelta
+
+import cohort_jobs
+from cohort_jobs import create_cohort, extend_cohort_lease, lease_next_cohort, process_next_cohort, run_cohort
+from models import CohortAnalysis, Document, JobStatus
+
+
+def _new_cohort(database):
+    document_ids = [row[0] for row in database.session.query(Document.id).all()]
+    return create_cohort('u1', document_ids, 'Class A').id
+
+
+def _expire_lease(database, cohort_id):
+    cohort = database.session.get(CohortAnalysis, cohort_id)
+    cohort.lease_expires_at = datetime.now() - timedelta(seconds=1)
+    database.session.commit()
+
+
+def test_crashing_cohort_fails_after_max_attempts(database):
+    cohort_id = _new_cohort(database)
+    for attempt in range(1, 4):
+        cohort = lease_next_cohort(f'worker-{attempt}')
+        assert cohort.id == cohort_id and cohort.attempts == attempt
+        _expire_lease(database, cohort_id)   # the worker died
+
+    assert lease_next_cohort('worker-4') is None
+    cohort = database.session.get(CohortAnalysis, cohort_id)
+    assert cohort.status == JobStatus.FAILED
+    assert cohort.last_error == 'Lease expired (worker lost)'
+
+
+def test_worker_that_lost_its_lease_does_not_overwrite(database):
+    cohort_id = _new_cohort(database)
+    stale = lease_next_cohort('worker-a')
+    _expire_lease(database, cohort_id)
+    current = lease_next_cohort('worker-b')
+    assert current.lease_owner == 'worker-b'
+
+    assert run_cohort(stale, 'worker-a') is False
+    assert database.session.get(CohortAnalysis, cohort_id).status == JobStatus.RUNNING
+    assert run_cohort(current, 'worker-b') is True
+    cohort = database.session.get(CohortAnalysis, cohort_id)
+    assert cohort.status == JobStatus.DONE and cohort.lease_owner is None
+
+
+def test_failed_cohort_is_retried_then_given_up(database, monkeypatch):
+    cohort_id = _new_cohort(database)
+
+    def broken(cohort, worker_id):
+        raise MemoryError("matrix too large")
+    monkeypatch.setattr(cohort_jobs, 'run_cohort', broken)
+
+    for attempt in range(3):
+        assert process_next_cohort('worker') is True
+    cohort = database.session.get(CohortAnalysis, cohort_id)
+    database.session.refresh(cohort)
+    assert cohort.status == JobStatus.FAILED
+    assert cohort.attempts == 3
+    assert 'matrix too large' in cohort.last_error
+    assert process_next_cohort('worker') is False
+
+
+def test_heartbeat_renews_the_lease(database):
+    from analysis_queue import LeaseHeartbeat
+
+    cohort_id = _new_cohort(database)
+    lease_next_cohort('worker', lease_seconds=3)
+    expires_at = database.session.get(CohortAnalysis, cohort_id).lease_expires_at
+
+    heartbeat = LeaseHeartbeat(lambda: extend_cohort_lease(cohort_id, 'worker', 3), f"cohort {cohort_id}", 3)
+    heartbeat.start()
+    time.sleep(1.5)
+    heartbeat.stop()
+    heartbeat.join()
+
+    database.session.expire_all()
+    assert database.session.get(CohortAnalysis, cohort_id).lease_expires_at > expires_at
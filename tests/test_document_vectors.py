@@ -0,0 +1,82 @@
+import sqlite3
+
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.metrics.pairwise import cosine_similarity
+
+from conftest import ESSAY_SENTENCES
+from document_vectors import TfidfDocumentIndex
+
+
+def _bigrams(text):
+    words = text.lower().split()
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+def _documents():
+    return [' '.join(ESSAY_SENTENCES[i:i + 3]) for i in range(0, len(ESSAY_SENTENCES), 2)]
+
+
+def _fitted(stored, text, analyzer=_bigrams, **options):
+    """A TfidfVectorizer fitted on the stored documents, then applied to the text"""
+    vectorizer = TfidfVectorizer(analyzer=analyzer, smooth_idf=True, **options)
+    matrix = vectorizer.fit_transform(stored)
+    return cosine_similarity(vectorizer.transform([text]), matrix)[0]
+
+
+def _assert_matches_fit(index, stored, text, **options):
+    expected = _fitted(stored, text, **options)
+    scores = dict(index.query(text))
+    actual = [scores.get(document_id, 0.0) for document_id in range(len(stored))]
+    np.testing.assert_allclose(actual, expected, atol=1e-6)
+
+
+def test_query_matches_fitted_vectorizer(tmp_path):
+    index = TfidfDocumentIndex(str(tmp_path / 'vectors.db'), _bigrams, smooth_idf=True, max_df=0.8)
+    stored = _documents()
+    for document_id, text in enumerate(stored):
+        index.add(document_id, text)
+
+    _assert_matches_fit(index, stored, ESSAY_SENTENCES[3] + " Unseen words about steam engines.", max_df=0.8)
+    _assert_matches_fit(index, stored, stored[1], max_df=0.8)
+    assert index.query("entirely unseen vocabulary") == []
+
+
+def test_incremental_refresh_matches_fitted_vectorizer(tmp_path):
+    index = TfidfDocumentIndex(str(tmp_path / 'vectors.db'), _bigrams, smooth_idf=True)
+    stored = _documents()
+    for document_id, text in enumerate(stored[:2]):
+        index.add(document_id, text)
+    index.query(stored[0])
+
+    # New documents (and new terms) are read from the rows added since the last snapshot
+    for document_id, text in enumerate(stored[2:], start=2):
+        index.add(document_id, text)
+    index.refresh()
+    _assert_matches_fit(index, stored, ESSAY_SENTENCES[7])
+
+    # A re-added document keeps only its latest vector
+    stored[0] = "Cotton prices fell sharply after the war in America."
+    index.add(0, stored[0])
+    index.refresh()
+    _assert_matches_fit(index, stored, ESSAY_SENTENCES[8] + " Cotton prices fell.")
+
+
+def test_integer_terms_are_stored_as_integers(tmp_path):
+    from token_vocab import get_token_vocabulary, token_hash
+
+    def hashed_bigrams(text):
+        vocabulary = get_token_vocabulary()
+        return vocabulary.ngram_range_hashes(vocabulary.encode(text.lower().split()), 1, 2).tolist()
+
+    db_path = str(tmp_path / 'vectors.db')
+    index = TfidfDocumentIndex(db_path, hashed_bigrams, smooth_idf=True, integer_terms=True)
+    stored = _documents()
+    for document_id, text in enumerate(stored):
+        index.add(document_id, text)
+
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute("SELECT DISTINCT typeof(term) FROM tfidf_terms").fetchall() == [('integer',)]
+        assert conn.execute("SELECT term_id FROM tfidf_terms WHERE term = ?",
+                            (token_hash('mills'),)).fetchone() is not None
+    _assert_matches_fit(index, stored, ESSAY_SENTENCES[4], analyzer=hashed_bigrams)
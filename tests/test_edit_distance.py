@@ -0,0 +1,62 @@
+import random
+
+from edit_distance import myers_distance, bounded_distance, token_similarity
+
+
+def _levenshtein(a, b):
+    """Textbook dynamic-programming oracle"""
+    previous = list(range(len(b) + 1))
+    for i, x in enumerate(a, 1):
+        current = [i]
+        for j, y in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (x != y)))
+        previous = current
+    return previous[-1]
+
+
+def _random_pairs(count, max_length, alphabet):
+    rng = random.Random(0)
+    for _ in range(count):
+        a = [rng.choice(alphabet) for _ in range(rng.randint(0, max_length))]
+        b = list(a)
+        # Edits on a copy, so the pairs range from identical to unrelated
+        for _ in range(rng.randint(0, max_length)):
+            op = rng.randrange(3)
+            if op == 0 and b:
+                del b[rng.randrange(len(b))]
+            elif op == 1:
+                b.insert(rng.randint(0, len(b)), rng.choice(alphabet))
+            elif b:
+                b[rng.randrange(len(b))] = rng.choice(alphabet)
+        yield a, b
+
+
+def test_myers_matches_dp_on_word_sequences():
+    words = ['the', 'mill', 'workers', 'of', 'england', 'labour', 'reform', 'act']
+    for a, b in _random_pairs(300, 40, words):
+        assert myers_distance(a, b) == _levenshtein(a, b)
+
+
+def test_myers_matches_dp_beyond_one_machine_word():
+    # Sequences longer than 64 symbols exercise the multi-block path
+    for a, b in _random_pairs(40, 200, 'abcdef'):
+        assert myers_distance(''.join(a), ''.join(b)) == _levenshtein(a, b)
+
+
+def test_bounded_distance_respects_the_bound():
+    for a, b in _random_pairs(200, 30, 'abcd'):
+        exact = _levenshtein(a, b)
+        for k in (0, exact - 1, exact, exact + 3):
+            expected = exact if 0 <= k and exact <= k else None
+            assert bounded_distance(a, b, k) == expected
+
+
+def test_token_similarity_is_zero_below_threshold():
+    a = 'the workers of the mill asked for shorter hours'.split()
+    b = 'the workers of the mill demanded much shorter hours'.split()
+    distance = _levenshtein(a, b)
+    exact = (1 - distance / max(len(a), len(b))) * 100
+    assert token_similarity(a, b) == exact
+    assert token_similarity(a, b, min_similarity=exact - 1) == exact
+    assert token_similarity(a, b, min_similarity=exact + 20) == 0.0
+    assert token_similarity([], []) == 0.0
@@ -0,0 +1,100 @@
+import socket
+import threading
+
+import numpy as np
+import pytest
+
+from ai_perplexity_detectgpt import batched_perplexities, token_losses
+from inference_server import InferenceClient, InferenceServer, MicroBatcher, _Request, _Window
+from conftest import ESSAY_SENTENCES
+
+TEXTS = [
+    ' '.join(ESSAY_SENTENCES),
+    ' '.join(ESSAY_SENTENCES * 6),   # longer than the model context: several windows
+    ESSAY_SENTENCES[3],
+    '',
+]
+
+
+@pytest.fixture
+def daemon(tiny_lm, tmp_path):
+    model, tokenizer = tiny_lm
+    # Asked for int8, but the model that actually loaded is the eager one
+    server = InferenceServer(str(tmp_path / 'inference.sock'), model, tokenizer, 'int8', 'tiny-gpt2',
+                             max_batch=4, max_wait_ms=5)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server, InferenceClient(server.path, timeout=30)
+    server.shutdown()
+    server.server_close()
+
+
+def test_daemon_losses_match_local(tiny_lm, daemon):
+    model, tokenizer = tiny_lm
+    _, client = daemon
+    remote = client.token_losses(TEXTS)
+    for text, (losses, ends) in zip(TEXTS, remote):
+        local_losses, local_ends = token_losses(text, model, tokenizer)
+        np.testing.assert_array_equal(ends, local_ends)
+        np.testing.assert_allclose(losses, local_losses, rtol=0, atol=1e-4)
+    assert len(remote[1][0]) > model.config.n_positions
+
+
+def test_daemon_batched_perplexities_match_local(tiny_lm, daemon):
+    model, tokenizer = tiny_lm
+    _, client = daemon
+    np.testing.assert_allclose(batched_perplexities(TEXTS, client, tokenizer),
+                               batched_perplexities(TEXTS, model, tokenizer), rtol=1e-4)
+
+
+def test_stats_advertise_the_loaded_backend(daemon):
+    server, client = daemon
+    stats = client.health()
+    assert stats['perplexity_model_id'] == 'tiny-gpt2/eager'
+    assert stats['backend'] == 'eager'
+
+
+def test_abandoned_windows_are_dropped(tiny_lm):
+    model, tokenizer = tiny_lm
+    batcher = MicroBatcher(model, tokenizer.eos_token_id, max_batch=4, max_wait_ms=1)
+    ids = tokenizer(ESSAY_SENTENCES[0])['input_ids']
+
+    abandoned = _Request()
+    abandoned.abandoned = True
+    abandoned.expect(3)
+    live = _Request()
+    live.expect(1)
+    losses = np.zeros(len(ids) - 1, dtype=np.float32)
+    batcher.submit([_Window(ids, 0, np.zeros(len(ids) - 1, dtype=np.float32), 0, abandoned) for _ in range(3)]
+                   + [_Window(ids, 0, losses, 0, live)])
+
+    assert live.done.wait(10)
+    stats = batcher.stats()
+    assert stats['dropped_windows'] == 3
+    assert stats['windows'] == 1
+    assert losses.any()
+
+
+def test_expired_deadline_skips_the_daemon(daemon):
+    from timeout_optimization import AnalysisDeadline
+    _, client = daemon
+    results = client.token_losses(TEXTS, deadline=AnalysisDeadline(0))
+    assert all(len(losses) == 0 for losses, _ in results)
+
+
+def test_refuses_the_socket_of_a_live_daemon(tiny_lm, daemon):
+    model, tokenizer = tiny_lm
+    server, client = daemon
+    with pytest.raises(RuntimeError, match='already listening'):
+        InferenceServer(server.path, model, tokenizer, 'eager', 'tiny-gpt2')
+    assert client.token_losses([ESSAY_SENTENCES[0]])    # the live daemon kept its socket
+
+
+def test_replaces_a_stale_socket(tiny_lm, tmp_path):
+    model, tokenizer = tiny_lm
+    path = str(tmp_path / 'inference.sock')
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(path)
+    stale.close()                                        # file left behind, nobody listening
+    server = InferenceServer(path, model, tokenizer, 'eager', 'tiny-gpt2')
+    server.server_close()
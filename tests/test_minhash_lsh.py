@@ -0,0 +1,43 @@
+import numpy as np
+
+from conftest import ESSAY_SENTENCES
+from minhash_lsh import MinHashLSH, word_set, jaccard
+
+
+def _essays():
+    return [' '.join(ESSAY_SENTENCES[i:i + 2]) for i in range(0, 10, 2)]
+
+
+def test_signature_estimates_jaccard(tmp_path):
+    index = MinHashLSH(str(tmp_path / 'minhash.db'))
+    # Pairs ranging from disjoint to half-shared to identical word sets
+    texts = _essays() + [' '.join(ESSAY_SENTENCES[1:3]), ' '.join(ESSAY_SENTENCES[:3])]
+    errors = []
+    for a in texts:
+        for b in texts:
+            estimate = float(np.mean(index.signature(a) == index.signature(b)))
+            errors.append(abs(estimate - jaccard(word_set(a), word_set(b))))
+    # Standard error of a 126-permutation estimate is at most ~0.045
+    assert max(errors) < 0.15
+    assert np.mean(errors) < 0.05
+
+
+def test_query_finds_near_duplicates(tmp_path):
+    index = MinHashLSH(str(tmp_path / 'minhash.db'))
+    essays = _essays()
+    for document_id, text in enumerate(essays):
+        index.add(document_id, text)
+    index.add(99, "Photosynthesis converts light energy into chemical energy stored in glucose.")
+
+    # The same essay with a few words changed
+    resubmitted = essays[2].replace('Parliament', 'Eventually,').replace('Historians', 'Scholars')
+    results = index.query(resubmitted)
+    assert results[0][0] == 2
+    assert results[0][1] > 0.8
+    assert 99 not in dict(results)
+    assert [score for _, score in results] == sorted((score for _, score in results), reverse=True)
+    assert index.query(resubmitted, min_similarity=0.99) == []
+
+    # Re-adding a document replaces its buckets
+    index.add(2, "Photosynthesis converts light energy into chemical energy stored in glucose.")
+    assert 2 not in dict(index.query(resubmitted, min_similarity=0.5))
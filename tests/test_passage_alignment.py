@@ -0,0 +1,63 @@
+import random
+
+from passage_alignment import extend, MATCH, MISMATCH, GAP, BAND
+
+
+def _banded_alignment(a, b, band):
+    """
+    Oracle: full banded prefix alignment without the X-drop cut-off.
+    Returns (score, words of a, words of b, identical words) of the best prefix pair.
+    """
+    minus_inf = (float('-inf'), 0)
+    table = [[minus_inf] * (len(b) + 1) for _ in range(len(a) + 1)]
+    best = (0, 0, 0, 0)
+    for i in range(len(a) + 1):
+        for j in range(len(b) + 1):
+            if abs(i - j) > band:
+                continue
+            if i == 0 and j == 0:
+                table[0][0] = (0, 0)
+                continue
+            candidates = [minus_inf]
+            if i and j:
+                score, matches = table[i - 1][j - 1]
+                same = a[i - 1] == b[j - 1]
+                candidates.append((score + (MATCH if same else MISMATCH), matches + same))
+            if i:
+                candidates.append((table[i - 1][j][0] + GAP, table[i - 1][j][1]))
+            if j:
+                candidates.append((table[i][j - 1][0] + GAP, table[i][j - 1][1]))
+            table[i][j] = max(candidates)
+            if i and table[i][j][0] > best[0]:
+                best = (table[i][j][0], i, j, table[i][j][1])
+    return best
+
+
+def test_identical_sequences_extend_to_the_end():
+    words = "the factory acts limited child labour in the textile mills".split()
+    assert extend(words, words) == (len(words), len(words), len(words))
+
+
+def test_extension_stops_after_a_divergence():
+    shared = "parliament eventually passed the factory acts".split()
+    a = shared + "which limited child labour in most northern mills".split()
+    b = shared + "railways opened distant markets to british manufacturers quickly".split()
+    assert extend(a, b) == (len(shared), len(shared), len(shared))
+
+
+def test_small_edits_are_bridged():
+    a = "working conditions in those mills remained harsh for several decades".split()
+    b = "working conditions in these mills remained very harsh for several decades".split()
+    assert extend(a, b) == (len(a), len(b), len(a) - 1)
+
+
+def test_matches_banded_alignment_without_cutoff():
+    rng = random.Random(0)
+    vocabulary = ['mill', 'labour', 'reform', 'act', 'wage', 'price']
+    for _ in range(300):
+        a = [rng.choice(vocabulary) for _ in range(rng.randint(0, 15))]
+        b = [word for word in a if rng.random() > 0.2]
+        for _ in range(rng.randint(0, 3)):
+            b.insert(rng.randint(0, len(b)), rng.choice(vocabulary))
+        _, i, j, matches = _banded_alignment(a, b, BAND)
+        assert extend(a, b, x_drop=10 ** 6) == (i, j, matches)
@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+import perplexity_cache
+from perplexity_cache import PerplexityCache
+from ai_likelihood_profile import AILikelihoodProfile
+from ai_perplexity_detectgpt import ai_detection_profile
+from chunked_analysis import analyze_text_chunked
+from conftest import ESSAY_SENTENCES
+
+# Paragraph breaks give tokens that belong to no sentence
+TEXT = "\n\n".join(' '.join(ESSAY_SENTENCES[i:i + 2]) for i in range(0, len(ESSAY_SENTENCES), 2))
+
+
+@pytest.fixture
+def use_cache(monkeypatch, tmp_path):
+    def install(enabled):
+        monkeypatch.setattr(perplexity_cache, 'CACHE_ENABLED', enabled)
+        monkeypatch.setattr(perplexity_cache, '_perplexity_cache',
+                            PerplexityCache(str(tmp_path / 'perplexity.db')) if enabled else None)
+        return perplexity_cache._perplexity_cache
+    return install
+
+
+def _assert_same_profile(a, b):
+    for name in AILikelihoodProfile._ARRAYS:
+        np.testing.assert_array_equal(getattr(a, name), getattr(b, name), err_msg=name)
+
+
+def test_cached_profile_matches_uncached(tiny_lm, use_cache):
+    model, tokenizer = tiny_lm
+    use_cache(False)
+    uncached, uncached_profile = ai_detection_profile(TEXT, model, tokenizer)
+
+    cache = use_cache(True)
+    cold, cold_profile = ai_detection_profile(TEXT, model, tokenizer)
+    warm, warm_profile = ai_detection_profile(TEXT, model, tokenizer)
+
+    assert cache.stats()['memory_hits'] == len(warm_profile)
+    assert uncached == cold == warm
+    assert len(warm_profile.token_logprobs) > 0
+    _assert_same_profile(uncached_profile, cold_profile)
+    _assert_same_profile(uncached_profile, warm_profile)
+
+
+def test_cached_windows_match_uncached(tiny_lm, use_cache, tmp_path):
+    model, tokenizer = tiny_lm
+    use_cache(False)
+    uncached = analyze_text_chunked(TEXT, window_chars=300, overlap_chars=80, model=model, tokenizer=tokenizer)
+    assert uncached['windows'] > 1
+
+    use_cache(True)
+    cold = analyze_text_chunked(TEXT, window_chars=300, overlap_chars=80, model=model, tokenizer=tokenizer)
+    # A new process: only the SQLite table is shared
+    cache = perplexity_cache._perplexity_cache = PerplexityCache(str(tmp_path / 'perplexity.db'))
+    warm = analyze_text_chunked(TEXT, window_chars=300, overlap_chars=80, model=model, tokenizer=tokenizer)
+
+    assert cache.stats()['misses'] == 0
+    assert uncached['ai_generated'] == cold['ai_generated'] == warm['ai_generated']
+    _assert_same_profile(uncached['ai_profile'], cold['ai_profile'])
+    _assert_same_profile(uncached['ai_profile'], warm['ai_profile'])
+
+
+def test_memory_is_bounded_in_bytes(tmp_path):
+    cache = PerplexityCache(str(tmp_path / 'perplexity.db'), memory_bytes=2000)
+    sentences = [f"Sentence number {i}." for i in range(20)]
+    values = [(np.full(10, i, dtype=np.float32), np.arange(1, 11, dtype=np.int32)) for i in range(20)]
+    cache.store('model', sentences, values)
+    assert cache.stats()['memory_bytes'] <= 2000
+
+    found = cache.lookup('model', sentences)
+    assert cache.stats()['misses'] == 0
+    for (losses, ends), (expected_losses, expected_ends) in zip(found, values):
+        np.testing.assert_array_equal(losses, expected_losses)
+        np.testing.assert_array_equal(ends, expected_ends)
+    assert cache.lookup('other-model', sentences[:1]) == [None]
@@ -0,0 +1,84 @@
+import os
+import json
+import multiprocessing
+
+import numpy as np
+import pytest
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+import reference_index
+from reference_index import ReferenceIndex, build_reference_index, load_reference_index
+
+SENTENCES = [
+    "The committee reviewed the annual budget and approved the new research programme.",
+    "Students must submit their final reports before the end of the spring semester.",
+    "Machine learning models require careful evaluation on held-out data sets.",
+    "The library extends its opening hours during the examination period every year.",
+    "Renewable energy sources are becoming cheaper than fossil fuels in many regions.",
+]
+
+
+def _write_corpus(directory, variant=0):
+    os.makedirs(directory, exist_ok=True)
+    for i in range(4):
+        sentences = [SENTENCES[(i + j + variant) % len(SENTENCES)] for j in range(3)]
+        with open(os.path.join(directory, f"doc{i}.txt"), 'w', encoding='utf-8') as f:
+            f.write(' '.join(sentences) + f" Variant number {variant} of document {i} ends here.")
+
+
+def _build_and_load(args):
+    reference_dir, index_dir = args
+    manifest = build_reference_index(reference_dir, index_dir)
+    index = ReferenceIndex(index_dir, manifest)
+    return manifest['generation'], len(index)
+
+
+def test_index_matches_full_refit(tmp_path):
+    from ai_perplexity_detectgpt import preprocess_text
+
+    reference_dir, index_dir = str(tmp_path / 'corpus'), str(tmp_path / 'index')
+    _write_corpus(reference_dir)
+    index = ReferenceIndex(index_dir, build_reference_index(reference_dir, index_dir))
+
+    sentences = []
+    for fname in sorted(os.listdir(reference_dir)):
+        with open(os.path.join(reference_dir, fname), encoding='utf-8') as f:
+            sentences += preprocess_text(f.read(), reference_index.MIN_REFERENCE_SENTENCE)
+    vectorizer = TfidfVectorizer().fit(sentences)
+    expected = vectorizer.transform(sentences).toarray()
+
+    assert index.vectorizer.get_feature_names_out().tolist() == vectorizer.get_feature_names_out().tolist()
+    np.testing.assert_allclose(index.matrix.toarray(), expected, rtol=1e-6, atol=1e-9)
+
+
+def test_concurrent_builds_keep_published_generation(tmp_path, monkeypatch):
+    reference_dir, index_dir = str(tmp_path / 'corpus'), str(tmp_path / 'index')
+    # No grace period: only the lock and the published manifest protect generations
+    monkeypatch.setenv('REFERENCE_INDEX_GRACE_SECONDS', '0')
+    context = multiprocessing.get_context('spawn')
+    for variant in range(3):
+        _write_corpus(reference_dir, variant)
+        with context.Pool(6) as pool:
+            results = pool.map(_build_and_load, [(reference_dir, index_dir)] * 6)
+        with open(os.path.join(index_dir, 'manifest.json'), encoding='utf-8') as f:
+            manifest = json.load(f)
+        assert os.path.isdir(os.path.join(index_dir, manifest['generation']))
+        # A single build per corpus change: every process sees the same generation
+        assert {generation for generation, _ in results} == {manifest['generation']}
+        assert len(ReferenceIndex(index_dir, manifest)) == results[0][1] > 0
+
+
+def test_load_reference_remembers_index_failure(monkeypatch):
+    import ai_perplexity_detectgpt
+
+    calls = []
+
+    def failing_load():
+        calls.append(1)
+        raise OSError("read-only cache")
+
+    monkeypatch.setattr(reference_index, 'load_reference_index', failing_load)
+    monkeypatch.setattr(ai_perplexity_detectgpt, '_REFERENCE_CACHE', {'reference': 'fallback'})
+    assert ai_perplexity_detectgpt._load_reference() == 'fallback'
+    assert ai_perplexity_detectgpt._load_reference() == 'fallback'
+    assert len(calls) == 1
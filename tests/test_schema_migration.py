@@ -0,0 +1,32 @@
+import os
+import shutil
+
+import pytest
+from sqlalchemy import create_engine, inspect
+
+import app  # noqa: F401  (configures db before the models are imported)
+import models
+
+LEGACY_DB = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'instance', 'acadcheck.db')
+
+
+@pytest.mark.skipif(not os.path.exists(LEGACY_DB), reason="no committed database")
+def test_legacy_database_gets_new_columns(tmp_path):
+    path = tmp_path / 'legacy.db'
+    shutil.copy(LEGACY_DB, path)
+    engine = create_engine(f'sqlite:///{path}')
+
+    added = models.add_missing_columns(engine)
+    assert 'documents.content_hash' in added
+    assert models.add_missing_columns(engine) == []  # idempotent
+
+    inspector = inspect(engine)
+    for table in models.db.metadata.sorted_tables:
+        if table.name in inspector.get_table_names():
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            assert {column.name for column in table.columns} <= existing, table.name
+
+    with engine.connect() as conn:
+        # Same query shape as the history page
+        conn.execute(models.db.select(models.Document)).all()
+        conn.execute(models.db.select(models.HighlightedSentence)).all()
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+from scipy import sparse
+
+from sparse_topk import blockwise_topk, max_similarities
+
+
+def _random_rows(rng, count, columns=60, density=0.1):
+    matrix = sparse.random(count, columns, density=density, format='lil', random_state=rng, dtype=np.float32)
+    matrix[0] = 0   # a row with no terms
+    return matrix.tocsr()
+
+
+def _dense_cosine(queries, references):
+    q = queries.toarray()
+    r = references.toarray()
+    q_norms = np.linalg.norm(q, axis=1, keepdims=True)
+    r_norms = np.linalg.norm(r, axis=1, keepdims=True)
+    q = np.divide(q, q_norms, out=np.zeros_like(q), where=q_norms > 0)
+    r = np.divide(r, r_norms, out=np.zeros_like(r), where=r_norms > 0)
+    return q @ r.T
+
+
+@pytest.mark.parametrize('block_rows,workers', [(8192, 1), (7, 1), (7, 3)])
+def test_topk_matches_dense_cosine(block_rows, workers):
+    rng = np.random.RandomState(0)
+    queries, references = _random_rows(rng, 25), _random_rows(rng, 50)
+    excluded = np.array([3, 3, 10, 49])
+    dense = _dense_cosine(queries, references)
+    dense[:, excluded] = -np.inf
+
+    scores, rows = blockwise_topk(queries, references, k=4, excluded_rows=excluded,
+                                  block_rows=block_rows, workers=workers)
+    expected = -np.sort(-dense, axis=1)[:, :4]
+    np.testing.assert_allclose(scores, np.where(np.isfinite(expected), expected, 0), atol=1e-5)
+    for query, (query_scores, query_rows) in enumerate(zip(scores, rows)):
+        assert not set(query_rows.tolist()) & set(excluded.tolist())
+        np.testing.assert_allclose(dense[query, query_rows], query_scores, atol=1e-5)
+
+    np.testing.assert_allclose(max_similarities(queries, references, excluded, block_rows, workers),
+                               scores[:, 0], atol=1e-6)
+
+
+def test_fewer_references_than_k():
+    rng = np.random.RandomState(1)
+    queries, references = _random_rows(rng, 5), _random_rows(rng, 3)
+    scores, rows = blockwise_topk(queries, references, k=5, excluded_rows=np.array([1]))
+    assert scores.shape == rows.shape == (5, 5)
+    assert (rows[:, 2:] == -1).all() and (scores[:, 2:] == 0).all()
+
+    empty_scores, empty_rows = blockwise_topk(queries, references[:0], k=2)
+    assert (empty_scores == 0).all() and (empty_rows == -1).all()
@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+
+import chunked_analysis
+from sentence_bert_detection import SentenceBertDetectionService
+from timeout_optimization import AnalysisDeadline, DeadlineExceeded, safe_analysis_wrapper
+from conftest import ESSAY_SENTENCES
+
+TEXT = ' '.join(ESSAY_SENTENCES)
+
+
+class CountdownDeadline(AnalysisDeadline):
+    """Expires after a fixed number of checks instead of a wall-clock budget"""
+
+    def __init__(self, checks):
+        super().__init__(3600)
+        self.checks = checks
+
+    def expired(self):
+        self.checks -= 1
+        return self.checks < 0
+
+
+@pytest.fixture
+def service():
+    return SentenceBertDetectionService()
+
+
+def test_levenshtein_stops_inside_the_stage(service):
+    deadline = CountdownDeadline(2)
+    with pytest.raises(DeadlineExceeded):
+        service._levenshtein_candidates(TEXT.lower().split(), [TEXT] * 10, deadline)
+    assert deadline.checks == -1
+
+
+
+class _RecordingIndex:
+    """Stands in for IVFIndex / TfidfDocumentIndex and records the calls it receives"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def search(self, queries, k=5):
+        self.calls += 1
+        return [[] for _ in range(len(queries))]
+
+    def query(self, text, min_similarity=0.0):
+        self.calls += 1
+        return []
+
+
+def test_sentence_index_checks_the_deadline_between_batches(service, monkeypatch):
+    import sentence_bert_detection
+    monkeypatch.setattr(sentence_bert_detection, 'SENTENCE_INDEX_BATCH', 2)
+    index = _RecordingIndex()
+    monkeypatch.setattr(service, 'sentence_index', index)
+    embeddings = np.eye(10, dtype=np.float32)
+
+    with pytest.raises(DeadlineExceeded):
+        service._detect_with_sentence_index(embeddings, deadline=CountdownDeadline(2))
+    assert index.calls == 2
+    assert service._detect_with_sentence_index(embeddings)['score'] == 0
+
+
+def test_document_vectors_query_respects_the_deadline(service, monkeypatch):
+    index = _RecordingIndex()
+    monkeypatch.setattr(service, 'document_vectors', index)
+    with pytest.raises(DeadlineExceeded):
+        service._detect_with_tfidf_cosine(TEXT, CountdownDeadline(0))
+    assert index.calls == 0
+
+def test_overrunning_stage_gives_partial_result(service, monkeypatch):
+    def slow_levenshtein(text, deadline=None):
+        raise DeadlineExceeded('levenshtein')
+    monkeypatch.setattr(service, '_detect_with_levenshtein', slow_levenshtein)
+
+    result = service.detect_plagiarism_and_ai(TEXT, 'essay.txt', deadline=AnalysisDeadline(3600))
+    assert result['partial'] is True
+    assert result['stages_completed'] == ['sentence_bert', 'tfidf']
+
+
+def test_no_completed_stage_falls_back(service):
+    result = safe_analysis_wrapper(service.detect_plagiarism_and_ai, TEXT, 'essay.txt', max_seconds=0)
+    assert result['method'] == 'timeout_fallback'
+    assert result['partial'] is True
+
+
+def test_partial_chunked_analysis_without_deadline(monkeypatch):
+    # A model pass that yields no tokens makes the analysis partial even without a deadline
+    monkeypatch.setattr(chunked_analysis, '_window_token_losses',
+                        lambda *args, **kwargs: (np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)))
+    result = chunked_analysis.analyze_text_chunked(TEXT, model=object(), tokenizer=object())
+    assert result['partial'] is True
+    assert result['stages']['perplexity'] == 0.0
@@ -0,0 +1,57 @@
+import random
+import threading
+
+import numpy as np
+
+from token_vocab import HASH_BASE, HASH_MODULUS, TokenVocabulary, ngram_hashes, token_hash
+
+
+def _naive_ngram_hashes(token_hashes, n):
+    return [sum(int(h) * pow(HASH_BASE, n - 1 - j, HASH_MODULUS) for j, h in enumerate(token_hashes[i:i + n]))
+            % HASH_MODULUS for i in range(len(token_hashes) - n + 1)]
+
+
+def test_ngram_hashes_match_exact_arithmetic():
+    rng = random.Random(0)
+    # Values near the modulus exercise the 64-bit overflow handling
+    extremes = [HASH_MODULUS - 1, HASH_MODULUS - 2, 0, 1, (1 << 60) + 12345]
+    hashes = extremes + [rng.randrange(HASH_MODULUS) for _ in range(200)]
+    for n in range(1, 8):
+        assert ngram_hashes(np.array(hashes, dtype=np.uint64), n).tolist() == _naive_ngram_hashes(hashes, n)
+    assert len(ngram_hashes(np.array(hashes[:3], dtype=np.uint64), 4)) == 0
+    assert len(ngram_hashes(np.array(hashes, dtype=np.uint64), 0)) == 0
+
+
+def test_vocabulary_interning():
+    vocabulary = TokenVocabulary()
+    words = "the mill the workers of the mill".split()
+    ids = vocabulary.encode(words)
+    assert list(ids) == [0, 1, 0, 2, 3, 0, 1]
+    assert vocabulary.forms(ids) == words
+    hashes = [token_hash(word) for word in words]
+    assert vocabulary.hashes(ids).tolist() == hashes
+    assert vocabulary.ngram_range_hashes(ids, 1, 2).tolist() == \
+        _naive_ngram_hashes(hashes, 1) + _naive_ngram_hashes(hashes, 2)
+
+
+def test_concurrent_interning_keeps_ids_consistent():
+    vocabulary = TokenVocabulary()
+    forms = [f"word{i}" for i in range(5000)]   # grows the hash array several times
+    results = []
+
+    def worker(seed):
+        shuffled = list(forms)
+        random.Random(seed).shuffle(shuffled)
+        results.append(dict(zip(shuffled, vocabulary.encode(shuffled))))
+
+    threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(vocabulary) == len(forms)
+    assert all(result == results[0] for result in results)
+    ids = [results[0][form] for form in forms]
+    assert vocabulary.forms(ids) == forms
+    assert vocabulary.hashes(ids).tolist() == [token_hash(form) for form in forms]
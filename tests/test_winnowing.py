@@ -0,0 +1,117 @@
+import sqlite3
+
+from winnowing import WinnowingIndex, submission_key, submission_title
+from passage_alignment import align_passages
+
+ESSAY = ("The industrial revolution transformed the economic structure of northern England, "
+         "moving labour from agricultural estates into the rapidly expanding textile mills of "
+         "Manchester and Leeds, where working conditions remained harsh for several decades.")
+
+
+def _index(tmp_path):
+    return WinnowingIndex(str(tmp_path / 'winnowing.db'))
+
+
+def _add_submission(index, document_id, user_id, uploaded_at, text=ESSAY):
+    index.add_document(submission_key(document_id), text, title=submission_title(document_id, uploaded_at),
+                       user_id=user_id, uploaded_at=uploaded_at)
+
+
+def test_own_earlier_draft_is_not_a_source(tmp_path):
+    index = _index(tmp_path)
+    _add_submission(index, 1, 'alice', '2026-03-01T10:00:00')
+
+    draft = ESSAY + " A revised conclusion follows."
+    assert index.find_seeds(draft, user_id='alice', uploaded_before='2026-03-08T10:00:00') == {}
+    assert align_passages(draft, index, user_id='alice', uploaded_before='2026-03-08T10:00:00') == []
+    # Another student's copy of the same essay is reported
+    assert align_passages(draft, index, user_id='bob', uploaded_before='2026-03-08T10:00:00')
+
+
+def test_later_submissions_are_not_sources(tmp_path):
+    index = _index(tmp_path)
+    _add_submission(index, 2, 'bob', '2026-03-10T09:00:00')
+    assert index.find_seeds(ESSAY, user_id='alice', uploaded_before='2026-03-01T10:00:00') == {}
+    assert index.find_seeds(ESSAY, user_id='alice', uploaded_before='2026-03-11T10:00:00')
+
+
+def test_reference_documents_are_never_excluded(tmp_path):
+    index = _index(tmp_path)
+    index.add_document('reference:history.txt', ESSAY, title='history.txt')
+    passages = align_passages(ESSAY, index, user_id='alice', uploaded_before='2000-01-01T00:00:00')
+    assert [passage.title for passage in passages] == ['history.txt']
+
+
+def test_submission_titles_are_anonymous(tmp_path):
+    index = _index(tmp_path)
+    _add_submission(index, 7, 'bob', '2026-03-10T09:00:00')
+    passages = align_passages(ESSAY, index, user_id='alice', uploaded_before='2026-04-01T00:00:00')
+    assert {passage.title for passage in passages} == {'Prior submission #7, 2026-03-10'}
+
+
+def _counts(index):
+    with sqlite3.connect(index.db_path) as conn:
+        stored = dict(conn.execute('SELECT hash, documents FROM wn_hash_counts'))
+        expected = dict(conn.execute('SELECT hash, COUNT(DISTINCT document_id) FROM wn_fingerprints GROUP BY hash'))
+    return stored, expected
+
+
+def test_hash_counts_follow_adds_and_removals(tmp_path):
+    index = _index(tmp_path)
+    index.add_document('reference:a.txt', ESSAY)
+    index.add_document('reference:b.txt', ESSAY + ' ' + ESSAY)   # repeated passage: still one document
+    index.add_document('reference:a.txt', ESSAY.upper() + " Revised.")   # re-indexed
+    stored, expected = _counts(index)
+    assert stored == expected and max(stored.values()) == 2
+
+    index.remove_document('reference:b.txt')
+    index.remove_document('reference:a.txt')
+    assert _counts(index) == ({}, {})
+
+
+def test_common_fingerprints_are_skipped_by_document_count(tmp_path, monkeypatch):
+    import winnowing
+    monkeypatch.setattr(winnowing, 'MAX_POSTINGS', 2)
+    index = _index(tmp_path)
+    index.add_document('reference:a.txt', ' '.join([ESSAY] * 5))
+    index.add_document('reference:b.txt', ESSAY)
+    assert len(index.find_seeds(ESSAY)) == 2
+    index.add_document('reference:c.txt', ESSAY)
+    assert index.find_seeds(ESSAY) == {}
+
+
+def test_sync_removes_deleted_reference_files(tmp_path):
+    from winnowing import sync_reference_corpus
+    reference_dir = tmp_path / 'reference_corpus'
+    reference_dir.mkdir()
+    (reference_dir / 'history.txt').write_text(ESSAY, encoding='utf-8')
+    (reference_dir / 'other.txt').write_text("A completely different text about marine biology and coral reefs "
+                                             "in the warm waters of the Pacific ocean near Fiji.", encoding='utf-8')
+    index = _index(tmp_path)
+    _add_submission(index, 3, 'bob', '2026-03-10T09:00:00', text="Unrelated submission text about chemistry.")
+    assert sync_reference_corpus(index, str(reference_dir)) == 2
+
+    (reference_dir / 'history.txt').unlink()
+    assert sync_reference_corpus(index, str(reference_dir)) == 0
+    assert sorted(index.document_keys()) == ['reference:other.txt', submission_key(3)]
+    assert index.find_seeds(ESSAY) == {}
+    stored, expected = _counts(index)
+    assert stored == expected
+
+
+def test_shared_index_picks_up_new_reference_files(tmp_path, monkeypatch):
+    import reference_index
+    import winnowing
+
+    reference_dir = tmp_path / 'corpus'
+    reference_dir.mkdir()
+    monkeypatch.setattr(reference_index, 'REFERENCE_DIR', str(reference_dir))
+    monkeypatch.setattr(winnowing, '_winnowing_index', None)
+    monkeypatch.setattr(winnowing, '_reference_state', {'checked_at': None, 'corpus': None})
+    assert winnowing.get_winnowing_index().find_seeds(ESSAY) == {}
+
+    (reference_dir / 'history.txt').write_text(ESSAY, encoding='utf-8')
+    # Within the check interval the corpus is not looked at again
+    assert winnowing.get_winnowing_index().find_seeds(ESSAY) == {}
+    monkeypatch.setattr(reference_index, 'CHECK_INTERVAL_SECONDS', 0)
+    assert winnowing.get_winnowing_index().document_keys('reference:') == ['reference:history.txt']
@@ -0,0 +1,185 @@
+"""
+Segmentation unique d'un document : paragraphes, phrases et tokens.
+
+Chaque détecteur redécoupait le texte avec sa propre expression régulière,
+puis les surligneurs retrouvaient les positions par document_text.find(),
+en O(n·m) et faux dès qu'une phrase est répétée. segment_document() découpe
+le texte une fois et renvoie un SegmentedDocument immuable :
+
+- paragraphes, phrases et tokens sous forme de tableaux de positions
+  (début, fin) dans le texte d'origine ;
+- pour chaque phrase, l'intervalle de ses tokens (sentence_token_starts /
+  sentence_token_ends) ;
+- l'identifiant de chaque token dans le vocabulaire interné partagé
+  (token_vocab), dont les formes sont normalisées (NFKC, minuscules).
+
+Les phrases suivent la règle historique de preprocess_text (coupure après
+. ! ? suivi d'espaces, bords sans espaces) : les scores TF-IDF et l'index
+de référence restent comparables. Les derniers documents segmentés sont
+gardés en cache, pour que tous les détecteurs d'une même analyse partagent
+le même objet.
+"""
+import re
+import threading
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from token_vocab import get_token_vocabulary
+
+_SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+')
+_PARAGRAPH_BOUNDARY = re.compile(r'\n\s*\n')
+_TOKEN_PATTERN = re.compile(r'\w+')
+
+_SEGMENT_CACHE = OrderedDict()
+_SEGMENT_CACHE_LOCK = threading.Lock()
+SEGMENT_CACHE_SIZE = 8
+
+
+def normalize_token(token: str) -> str:
+    """Forme normalisée d'un token (NFKC, minuscules)"""
+    return unicodedata.normalize('NFKC', token).lower()
+
+
+def text_token_ids(text: str) -> array:
+    """Identifiants internés des tokens d'un court texte, sans segmentation en phrases ni cache"""
+    return get_token_vocabulary().encode(normalize_token(token) for token in _TOKEN_PATTERN.findall(text or ""))
+
+
+def strip_span(text: str, start: int, end: int) -> Optional[Tuple[int, int]]:
+    """(début, fin) sans espaces de bord, ou None si le segment est vide"""
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return (start, end) if end > start else None
+
+
+def _boundary_spans(text: str, boundary) -> Iterator[Tuple[int, int]]:
+    """Segments entre les séparateurs, sans espaces de bord"""
+    pos = 0
+    for match in boundary.finditer(text):
+        span = strip_span(text, pos, match.start())
+        if span:
+            yield span
+        pos = match.end()
+    span = strip_span(text, pos, len(text))
+    if span:
+        yield span
+
+
+def _frozen(values, dtype) -> np.ndarray:
+    array = np.asarray(values, dtype=dtype)
+    array.flags.writeable = False
+    return array
+
+
+def _span_arrays(spans: List[Tuple[int, int]]) -> Tuple[np.ndarray, np.ndarray]:
+    spans = np.asarray(spans, dtype=np.int64).reshape(-1, 2)
+    return _frozen(spans[:, 0], np.int64), _frozen(spans[:, 1], np.int64)
+
+
+class SegmentedDocument:
+    """Document découpé une fois pour toutes (tableaux de positions en lecture seule)"""
+
+    __slots__ = ('text', 'paragraph_starts', 'paragraph_ends', 'sentence_starts', 'sentence_ends',
+                 'sentence_token_starts', 'sentence_token_ends', 'token_starts', 'token_ends',
+                 'token_ids')
+
+    def __init__(self, text: str):
+        text = text or ""
+        setattr_ = object.__setattr__
+        setattr_(self, 'text', text)
+
+        paragraph_starts, paragraph_ends = _span_arrays(list(_boundary_spans(text, _PARAGRAPH_BOUNDARY)))
+        setattr_(self, 'paragraph_starts', paragraph_starts)
+        setattr_(self, 'paragraph_ends', paragraph_ends)
+        sentence_starts, sentence_ends = _span_arrays(list(_boundary_spans(text, _SENTENCE_BOUNDARY)))
+        setattr_(self, 'sentence_starts', sentence_starts)
+        setattr_(self, 'sentence_ends', sentence_ends)
+
+        starts, ends, forms = [], [], []
+        for match in _TOKEN_PATTERN.finditer(text):
+            forms.append(normalize_token(match.group()))
+            starts.append(match.start())
+            ends.append(match.end())
+        setattr_(self, 'token_starts', _frozen(starts, np.int64))
+        setattr_(self, 'token_ends', _frozen(ends, np.int64))
+        setattr_(self, 'token_ids', _frozen(np.frombuffer(get_token_vocabulary().encode(forms), dtype=np.uint32),
+                                            np.uint32))
+
+        # Tokens d'une phrase : ceux qui commencent dans ses bornes
+        setattr_(self, 'sentence_token_starts',
+                 _frozen(np.searchsorted(self.token_starts, sentence_starts, 'left'), np.int64))
+        setattr_(self, 'sentence_token_ends',
+                 _frozen(np.searchsorted(self.token_starts, sentence_ends, 'left'), np.int64))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("SegmentedDocument est immuable")
+
+    def __len__(self):
+        return len(self.sentence_starts)
+
+    # --- Phrases ---
+
+    def sentence_spans(self, min_length: int = 0) -> List[Tuple[int, int]]:
+        """(début, fin) des phrases de plus de min_length caractères"""
+        keep = (self.sentence_ends - self.sentence_starts) > min_length
+        return list(zip(self.sentence_starts[keep].tolist(), self.sentence_ends[keep].tolist()))
+
+    def sentences(self, min_length: int = 0) -> List[str]:
+        """Texte des phrases de plus de min_length caractères"""
+        return [self.text[start:end] for start, end in self.sentence_spans(min_length)]
+
+    def sentence_tokens(self, index: int) -> List[str]:
+        """Formes normalisées des tokens de la phrase index"""
+        ids = self.token_ids[self.sentence_token_starts[index]:self.sentence_token_ends[index]]
+        return get_token_vocabulary().forms(ids)
+
+    def sentence_at(self, offset: int) -> int:
+        """Indice de la phrase contenant la position offset, ou -1"""
+        index = int(np.searchsorted(self.sentence_starts, offset, 'right')) - 1
+        if index >= 0 and offset < self.sentence_ends[index]:
+            return index
+        return -1
+
+    # --- Paragraphes ---
+
+    def paragraph_spans(self) -> List[Tuple[int, int]]:
+        return list(zip(self.paragraph_starts.tolist(), self.paragraph_ends.tolist()))
+
+    def paragraphs(self) -> List[str]:
+        return [self.text[start:end] for start, end in self.paragraph_spans()]
+
+    # --- Tokens ---
+
+    def tokens(self) -> List[str]:
+        """Formes normalisées de tous les tokens"""
+        return get_token_vocabulary().forms(self.token_ids)
+
+    def token_spans(self) -> List[Tuple[str, int, int]]:
+        """(forme normalisée, début, fin) de chaque token"""
+        return list(zip(self.tokens(), self.token_starts.tolist(), self.token_ends.tolist()))
+
+    def ngram_hashes(self, n: int) -> np.ndarray:
+        """Hachages (uint64) des n-grammes de tokens, dans l'ordre du texte"""
+        return get_token_vocabulary().ngram_hashes(self.token_ids, n)
+
+
+def segment_document(text: str) -> SegmentedDocument:
+    """Segmentation du texte, partagée entre les détecteurs (cache des derniers documents)"""
+    text = text or ""
+    with _SEGMENT_CACHE_LOCK:
+        document = _SEGMENT_CACHE.get(text)
+        if document is not None:
+            _SEGMENT_CACHE.move_to_end(text)
+            return document
+    document = SegmentedDocument(text)
+    with _SEGMENT_CACHE_LOCK:
+        _SEGMENT_CACHE[text] = document
+        if len(_SEGMENT_CACHE) > SEGMENT_CACHE_SIZE:
+            _SEGMENT_CACHE.popitem(last=False)
+    return document
@@ -1,106 +1,83 @@
 """
 Optimisation pour éviter les timeouts sur gros documents
-Compatible Windows et Unix/Linux
+Échéance coopérative, sans signal : compatible Windows, Unix/Linux et
+workers multi-threads (gunicorn --threads)
 """
-import signal
 import logging
-import platform
-import threading
 import time
-from typing import Dict, Any, Callable
+from typing import Dict, Any, Callable, Optional
 
-class TimeoutOptimizer:
-    """Gestionnaire de timeout pour éviter les blocages - Compatible multiplateforme"""
+class DeadlineExceeded(TimeoutError):
+    """Levée par AnalysisDeadline.check() quand le budget de temps est épuisé"""
     
-    def __init__(self, max_seconds: int = 25):
-        self.max_seconds = max_seconds
-        self.original_handler = None
-        self.is_windows = platform.system() == 'Windows'
-        self.timer = None
-        self.timeout_occurred = False
-    
-    def timeout_handler(self, signum=None, frame=None):
-        """Handler appelé en cas de timeout"""
-        self.timeout_occurred = True
-        raise TimeoutError(f"Opération interrompue après {self.max_seconds}s")
-    
-    def _windows_timeout_handler(self):
-        """Handler de timeout pour Windows utilisant threading"""
-        time.sleep(self.max_seconds)
-        if not self.timeout_occurred:
-            self.timeout_handler()
+    def __init__(self, stage: Optional[str] = None):
+        self.stage = stage
+        super().__init__(f"Échéance dépassée pendant l'étape '{stage}'" if stage else "Échéance dépassée")
+
+class AnalysisDeadline:
+    """
+    Échéance explicite transmise à chaque étape de l'analyse.
     
-    def __enter__(self):
-        """Démarrer le timeout"""
-        self.timeout_occurred = False
-        
-        if self.is_windows:
-            # Sur Windows, utiliser un timer thread
-            self.timer = threading.Timer(self.max_seconds, self._windows_timeout_handler)
-            self.timer.daemon = True
-            self.timer.start()
-        else:
-            # Sur Unix/Linux, utiliser signal.SIGALRM
-            try:
-                self.original_handler = signal.signal(signal.SIGALRM, self.timeout_handler)
-                signal.alarm(self.max_seconds)
-            except AttributeError:
-                # Fallback si SIGALRM n'est pas disponible
-                self.timer = threading.Timer(self.max_seconds, self._windows_timeout_handler)
-                self.timer.daemon = True
-                self.timer.start()
-        
-        return self
+    Chaque étape (segmentation, TF-IDF, fenêtres de perplexité)
+    consulte expired() entre deux unités de travail et s'arrête proprement,
+    ce qui permet de renvoyer les résultats déjà calculés. Les boucles
+    internes d'une étape qui ne peut pas rendre de résultat partiel appellent
+    check() : DeadlineExceeded interrompt l'étape en cours. Basée sur
+    time.monotonic(), elle fonctionne depuis n'importe quel thread.
+    """
     
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        """Arrêter le timeout"""
-        self.timeout_occurred = True
-        
-        if self.is_windows or not hasattr(signal, 'SIGALRM'):
-            # Annuler le timer sur Windows ou si SIGALRM n'existe pas
-            if self.timer and self.timer.is_alive():
-                self.timer.cancel()
-        else:
-            # Annuler l'alarme sur Unix/Linux
-            signal.alarm(0)
-            if self.original_handler:
-                signal.signal(signal.SIGALRM, self.original_handler)
-
-def optimize_text_for_analysis(text: str, max_length: int = 3000) -> str:
-    """Optimise un texte pour l'analyse en conservant le sens"""
-    if len(text) <= max_length:
-        return text
+    def __init__(self, max_seconds: Optional[float] = None):
+        self.max_seconds = max_seconds
+        self.started_at = time.monotonic()
+        self.expires_at = None if max_seconds is None else self.started_at + max_seconds
     
-    logging.info(f"📄 Optimisation texte : {len(text)} → {max_length} caractères")
+    def remaining(self) -> float:
+        """Secondes restantes (infini si pas d'échéance)"""
+        if self.expires_at is None:
+            return float('inf')
+        return max(0.0, self.expires_at - time.monotonic())
     
-    # Stratégie : début + milieu + fin pour préserver la structure
-    third = max_length // 3
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
     
-    start = text[:third]
-    middle_pos = len(text) // 2
-    middle = text[middle_pos - third//2:middle_pos + third//2]
-    end = text[-third:]
+    def expired(self) -> bool:
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
     
-    optimized = start + " [...] " + middle + " [...] " + end
-    return optimized[:max_length]
+    def check(self, stage: Optional[str] = None):
+        """Lève DeadlineExceeded si l'échéance est passée"""
+        if self.expired():
+            raise DeadlineExceeded(stage)
+
+def deadline_expired(deadline: Optional[AnalysisDeadline]) -> bool:
+    """Raccourci pour les étapes dont l'échéance est optionnelle"""
+    return deadline is not None and deadline.expired()
+
+def check_deadline(deadline: Optional[AnalysisDeadline], stage: Optional[str] = None):
+    """check() pour les boucles dont l'échéance est optionnelle"""
+    if deadline is not None:
+        deadline.check(stage)
 
-def safe_analysis_wrapper(analysis_func: Callable, text: str, *args, **kwargs) -> Dict[str, Any]:
-    """Wrapper sécurisé pour les analyses avec timeout - Compatible Windows"""
+def safe_analysis_wrapper(analysis_func: Callable, text: str, *args, max_seconds: float = 25, **kwargs) -> Dict[str, Any]:
+    """
+    Wrapper sécurisé pour les analyses avec échéance coopérative.
+    
+    analysis_func reçoit un paramètre deadline et renvoie elle-même un résultat
+    partiel (partial=True, coverage) quand le temps est écoulé; elle laisse
+    passer DeadlineExceeded quand aucune étape n'a pu aboutir.
+    """
+    deadline = AnalysisDeadline(max_seconds)
     try:
-        # Optimiser le texte d'abord
-        optimized_text = optimize_text_for_analysis(text)
-        
-        # Exécuter avec timeout (compatible Windows/Linux)
-        with TimeoutOptimizer(25):  # 25 secondes max
-            return analysis_func(optimized_text, *args, **kwargs)
+        return analysis_func(text, *args, deadline=deadline, **kwargs)
     
-    except TimeoutError:
-        logging.warning("⏰ Timeout détecté - analyse simplifiée")
+    except DeadlineExceeded as e:
+        logging.warning(f"⏰ Échéance atteinte sans résultat partiel exploitable: {e}")
         return {
             'plagiarism_percentage': 0,
             'ai_probability': 0,
             'sources_found': 0,
             'method': 'timeout_fallback',
+            'partial': True,
+            'coverage': 0.0,
             'error': 'Document trop volumineux - analyse partielle'
         }
     except Exception as e:
@@ -111,4 +88,4 @@ def safe_analysis_wrapper(analysis_func: Callable, text: str, *args, **kwargs) -
             'sources_found': 0,
             'method': 'error_fallback',
             'error': str(e)
-        }
\ No newline at end of file
+        }
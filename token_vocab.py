@@ -0,0 +1,130 @@
+"""
+Vocabulaire de tokens interné et hachages de n-grammes sans chaînes.
+
+Les détecteurs construisaient leurs n-grammes en joignant des mots
+(' '.join(words[i:i+n])) : des millions de petites chaînes éphémères pour
+une thèse. Ici chaque forme normalisée reçoit une fois pour toutes un
+identifiant entier (tableaux array('I') / numpy uint32) et un hachage stable
+sur 61 bits (blake2b, identique d'un processus à l'autre). Un n-gramme est
+représenté par le hachage polynomial (Rabin-Karp) des hachages de ses
+tokens, modulo 2^61 - 1 : ce sont exactement les valeurs des empreintes
+winnowing, qui tiennent dans un INTEGER SQLite. ngram_hashes les calcule
+pour tout un document en n passes vectorisées, sans objet Python par
+n-gramme.
+
+TurnitinStyleDetector, ManualTfIdf, winnowing et SegmentedDocument
+partagent le même vocabulaire (get_token_vocabulary).
+"""
+import hashlib
+import threading
+from array import array
+from typing import Iterable, List
+
+import numpy as np
+
+HASH_MODULUS = (1 << 61) - 1   # tient dans un INTEGER SQLite (64 bits signés)
+HASH_BASE = 1000003
+
+_MODULUS = np.uint64(HASH_MODULUS)
+_BASE = np.uint64(HASH_BASE)
+_LOW_32 = np.uint64((1 << 32) - 1)
+_LOW_29 = np.uint64((1 << 29) - 1)
+
+_VOCABULARY_CACHE = {}
+
+
+def token_hash(form: str) -> int:
+    """Hachage stable d'une forme normalisée (hash() de Python est randomisé)"""
+    return int.from_bytes(hashlib.blake2b(form.encode('utf-8'), digest_size=8).digest(), 'big') % HASH_MODULUS
+
+
+def _reduce(values: np.ndarray) -> np.ndarray:
+    """values mod 2^61 - 1, pour des valeurs < 2^63"""
+    values = (values & _MODULUS) + (values >> np.uint64(61))
+    return np.where(values >= _MODULUS, values - _MODULUS, values)
+
+
+def _times_base(values: np.ndarray) -> np.ndarray:
+    """values * HASH_BASE mod 2^61 - 1 sans dépasser 64 bits"""
+    high = (values >> np.uint64(32)) * _BASE   # < 2^49
+    # high * 2^32 mod 2^61 - 1 : les bits au-delà du 61e reviennent en bas
+    shifted = (high >> np.uint64(29)) + ((high & _LOW_29) << np.uint64(32))
+    return _reduce(shifted + (values & _LOW_32) * _BASE)
+
+
+def ngram_hashes(token_hashes: np.ndarray, n: int) -> np.ndarray:
+    """
+    Hachage de chaque n-gramme (uint64) à partir des hachages des tokens :
+    sum(h[i + j] * HASH_BASE^(n - 1 - j)) mod 2^61 - 1.
+    """
+    token_hashes = np.asarray(token_hashes, dtype=np.uint64)
+    count = len(token_hashes) - n + 1
+    if n <= 0 or count <= 0:
+        return np.zeros(0, dtype=np.uint64)
+    hashes = token_hashes[:count].copy()
+    for offset in range(1, n):
+        hashes = _reduce(_times_base(hashes) + token_hashes[offset:offset + count])
+    return hashes
+
+
+class TokenVocabulary:
+    """Formes normalisées internées : identifiant entier et hachage stable de chaque forme"""
+
+    def __init__(self):
+        self._ids = {}
+        self._forms = []
+        self._hashes = np.zeros(1024, dtype=np.uint64)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._forms)
+
+    def intern(self, form: str) -> int:
+        token_id = self._ids.get(form)
+        if token_id is not None:
+            return token_id
+        with self._lock:
+            token_id = self._ids.get(form)
+            if token_id is None:
+                token_id = len(self._forms)
+                if token_id == len(self._hashes):
+                    # Nouveau tableau : les lecteurs gardent l'ancien, déjà complet
+                    hashes = np.zeros(2 * len(self._hashes), dtype=np.uint64)
+                    hashes[:token_id] = self._hashes
+                    self._hashes = hashes
+                self._hashes[token_id] = token_hash(form)
+                self._forms.append(form)
+                self._ids[form] = token_id  # publié en dernier
+            return token_id
+
+    def encode(self, forms: Iterable[str]) -> array:
+        """Identifiants des formes, dans un array('I')"""
+        ids = self._ids
+        intern = self.intern
+        return array('I', [ids[form] if form in ids else intern(form) for form in forms])
+
+    def forms(self, token_ids) -> List[str]:
+        forms = self._forms
+        return [forms[token_id] for token_id in np.asarray(token_ids, dtype=np.int64).tolist()]
+
+    def hashes(self, token_ids) -> np.ndarray:
+        """Hachages stables (uint64) des tokens"""
+        return self._hashes[np.asarray(token_ids, dtype=np.int64)]
+
+    def ngram_hashes(self, token_ids, n: int) -> np.ndarray:
+        return ngram_hashes(self.hashes(token_ids), n)
+
+    def ngram_range_hashes(self, token_ids, min_n: int, max_n: int) -> np.ndarray:
+        """Hachages de tous les n-grammes pour min_n <= n <= max_n, concaténés"""
+        token_hashes = self.hashes(token_ids)
+        return np.concatenate([ngram_hashes(token_hashes, n) for n in range(min_n, max_n + 1)]
+                              + [np.zeros(0, dtype=np.uint64)])
+
+
+def get_token_vocabulary() -> TokenVocabulary:
+    """Vocabulaire partagé par tous les détecteurs du processus"""
+    vocabulary = _VOCABULARY_CACHE.get('vocabulary')
+    if vocabulary is None:
+        # setdefault : un seul vocabulaire même si deux threads arrivent ensemble
+        vocabulary = _VOCABULARY_CACHE.setdefault('vocabulary', TokenVocabulary())
+    return vocabulary
@@ -12,6 +12,7 @@ class Translations:
             'dashboard': 'Tableau de bord',
             'upload': 'Télécharger',
             'reports': 'Rapports',
+            'cohorts': 'Cohortes',
             'settings': 'Paramètres',
             'logout': 'Déconnexion',
             'login': 'Connexion',
@@ -175,6 +176,7 @@ class Translations:
             'dashboard': 'Dashboard', 
             'upload': 'Upload',
             'reports': 'Reports',
+            'cohorts': 'Cohorts',
             'settings': 'Settings',
             'logout': 'Logout',
             'login': 'Login',
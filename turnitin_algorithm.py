@@ -10,9 +10,12 @@ from collections import Counter, defaultdict
 from typing import List, Dict, Tuple, Optional
 import logging
 from difflib import SequenceMatcher
-import hashlib
 import time
 
+import numpy as np
+
+from text_segmentation import segment_document
+
 class TurnitinStyleDetector:
     def __init__(self):
         self.min_match_length = 8  # Minimum de mots consécutifs pour considérer une correspondance
@@ -39,13 +42,17 @@ class TurnitinStyleDetector:
             cleaned_text = self._preprocess_text(text)
             
             # Génération de signatures et n-grammes
-            ngrams = self._generate_ngrams(cleaned_text, n=5)
-            fingerprints = self._generate_fingerprints(cleaned_text)
+            ngrams = self._generate_ngrams(text, n=5)
+            fingerprints = self._generate_fingerprints(text)
             
             # Recherche de correspondances
             matches = []
             total_matched_chars = 0
             
+            # Passages retrouvés dans les documents indexés (winnowing)
+            stored_matches = self._check_stored_sources(text)
+            matches.extend(stored_matches)
+            
             # Vérification contre sources web connues
             web_matches = self._check_web_sources(cleaned_text)
             matches.extend(web_matches)
@@ -99,6 +106,13 @@ class TurnitinStyleDetector:
                 else:
                     plagiarism_percent = min(25.0, max(15.0, len(text) / 50))
             
+            # Les passages réellement retrouvés ne sont jamais minorés par la calibration
+            if stored_matches:
+                from winnowing import matched_length
+                all_spans = [span for match in stored_matches for span in match['spans']]
+                verified_percent = matched_length(all_spans) * 100.0 / max(1, len(text))
+                plagiarism_percent = max(plagiarism_percent, min(100.0, verified_percent))
+            
             # Calculer le score d'IA séparément
             ai_score = self._calculate_ai_score(cleaned_text, matches)
             
@@ -131,32 +145,44 @@ class TurnitinStyleDetector:
         text = re.sub(r'\s+', ' ', text).strip()
         return text
     
-    def _generate_ngrams(self, text: str, n: int = 5) -> List[str]:
-        """Génère des n-grammes pour la détection"""
-        words = text.split()
-        ngrams = []
-        for i in range(len(words) - n + 1):
-            ngram = ' '.join(words[i:i+n])
-            ngrams.append(ngram)
-        return ngrams
+    def _generate_ngrams(self, text: str, n: int = 5) -> np.ndarray:
+        """Hachages des n-grammes de mots (token_vocab), sans chaîne par n-gramme"""
+        return segment_document(text).ngram_hashes(n)
     
     def _generate_fingerprints(self, text: str) -> List[str]:
-        """Génère des empreintes digitales du texte"""
-        sentences = re.split(r'[.!?]+', text)
-        fingerprints = []
+        """Empreintes winnowing du texte (k-grammes de mots, minimum par fenêtre)"""
+        from winnowing import fingerprint
+        return [format(h, '016x') for h, _, _, _ in fingerprint(text)]
+    
+    def _check_stored_sources(self, text: str) -> List[Dict]:
+        """Passages copiés depuis les documents indexés, un résultat par source avec ses passages alignés"""
+        try:
+            from winnowing import get_winnowing_index, matched_length
+            spans = get_winnowing_index().find_matches(text)
+        except Exception as e:
+            logging.error(f"Erreur index winnowing: {e}")
+            return []
         
-        for sentence in sentences:
-            if len(sentence.strip()) > 20:  # Ignorer les phrases trop courtes
-                # Créer une empreinte basée sur la structure
-                words = sentence.strip().split()
-                if len(words) >= 5:
-                    # Empreinte basée sur les 3 premiers et 3 derniers mots
-                    start_words = ' '.join(words[:3])
-                    end_words = ' '.join(words[-3:])
-                    fingerprint = hashlib.md5(f"{start_words}_{end_words}".encode()).hexdigest()[:16]
-                    fingerprints.append(fingerprint)
-        
-        return fingerprints
+        by_source = defaultdict(list)
+        for span in spans:
+            by_source[span['document_id']].append(span)
+        
+        matches = []
+        total_chars = max(1, len(text))
+        for document_id, source_spans in by_source.items():
+            length = matched_length(source_spans)
+            matches.append({
+                'source': source_spans[0]['title'],
+                'source_id': source_spans[0]['doc_key'],
+                'percent': round(min(100.0, length * 100.0 / total_chars), 2),
+                'length': length,
+                'confidence': 'very_high' if length >= 200 else 'high',
+                'type': 'winnowing_match',
+                'spans': [{key: span[key] for key in ('start', 'end', 'source_start', 'source_end', 'tokens')}
+                          for span in source_spans]
+            })
+        matches.sort(key=lambda m: m['length'], reverse=True)
+        return matches
     
     def _check_web_sources(self, text: str) -> List[Dict]:
         """Simule la vérification contre des sources web (version locale)"""
@@ -274,7 +300,7 @@ class TurnitinStyleDetector:
         matches = []
         
         # Phrases très longues (typiques de texte généré ou copié)
-        sentences = re.split(r'[.!?]+', text)
+        sentences = segment_document(text).sentences()
         long_sentences = [s for s in sentences if len(s.split()) > 30]
         
         if len(long_sentences) >= 3:  # Plus restrictif
@@ -313,7 +339,7 @@ class TurnitinStyleDetector:
             return 0
         
         # Calcul de diverses métriques
-        sentences = re.split(r'[.!?]+', text)
+        sentences = segment_document(text).sentences()
         avg_sentence_length = sum(len(s.split()) for s in sentences if s.strip()) / len([s for s in sentences if s.strip()])
         
         # Analyse de la diversité lexicale
@@ -8,6 +8,8 @@ import math
 from collections import Counter
 from typing import Dict, List
 
+from text_segmentation import segment_document
+
 class GPTZeroLikeDetector:
     """Détecteur IA basé sur les principes GPTZero (perplexité + burstiness)"""
     
@@ -34,7 +36,7 @@ class GPTZeroLikeDetector:
     
     def calculate_simple_perplexity(self, text: str) -> float:
         """Calcule une perplexité simplifiée basée sur la prévisibilité des mots"""
-        words = re.findall(r'\b\w+\b', text.lower())
+        words = segment_document(text).tokens()
         if len(words) < 5:
             return 100  # Texte trop court
         
@@ -73,8 +75,7 @@ class GPTZeroLikeDetector:
     def calculate_burstiness(self, text: str) -> float:
         """Calcule la burstiness (variabilité de longueur des phrases)"""
         # Diviser en phrases
-        sentences = re.split(r'[.!?]+', text)
-        sentences = [s.strip() for s in sentences if len(s.strip()) > 3]
+        sentences = segment_document(text).sentences(3)
         
         if len(sentences) < 2:
             return 0
@@ -91,8 +92,7 @@ class GPTZeroLikeDetector:
     
     def analyze_sentence_patterns(self, text: str) -> Dict:
         """Analyse les patterns de phrases typiques IA"""
-        sentences = re.split(r'[.!?]+', text)
-        sentences = [s.strip() for s in sentences if len(s.strip()) > 10]
+        sentences = segment_document(text).sentences(10)
         
         if not sentences:
             return {'uniformity_score': 0, 'avg_complexity': 0}
@@ -128,8 +128,7 @@ class GPTZeroLikeDetector:
     
     def analyze_advanced_ai_patterns(self, text: str) -> Dict:
         """Analyse avancée des patterns IA supplémentaires"""
-        sentences = re.split(r'[.!?]+', text)
-        sentences = [s.strip() for s in sentences if len(s.strip()) > 10]
+        sentences = segment_document(text).sentences(10)
         
         if not sentences:
             return {'coherence_score': 0, 'vocabulary_diversity': 100, 'temporal_consistency': 0}
@@ -174,8 +173,7 @@ class GPTZeroLikeDetector:
     
     def calculate_semantic_coherence(self, text: str) -> float:
         """Calcule la cohérence sémantique (IA = trop cohérent)"""
-        sentences = re.split(r'[.!?]+', text)
-        sentences = [s.strip() for s in sentences if len(s.strip()) > 10]
+        sentences = segment_document(text).sentences(10)
         
         if len(sentences) < 2:
             return 0
@@ -0,0 +1,462 @@
+"""
+Empreintes par winnowing (MOSS) pour la détection de passages copiés.
+
+Le texte est normalisé en tokens (minuscules, NFKC, mots \\w+), chaque
+k-gramme de tokens reçoit un hachage roulant (token_vocab), et seule la
+plus petite empreinte de chaque fenêtre de w k-grammes est conservée. Tout
+passage commun d'au moins k + w - 1 tokens partage donc au moins une
+empreinte.
+
+Les empreintes des documents stockés sont dans une table SQLite inversée
+hash -> (document, position), indexée sur le hash : une recherche coûte le
+nombre d'empreintes de la soumission, pas la taille du corpus. Les
+empreintes banales (présentes dans plus de MAX_POSTINGS documents) sont
+ignorées pour que ce coût reste borné quand le corpus grandit : le nombre
+de documents de chaque empreinte est tenu à jour dans wn_hash_counts à
+chaque ajout ou retrait, et leurs listes ne sont jamais lues. Les
+correspondances sont ensuite regroupées par diagonale en passages alignés
+(positions dans la soumission et dans la source).
+
+L'index contient le corpus de référence (clés 'reference:<fichier>') et
+chaque soumission analysée (clés 'submission:<id>', avec l'utilisateur et
+la date de dépôt) : les soumissions suivantes sont comparées aux précédentes
+des autres utilisateurs (jamais aux leurs, ni aux dépôts plus récents). Le
+titre d'une soumission est anonyme (submission_title) : le nom du fichier
+d'un autre étudiant n'apparaît jamais dans un rapport.
+
+    python -m winnowing        # indexe le corpus de référence
+"""
+import os
+import time
+import sqlite3
+import logging
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from text_segmentation import segment_document
+from token_vocab import get_token_vocabulary
+
+K_GRAM = 5        # Même taille que TurnitinStyleDetector._generate_ngrams
+WINDOW = 4        # Garantie : tout passage commun de K_GRAM + WINDOW - 1 = 8 tokens est détecté
+DB_PATH = os.path.join('plagiarism_cache', 'winnowing.db')
+MAX_POSTINGS = 200  # Au-delà, une empreinte (formule consacrée, modèle de page) n'est plus une graine
+
+_QUERY_BATCH = 400   # Deux fois par requête : reste sous la limite de 999 paramètres SQLite
+
+
+def tokenize(text: str) -> List[Tuple[str, int, int]]:
+    """Tokens normalisés avec leur position (début, fin) dans le texte d'origine"""
+    return segment_document(text).token_spans()
+
+
+def kgram_hashes(tokens: List[Tuple[str, int, int]], k: int = K_GRAM) -> List[int]:
+    """Hachage roulant (Rabin-Karp) de chaque k-gramme de tokens (token_vocab)"""
+    vocabulary = get_token_vocabulary()
+    return vocabulary.ngram_hashes(vocabulary.encode(token for token, _, _ in tokens), k).tolist()
+
+
+def winnow(hashes: List[int], window: int = WINDOW) -> List[Tuple[int, int]]:
+    """
+    Empreintes retenues (hash, position du k-gramme) : minimum de chaque
+    fenêtre, le plus à droite en cas d'égalité, sans doublon consécutif.
+    """
+    if not hashes:
+        return []
+    if len(hashes) <= window:
+        position = min(range(len(hashes)), key=lambda i: (hashes[i], -i))
+        return [(hashes[position], position)]
+
+    selected = []
+    last = -1
+    for start in range(len(hashes) - window + 1):
+        if last < start:
+            # L'ancien minimum est sorti de la fenêtre : rechercher le nouveau
+            last = start
+            for i in range(start + 1, start + window):
+                if hashes[i] <= hashes[last]:
+                    last = i
+            selected.append((hashes[last], last))
+        else:
+            newest = start + window - 1
+            if hashes[newest] <= hashes[last]:
+                last = newest
+                selected.append((hashes[last], last))
+    return selected
+
+
+SUBMISSION_PREFIX = 'submission:'
+
+
+def submission_key(document_id: int) -> str:
+    """Clé d'index d'un document soumis (models.Document)"""
+    return f'{SUBMISSION_PREFIX}{document_id}'
+
+
+def submission_title(document_id, uploaded_at: Optional[str] = None) -> str:
+    """Libellé anonyme d'une soumission indexée : numéro et date de dépôt, sans nom de fichier"""
+    title = f'Prior submission #{document_id}'
+    return f'{title}, {uploaded_at[:10]}' if uploaded_at else title
+
+
+def fingerprint(text: str, k: int = K_GRAM, window: int = WINDOW) -> List[Tuple[int, int, int, int]]:
+    """Empreintes du texte : (hash, position du k-gramme en tokens, début, fin en caractères)"""
+    document = segment_document(text)
+    starts, ends = document.token_starts, document.token_ends
+    return [(h, position, int(starts[position]), int(ends[position + k - 1]))
+            for h, position in winnow(document.ngram_hashes(k).tolist(), window)]
+
+
+class WinnowingIndex:
+    """Index inversé des empreintes des documents stockés (SQLite)"""
+
+    def __init__(self, db_path: str = DB_PATH, k: int = K_GRAM, window: int = WINDOW):
+        self.db_path = db_path
+        self.k = k
+        self.window = window
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._init_database()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path)
+
+    def _init_database(self):
+        with self._connect() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS wn_documents (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    doc_key TEXT UNIQUE NOT NULL,
+                    title TEXT,
+                    content_hash TEXT,
+                    content TEXT,
+                    token_count INTEGER,
+                    created_at TEXT,
+                    user_id TEXT,
+                    uploaded_at TEXT
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS wn_fingerprints (
+                    hash INTEGER NOT NULL,
+                    document_id INTEGER NOT NULL,
+                    token_pos INTEGER NOT NULL,
+                    char_start INTEGER NOT NULL,
+                    char_end INTEGER NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_wn_fingerprints_hash ON wn_fingerprints(hash)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_wn_fingerprints_doc ON wn_fingerprints(document_id)')
+            # Nombre de documents distincts par empreinte (filtre MAX_POSTINGS)
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS wn_hash_counts (
+                    hash INTEGER PRIMARY KEY,
+                    documents INTEGER NOT NULL
+                )
+            ''')
+
+    def document_hash(self, doc_key: str) -> Optional[str]:
+        with self._connect() as conn:
+            row = conn.execute('SELECT content_hash FROM wn_documents WHERE doc_key = ?', (doc_key,)).fetchone()
+        return row[0] if row else None
+
+    def add_document(self, doc_key: str, text: str, title: Optional[str] = None,
+                     content_hash: Optional[str] = None, user_id: Optional[str] = None,
+                     uploaded_at: Optional[str] = None) -> int:
+        """Indexe (ou ré-indexe) un document; renvoie le nombre d'empreintes stockées"""
+        prints = fingerprint(text, self.k, self.window)
+        with self._connect() as conn:
+            self._delete(conn, doc_key)
+            cursor = conn.execute(
+                'INSERT INTO wn_documents (doc_key, title, content_hash, content, token_count, created_at, '
+                'user_id, uploaded_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (doc_key, title or doc_key, content_hash, text, len(tokenize(text)), datetime.now().isoformat(),
+                 user_id, uploaded_at)
+            )
+            document_id = cursor.lastrowid
+            conn.executemany(
+                'INSERT INTO wn_fingerprints (hash, document_id, token_pos, char_start, char_end) '
+                'VALUES (?, ?, ?, ?, ?)',
+                [(h, document_id, position, start, end) for h, position, start, end in prints]
+            )
+            conn.executemany(
+                'INSERT INTO wn_hash_counts (hash, documents) VALUES (?, 1) '
+                'ON CONFLICT(hash) DO UPDATE SET documents = documents + 1',
+                [(h,) for h in {h for h, _, _, _ in prints}]
+            )
+        return len(prints)
+
+    def document_keys(self, prefix: str = '') -> List[str]:
+        """Clés des documents indexés commençant par prefix"""
+        with self._connect() as conn:
+            return [row[0] for row in conn.execute(
+                'SELECT doc_key FROM wn_documents WHERE substr(doc_key, 1, ?) = ?', (len(prefix), prefix))]
+
+    def remove_document(self, doc_key: str) -> None:
+        with self._connect() as conn:
+            self._delete(conn, doc_key)
+
+    @staticmethod
+    def _delete(conn: sqlite3.Connection, doc_key: str) -> None:
+        row = conn.execute('SELECT id FROM wn_documents WHERE doc_key = ?', (doc_key,)).fetchone()
+        if row:
+            conn.execute('UPDATE wn_hash_counts SET documents = documents - 1 WHERE hash IN ('
+                         'SELECT DISTINCT hash FROM wn_fingerprints WHERE document_id = ?)', (row[0],))
+            conn.execute('DELETE FROM wn_hash_counts WHERE documents <= 0')
+            conn.execute('DELETE FROM wn_fingerprints WHERE document_id = ?', (row[0],))
+            conn.execute('DELETE FROM wn_documents WHERE id = ?', (row[0],))
+
+    def _lookup(self, conn: sqlite3.Connection, hashes: List[int]) -> List[Tuple[int, int, int, int, int]]:
+        """Entrées des empreintes présentes dans au plus MAX_POSTINGS documents"""
+        rows = []
+        for i in range(0, len(hashes), _QUERY_BATCH):
+            batch = hashes[i:i + _QUERY_BATCH]
+            placeholders = ','.join('?' * len(batch))
+            rows.extend(conn.execute(
+                f'SELECT f.hash, f.document_id, f.token_pos, f.char_start, f.char_end '
+                f'FROM wn_hash_counts c JOIN wn_fingerprints f ON f.hash = c.hash '
+                f'WHERE c.hash IN ({placeholders}) AND c.documents <= ?', batch + [MAX_POSTINGS]
+            ).fetchall())
+        return rows
+
+    @staticmethod
+    def _excluded_documents(conn: sqlite3.Connection, document_ids: List[int], exclude_keys: Iterable[str] = (),
+                            user_id=None, uploaded_before: Optional[str] = None) -> set:
+        """
+        Documents écartés parmi les candidats document_ids : clés données,
+        soumissions du même utilisateur (brouillons successifs) et soumissions
+        déposées après uploaded_before (date ISO). Le corpus de référence n'est
+        jamais écarté par ces deux derniers critères. Seuls les candidats sont
+        lus (clé primaire) : le coût ne dépend pas du nombre de soumissions.
+        """
+        conditions, params = [], []
+        exclude_keys = list(exclude_keys)
+        if exclude_keys:
+            conditions.append(f"doc_key IN ({','.join('?' * len(exclude_keys))})")
+            params.extend(exclude_keys)
+        if user_id is not None:
+            conditions.append('(substr(doc_key, 1, ?) = ? AND user_id = ?)')
+            params.extend([len(SUBMISSION_PREFIX), SUBMISSION_PREFIX, str(user_id)])
+        if uploaded_before:
+            conditions.append('(substr(doc_key, 1, ?) = ? AND uploaded_at > ?)')
+            params.extend([len(SUBMISSION_PREFIX), SUBMISSION_PREFIX, uploaded_before])
+        if not conditions:
+            return set()
+        excluded = set()
+        for i in range(0, len(document_ids), _QUERY_BATCH):
+            batch = document_ids[i:i + _QUERY_BATCH]
+            excluded.update(row[0] for row in conn.execute(
+                f"SELECT id FROM wn_documents WHERE id IN ({','.join('?' * len(batch))}) "
+                f"AND ({' OR '.join(conditions)})", batch + params))
+        return excluded
+
+    def _seed_hits(self, conn: sqlite3.Connection, prints: List[Tuple[int, int, int, int]],
+                   exclude_keys: Iterable[str] = (), user_id=None,
+                   uploaded_before: Optional[str] = None) -> Dict[int, List[Tuple[int, int, int, int, int, int]]]:
+        """Empreintes communes par document : (position soumission, position source, caractères...)"""
+        by_hash = {}
+        for h, position, start, end in prints:
+            by_hash.setdefault(h, []).append((position, start, end))
+
+        rows = self._lookup(conn, list(by_hash))
+        excluded = self._excluded_documents(conn, sorted({row[1] for row in rows}), exclude_keys,
+                                            user_id, uploaded_before)
+
+        hits = {}
+        for h, document_id, src_pos, src_start, src_end in rows:
+            if document_id in excluded:
+                continue
+            for sub_pos, sub_start, sub_end in by_hash[h]:
+                hits.setdefault(document_id, []).append(
+                    (sub_pos, src_pos, sub_start, sub_end, src_start, src_end))
+        return hits
+
+    def find_seeds(self, text: str, exclude_keys: Iterable[str] = (), user_id=None,
+                   uploaded_before: Optional[str] = None) -> Dict[int, List[Tuple[int, int, int, int, int, int]]]:
+        """
+        Graines d'alignement : empreintes du texte retrouvées dans chaque
+        document indexé, hors documents écartés (voir _excluded_documents)
+        """
+        prints = fingerprint(text, self.k, self.window)
+        if not prints:
+            return {}
+        with self._connect() as conn:
+            return self._seed_hits(conn, prints, exclude_keys, user_id, uploaded_before)
+
+    def documents_info(self, document_ids: Iterable[int]) -> Dict[int, Tuple[str, str, int]]:
+        """(doc_key, titre, longueur en caractères) des documents, sans lire leur contenu"""
+        document_ids = sorted(set(document_ids))
+        if not document_ids:
+            return {}
+        placeholders = ','.join('?' * len(document_ids))
+        with self._connect() as conn:
+            return {document_id: (doc_key, title, length) for document_id, doc_key, title, length in conn.execute(
+                f'SELECT id, doc_key, title, length(content) FROM wn_documents WHERE id IN ({placeholders})',
+                document_ids)}
+
+    def find_matches(self, text: str, exclude_keys: Iterable[str] = (),
+                     min_tokens: Optional[int] = None, max_shift: int = 2, user_id=None,
+                     uploaded_before: Optional[str] = None) -> List[Dict]:
+        """
+        Passages du texte présents dans les documents indexés, alignés avec la
+        source. Les empreintes communes sont regroupées quand elles se suivent
+        dans la soumission sur (presque) la même diagonale source - soumission.
+        """
+        prints = fingerprint(text, self.k, self.window)
+        if not prints:
+            return []
+        min_tokens = min_tokens or self.k + self.window - 1
+
+        with self._connect() as conn:
+            # Correspondances (document, position soumission, position source)
+            hits = self._seed_hits(conn, prints, exclude_keys, user_id, uploaded_before)
+
+            spans = []
+            for document_id, doc_hits in hits.items():
+                for span in self._align(doc_hits, max_shift):
+                    if span['tokens'] >= min_tokens:
+                        span['document_id'] = document_id
+                        spans.append(span)
+            if not spans:
+                return []
+
+            titles = {}
+            document_ids = sorted({span['document_id'] for span in spans})
+            placeholders = ','.join('?' * len(document_ids))
+            for document_id, doc_key, title in conn.execute(
+                    f'SELECT id, doc_key, title FROM wn_documents WHERE id IN ({placeholders})', document_ids):
+                titles[document_id] = (doc_key, title)
+
+        for span in spans:
+            span['doc_key'], span['title'] = titles.get(span['document_id'], (None, None))
+        spans.sort(key=lambda s: (s['start'], -s['tokens']))
+        return spans
+
+    def _align(self, hits: List[Tuple[int, int, int, int, int, int]], max_shift: int) -> List[Dict]:
+        """Regroupe les correspondances d'un document en passages alignés"""
+        gap = self.k + self.window
+        hits.sort()
+        open_spans = []
+        for sub_pos, src_pos, sub_start, sub_end, src_start, src_end in hits:
+            diagonal = src_pos - sub_pos
+            target = None
+            for span in open_spans:
+                if (sub_pos - span['last_sub'] <= gap and abs(diagonal - span['diagonal']) <= max_shift
+                        and src_pos >= span['last_src']):
+                    target = span
+                    break
+            if target is None:
+                open_spans.append({
+                    'first_sub': sub_pos, 'last_sub': sub_pos, 'first_src': src_pos, 'last_src': src_pos,
+                    'start': sub_start, 'end': sub_end, 'source_start': src_start, 'source_end': src_end,
+                    'diagonal': diagonal, 'fingerprints': 1,
+                })
+            else:
+                target['last_sub'] = sub_pos
+                target['last_src'] = src_pos
+                target['end'] = max(target['end'], sub_end)
+                target['source_end'] = max(target['source_end'], src_end)
+                target['diagonal'] = diagonal
+                target['fingerprints'] += 1
+
+        return [{
+            'start': span['start'],
+            'end': span['end'],
+            'source_start': span['source_start'],
+            'source_end': span['source_end'],
+            'tokens': span['last_sub'] - span['first_sub'] + self.k,
+            'fingerprints': span['fingerprints'],
+        } for span in open_spans]
+
+    def source_excerpt(self, document_id: int, start: int, end: int) -> str:
+        with self._connect() as conn:
+            row = conn.execute('SELECT substr(content, ?, ?) FROM wn_documents WHERE id = ?',
+                               (start + 1, end - start, document_id)).fetchone()
+        return row[0] if row else ""
+
+
+def matched_length(spans: List[Dict]) -> int:
+    """Nombre de caractères de la soumission couverts par au moins un passage"""
+    covered = 0
+    current_start = current_end = -1
+    for span in sorted(spans, key=lambda s: s['start']):
+        if span['start'] > current_end:
+            covered += max(0, current_end - current_start)
+            current_start, current_end = span['start'], span['end']
+        else:
+            current_end = max(current_end, span['end'])
+    covered += max(0, current_end - current_start)
+    return covered
+
+
+def sync_reference_corpus(index: 'WinnowingIndex', reference_dir: Optional[str] = None) -> int:
+    """
+    Indexe les fichiers du corpus de référence nouveaux ou modifiés et retire
+    ceux qui ont été supprimés; renvoie le nombre de fichiers indexés
+    """
+    from corpus_extraction import file_sha256, extract_corpus_text, is_supported
+    from reference_index import REFERENCE_DIR
+
+    reference_dir = reference_dir or REFERENCE_DIR
+    if not os.path.isdir(reference_dir):
+        return 0
+    updated = 0
+    present = set()
+    for fname in sorted(os.listdir(reference_dir)):
+        path = os.path.join(reference_dir, fname)
+        if not os.path.isfile(path) or not is_supported(path):
+            continue
+        present.add(f'reference:{fname}')
+        try:
+            sha256 = file_sha256(path)
+            doc_key = f'reference:{fname}'
+            if index.document_hash(doc_key) == sha256:
+                continue
+            index.add_document(doc_key, extract_corpus_text(path, sha256), title=fname, content_hash=sha256)
+            updated += 1
+        except Exception as e:
+            logging.error(f"Error fingerprinting reference file {fname}: {e}")
+
+    removed = [doc_key for doc_key in index.document_keys('reference:') if doc_key not in present]
+    for doc_key in removed:
+        index.remove_document(doc_key)
+    if updated or removed:
+        logging.info(f"🔎 Winnowing : {updated} fichiers de référence indexés, {len(removed)} retirés")
+    return updated
+
+
+_winnowing_index = None
+_reference_state = {'checked_at': None, 'corpus': None}
+
+
+def _corpus_stamp(reference_dir: str) -> Dict[str, Tuple[int, float]]:
+    from reference_index import _list_corpus
+    return {fname: (stat.st_size, stat.st_mtime) for fname, stat in _list_corpus(reference_dir).items()}
+
+
+def get_winnowing_index() -> WinnowingIndex:
+    """
+    Index partagé du processus. Comme load_reference_index, le corpus de
+    référence est re-vérifié (stat des fichiers) au plus toutes les
+    CHECK_INTERVAL_SECONDS et resynchronisé seulement s'il a changé.
+    """
+    global _winnowing_index
+    from reference_index import CHECK_INTERVAL_SECONDS, REFERENCE_DIR
+
+    if _winnowing_index is None:
+        _winnowing_index = WinnowingIndex()
+    now = time.monotonic()
+    checked_at = _reference_state['checked_at']
+    if checked_at is None or now - checked_at >= CHECK_INTERVAL_SECONDS:
+        _reference_state['checked_at'] = now
+        corpus = _corpus_stamp(REFERENCE_DIR)
+        if corpus != _reference_state['corpus']:
+            sync_reference_corpus(_winnowing_index)
+            _reference_state['corpus'] = corpus
+    return _winnowing_index
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    count = sync_reference_corpus(WinnowingIndex())
+    print(f"{count} fichiers de référence indexés")